@@ -0,0 +1,201 @@
+"""
+结果文件（MIDI / MusicXML）的下载分发。
+
+任务完成时 precompress_results() 为结果文件生成预压缩副本（result.musicxml.gz，安装 brotli 时
+另有 .br），MusicXML 通常可压缩到原来的 1/10 以下；下载时按 Accept-Encoding 选择副本，
+不在请求中实时压缩。任务完成后结果不再变化，响应带强 ETag 与 Cache-Control: immutable，
+Range / If-Range 由 FileResponse 处理（作用于所选的编码副本）。
+ArtifactIndex 在内存中缓存已完成任务的结果路径，重复下载不查数据库。
+"""
+import gzip
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from fastapi.responses import FileResponse, Response
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+try:
+    from .config import DOWNLOAD_INDEX_ENTRIES, RESULT_PRECOMPRESS
+except ImportError:
+    from backend.config import DOWNLOAD_INDEX_ENTRIES, RESULT_PRECOMPRESS
+
+# 编码 -> 副本后缀，按优先级排列（q 值相同时优先 br）
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+# 压缩后不小于原文件该比例时不保留副本（MIDI 本身已很紧凑）
+MIN_COMPRESSION_RATIO = 0.9
+# brotli 11 级在 MB 级的 MusicXML 上需要数秒，9 级压缩率接近且快得多
+BROTLI_QUALITY = 9
+
+MEDIA_TYPES = {
+    "mid": "audio/midi",
+    "musicxml": "application/vnd.recordare.musicxml+xml",
+}
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def _compressors():
+    yield "gzip", lambda data: gzip.compress(data, compresslevel=9, mtime=0)
+    if BROTLI_AVAILABLE:
+        yield "br", lambda data: brotli.compress(data, quality=BROTLI_QUALITY)
+
+
+def precompress(path) -> list:
+    """为单个文件生成预压缩副本，返回生成的编码；先写临时文件再替换，读者不会看到半个文件"""
+    path = Path(path)
+    data = path.read_bytes()
+    created = []
+    for encoding, compress in _compressors():
+        target = path.with_name(path.name + ENCODINGS[encoding])
+        compressed = compress(data)
+        if len(compressed) >= len(data) * MIN_COMPRESSION_RATIO:
+            target.unlink(missing_ok=True)
+            continue
+        part = target.with_name(target.name + ".part")
+        part.write_bytes(compressed)
+        os.replace(part, target)
+        created.append(encoding)
+    return created
+
+
+def precompress_results(*paths):
+    """任务完成时调用；失败不影响任务结果，下载时退回未压缩的原文件"""
+    if not RESULT_PRECOMPRESS:
+        return
+    for path in paths:
+        if not path:
+            continue
+        try:
+            precompress(path)
+        except OSError as e:
+            print(f"[artifacts] precompress failed {path}: {e}")
+
+
+def compressed_siblings(path):
+    """已存在的预压缩副本路径"""
+    path = Path(path)
+    return [s for s in (path.with_name(path.name + suffix) for suffix in ENCODINGS.values()) if s.exists()]
+
+
+def promote(source, target):
+    """
+    用 source 及其预压缩副本整体替换 target（os.replace，同一文件系统内为原子操作）；
+    source 没有的编码副本从 target 一侧删除，不留下上一次结果的旧副本。
+    """
+    source, target = Path(source), Path(target)
+    for suffix in ENCODINGS.values():
+        sibling = source.with_name(source.name + suffix)
+        if sibling.exists():
+            os.replace(sibling, target.with_name(target.name + suffix))
+        else:
+            target.with_name(target.name + suffix).unlink(missing_ok=True)
+    os.replace(source, target)
+
+
+def parse_accept_encoding(header: str) -> dict:
+    """Accept-Encoding -> {编码: q 值}"""
+    accepted = {}
+    for item in (header or "").split(","):
+        parts = item.strip().split(";")
+        name = parts[0].strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            key, _, value = param.strip().partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+def choose_variant(path, accept_encoding: str):
+    """返回 (文件路径, stat, 编码)；编码为 None 表示原文件。原文件不存在时抛出 FileNotFoundError"""
+    path = Path(path)
+    original = os.stat(path)
+    accepted = parse_accept_encoding(accept_encoding)
+    best, best_q = (path, original, None), accepted.get("identity", accepted.get("*", 1.0))
+    for encoding, suffix in ENCODINGS.items():
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q <= 0 or q < best_q or (q == best_q and best[2] is not None):
+            continue
+        candidate = path.with_name(path.name + suffix)
+        try:
+            best, best_q = (candidate, os.stat(candidate), encoding), q
+        except FileNotFoundError:
+            continue
+    return best
+
+
+def _strong_etag(stat_result, encoding) -> str:
+    # 结果文件只会整体替换，不会原地修改：inode + mtime + 大小可以唯一确定内容
+    return f'"{stat_result.st_ino:x}-{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}-{encoding or "identity"}"'
+
+
+def artifact_response(path, filename: str, ext: str, accept_encoding: str = None,
+                      if_none_match: str = None, immutable: bool = True) -> Response:
+    """结果文件的下载响应；原文件不存在时抛出 FileNotFoundError"""
+    served, stat_result, encoding = choose_variant(path, accept_encoding)
+    etag = _strong_etag(stat_result, encoding)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": IMMUTABLE if immutable else "no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    if if_none_match and (etag in {t.strip() for t in if_none_match.split(",")} or if_none_match.strip() == "*"):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return FileResponse(
+        served,
+        headers=headers,
+        media_type=MEDIA_TYPES.get(ext),
+        filename=filename,
+        stat_result=stat_result,
+    )
+
+
+class ArtifactIndex:
+    """已完成任务的结果路径 LRU（task_id -> {ext: path}）；结果不再变化，无需失效，只按容量淘汰"""
+
+    def __init__(self, max_entries: int = DOWNLOAD_INDEX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, task_id: str):
+        with self._lock:
+            paths = self._entries.get(task_id)
+            if paths is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(task_id)
+            self.hits += 1
+            return paths
+
+    def put(self, task_id: str, paths: dict):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[task_id] = paths
+            self._entries.move_to_end(task_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, task_id: str):
+        with self._lock:
+            self._entries.pop(task_id, None)
+
+
+artifact_index = ArtifactIndex()
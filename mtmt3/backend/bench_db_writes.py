@@ -0,0 +1,104 @@
+"""
+进度写入基准：多个线程模拟 worker 的进度回调（每次回调一个新会话），对比
+- direct-delete：回滚日志模式，每次回调一个写事务（原行为）
+- direct-wal：WAL 模式，每次回调一个写事务
+- coalesced：WAL 模式，回调只读检查租约，写入由 ProgressWriter 合并批量提交
+
+    python -m backend.bench_db_writes --threads 16 --tasks 64 --seconds 5
+"""
+import argparse
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+try:
+    from .db import Base, Task, make_engine, renew_lease, lease_status
+    from .progress_writer import ProgressWriter
+except ImportError:
+    from backend.db import Base, Task, make_engine, renew_lease, lease_status
+    from backend.progress_writer import ProgressWriter
+
+MODES = ("direct-delete", "direct-wal", "coalesced")
+
+
+def _setup(path: Path, wal: bool, tasks: int):
+    engine = make_engine(f"sqlite:///{path}", wal=wal)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine, autoflush=False)
+    with Session() as db:
+        expires = datetime.utcnow() + timedelta(hours=1)
+        for i in range(tasks):
+            db.add(Task(id=f"t{i}", status="processing", input_path="x", worker_id=f"w{i}",
+                        lease_expires_at=expires))
+        db.commit()
+    return engine, Session
+
+
+def run(mode: str, threads: int, tasks: int, seconds: float, interval: float) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine, Session = _setup(Path(tmp) / "bench.sqlite3", wal=mode != "direct-delete", tasks=tasks)
+        writer = ProgressWriter(engine, interval=interval) if mode == "coalesced" else None
+        counts = [0] * threads
+        errors = [0] * threads
+        deadline = time.perf_counter() + seconds
+
+        def loop(n: int):
+            i = n
+            while time.perf_counter() < deadline:
+                task_id, worker_id = f"t{i % tasks}", f"w{i % tasks}"
+                progress = (counts[n] % 100) / 100
+                db = Session()
+                try:
+                    if writer is not None:
+                        if lease_status(db, task_id, worker_id) == "ok":
+                            writer.submit(task_id, worker_id, progress)
+                    else:
+                        renew_lease(db, task_id, worker_id, progress=progress)
+                    counts[n] += 1
+                except OperationalError:
+                    db.rollback()
+                    errors[n] += 1
+                finally:
+                    db.close()
+                i += threads
+
+        pool = [threading.Thread(target=loop, args=(n,)) for n in range(threads)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        if writer is not None:
+            writer.flush()
+        engine.dispose()
+
+    updates = sum(counts)
+    return {
+        "mode": mode,
+        "updates_per_sec": updates / seconds,
+        "lock_errors": sum(errors),
+        "write_transactions": writer.counters["batches"] if writer else updates,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite 进度写入基准")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--tasks", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--interval", type=float, default=0.5, help="coalesced 模式的合并间隔（秒）")
+    parser.add_argument("--modes", default=",".join(MODES))
+    args = parser.parse_args()
+
+    print(f"{'mode':<14} {'updates/s':>10} {'lock errors':>12} {'write txns':>11}")
+    for mode in args.modes.split(","):
+        r = run(mode.strip(), args.threads, args.tasks, args.seconds, args.interval)
+        print(f"{r['mode']:<14} {r['updates_per_sec']:>10.0f} {r['lock_errors']:>12} {r['write_transactions']:>11}")
+
+
+if __name__ == "__main__":
+    main()
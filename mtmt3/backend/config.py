@@ -1,3 +1,4 @@
+import importlib.util
 import os
 from pathlib import Path
 
@@ -14,3 +15,104 @@ DATABASE_URL = f"sqlite:///{BASE_DIR / 'db.sqlite3'}"
 
 # 远程 worker 鉴权令牌（云端与本地 GPU worker 保持一致）
 WORKER_TOKEN = os.getenv("WORKER_TOKEN", "change-me")
+
+# 管理接口令牌（结果缓存清理、/api/workers 等）；未设置时管理接口不可用，
+# 不与 WORKER_TOKEN 共用默认值，避免只配置了 worker 令牌的部署暴露管理接口
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# 结果缓存：相同音频 + 相同参数直接复用已有的 MIDI/MusicXML
+RESULT_CACHE_DIR = RESULT_DIR / "_cache"
+RESULT_CACHE_MAX_BYTES = int(float(os.getenv("RESULT_CACHE_MAX_MB", "2048")) * 1024 * 1024)
+# 模型版本号参与缓存键；升级模型后修改此值，旧结果不会再被命中
+MODEL_VERSION = os.getenv("MTMT3_MODEL_VERSION", "mr_mt3-1")
+# 未安装 mt3_infer 时 worker 以模拟模式运行，模拟结果不进入结果缓存，该标志也参与缓存键
+TRANSCRIBER_MOCK = importlib.util.find_spec("mt3_infer") is None
+
+# 本地 worker 流水线模式：推理与 MusicXML 后处理并行
+WORKER_PIPELINE = os.getenv("WORKER_PIPELINE", "0") == "1"
+WORKER_INFERENCE_SLOTS = int(os.getenv("WORKER_INFERENCE_SLOTS", "1"))
+WORKER_POSTPROCESS_PROCESSES = int(os.getenv("WORKER_POSTPROCESS_PROCESSES", "2"))
+# 等待后处理的任务上限，超过后暂停领取新任务
+WORKER_MAX_PENDING_POSTPROCESS = int(os.getenv("WORKER_MAX_PENDING_POSTPROCESS", str(WORKER_POSTPROCESS_PROCESSES * 2)))
+
+# supervisor：本地多进程 worker 与多进程 API
+# WORKER_PROCESSES / WORKER_THREADS 为 0 时按机器核心数推算（见 mtmt3_core/cpu_affinity.py）
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0"))
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "0"))
+# 不分配给 worker 的核心数，留给 API 与后处理进程
+WORKER_RESERVED_CORES = int(os.getenv("WORKER_RESERVED_CORES", "0"))
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("API_PORT", "8000"))
+API_WORKERS = int(os.getenv("API_WORKERS", "2"))
+# 单独运行 uvicorn 时 API 进程自己建表/补列并运行租约回收线程；
+# supervisor 启动多进程 API 时把两者都设为 0，由 supervisor 进程各做一次
+API_INIT_DB = os.getenv("API_INIT_DB", "1") == "1"
+API_LEASE_REAPER = os.getenv("API_LEASE_REAPER", "1") == "1"
+
+# 任务租约：领取时写入 worker_id 与到期时间，进度上报/心跳续约；
+# 到期未续约的任务由回收线程（API 进程内，或 supervisor 进程内）重新排队，超过重试次数后标记失败
+TASK_LEASE_SECONDS = float(os.getenv("TASK_LEASE_SECONDS", "120"))
+TASK_MAX_ATTEMPTS = int(os.getenv("TASK_MAX_ATTEMPTS", "3"))
+LEASE_REAPER_INTERVAL = float(os.getenv("LEASE_REAPER_INTERVAL", "15"))
+
+# 空闲 worker 等待新任务通知（见 notify.py），超时后查询一次数据库作为兜底
+WORKER_IDLE_POLL_SECONDS = float(os.getenv("WORKER_IDLE_POLL_SECONDS", "30"))
+# 远程 worker 长轮询领取任务时，服务端最多挂起请求的秒数
+CLAIM_MAX_WAIT_SECONDS = float(os.getenv("CLAIM_MAX_WAIT_SECONDS", "30"))
+
+# 短音频批量推理：一次领取多个 model/mode/precision 相同的任务，分段混合打包进同一模型批次
+# 本地 worker 每次领取的任务数（1 表示逐个处理）
+WORKER_BATCH_TASKS = int(os.getenv("WORKER_BATCH_TASKS", "1"))
+# 远程 worker 批量领取时，服务端单次最多返回的任务数
+CLAIM_MAX_BATCH = int(os.getenv("CLAIM_MAX_BATCH", "16"))
+
+# worker 能力登记与路由：worker 定期上报设备、已加载模型、槽位与实测速度，
+# 领取时优先分配已加载所需模型的任务，长音频优先交给 GPU worker、短音频优先交给 CPU worker
+WORKER_REGISTER_SECONDS = float(os.getenv("WORKER_REGISTER_SECONDS", "30"))
+# 超过该秒数未上报的 worker 视为离线
+WORKER_STALE_SECONDS = float(os.getenv("WORKER_STALE_SECONDS", "90"))
+# 不短于该秒数的音频视为长音频
+ROUTE_LONG_AUDIO_SECONDS = float(os.getenv("ROUTE_LONG_AUDIO_SECONDS", "120"))
+# 任务排队超过该秒数后不再挑选 worker，任何 worker 都优先领取（防止饿死）
+ROUTE_MAX_DELAY_SECONDS = float(os.getenv("ROUTE_MAX_DELAY_SECONDS", "60"))
+
+# 上传大小上限（MB）：音频由 POST /api/tasks 上传，结果文件由远程 worker 回传；0 表示不限制
+MAX_UPLOAD_MB = float(os.getenv("MAX_UPLOAD_MB", "200"))
+MAX_RESULT_MB = float(os.getenv("MAX_RESULT_MB", "50"))
+# 批量提交（POST /api/batches）：整个请求体（或压缩包解出的总量）上限与单批最多文件数
+MAX_BATCH_UPLOAD_MB = float(os.getenv("MAX_BATCH_UPLOAD_MB", "2048"))
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "500"))
+
+# SQLite：WAL 模式下读不阻塞写；busy_timeout 让写锁冲突时等待而不是立即报 "database is locked"
+SQLITE_WAL = os.getenv("SQLITE_WAL", "1") == "1"
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_MB = float(os.getenv("SQLITE_CACHE_MB", "16"))
+# 进度与续约写入的合并间隔（秒）：每个进程由一个写线程定期批量提交，0 表示立即写入
+PROGRESS_WRITE_INTERVAL = float(os.getenv("PROGRESS_WRITE_INTERVAL", "0.5"))
+
+# 前端进度推送（SSE）：无变化时每隔该秒数发送一次保活注释，并重新读取一次任务状态兜底
+EVENTS_KEEPALIVE_SECONDS = float(os.getenv("EVENTS_KEEPALIVE_SECONDS", "15"))
+# 一条推送连接最多订阅的任务数
+EVENTS_MAX_TASKS = int(os.getenv("EVENTS_MAX_TASKS", "50"))
+
+# 批量状态查询（GET /api/tasks）一次最多返回的任务数
+STATUS_QUERY_MAX_TASKS = int(os.getenv("STATUS_QUERY_MAX_TASKS", "500"))
+
+# 结果下载：完成时为结果文件生成预压缩副本（.gz；安装 brotli 时另有 .br），下载时按 Accept-Encoding 选择
+RESULT_PRECOMPRESS = os.getenv("RESULT_PRECOMPRESS", "1") == "1"
+# 下载接口在内存中缓存的已完成任务结果路径条数（命中时不查数据库）
+DOWNLOAD_INDEX_ENTRIES = int(os.getenv("DOWNLOAD_INDEX_ENTRIES", "4096"))
+
+# 文件存储：local 为 DATA_DIR 下的 UPLOAD_DIR / RESULT_DIR（远程 worker 经由 API 传输）；
+# s3 为 S3 兼容的对象存储（AWS S3、MinIO 等，路径风格访问），远程 worker 凭领取时下发的签名 URL
+# 直接与存储传输输入音频和结果文件，API 本地仍保留一份用于本地 worker 与结果下载
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+S3_ENDPOINT = os.getenv("S3_ENDPOINT", "")
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_ACCESS_KEY = os.getenv("S3_ACCESS_KEY", "")
+S3_SECRET_KEY = os.getenv("S3_SECRET_KEY", "")
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+S3_PREFIX = os.getenv("S3_PREFIX", "")
+# 签名 URL 的有效期（秒）
+STORAGE_URL_EXPIRES = int(os.getenv("STORAGE_URL_EXPIRES", "900"))
@@ -1,22 +1,53 @@
-from datetime import datetime
+import random
+import time
+from datetime import datetime, timedelta
 from sqlalchemy import (
-    create_engine, Column, String, DateTime, Float, Text
+    create_engine, event, inspect, text, select, update, func, and_, or_, case,
+    Column, String, DateTime, Float, Integer, Text, Index
 )
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import declarative_base, sessionmaker, Session
 
 try:
-    from .config import DATABASE_URL
+    from .config import (
+        DATABASE_URL, TASK_LEASE_SECONDS, TASK_MAX_ATTEMPTS, LEASE_REAPER_INTERVAL,
+        WORKER_STALE_SECONDS, ROUTE_LONG_AUDIO_SECONDS, ROUTE_MAX_DELAY_SECONDS,
+        SQLITE_WAL, SQLITE_SYNCHRONOUS, SQLITE_BUSY_TIMEOUT_MS, SQLITE_CACHE_MB,
+    )
+    from .mtmt3_core.model_registry import model_aliases
 except ImportError:
-    from backend.config import DATABASE_URL
-
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False},
-    pool_size=20,  # 增加连接池大小
-    max_overflow=40,  # 允许的额外连接数
-    pool_timeout=30,  # 连接超时时间
-    pool_recycle=3600,  # 连接回收时间（秒）
-)
+    from backend.config import (
+        DATABASE_URL, TASK_LEASE_SECONDS, TASK_MAX_ATTEMPTS, LEASE_REAPER_INTERVAL,
+        WORKER_STALE_SECONDS, ROUTE_LONG_AUDIO_SECONDS, ROUTE_MAX_DELAY_SECONDS,
+        SQLITE_WAL, SQLITE_SYNCHRONOUS, SQLITE_BUSY_TIMEOUT_MS, SQLITE_CACHE_MB,
+    )
+    from backend.mtmt3_core.model_registry import model_aliases
+
+def make_engine(url: str = DATABASE_URL, wal: bool = SQLITE_WAL):
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        pool_size=20,  # 增加连接池大小
+        max_overflow=40,  # 允许的额外连接数
+        pool_timeout=30,  # 连接超时时间
+        pool_recycle=3600,  # 连接回收时间（秒）
+    )
+    if engine.dialect.name == "sqlite":
+        @event.listens_for(engine, "connect")
+        def _sqlite_pragmas(dbapi_connection, _record):
+            cursor = dbapi_connection.cursor()
+            if wal:
+                # WAL 为数据库文件级设置，首个连接设置后持久生效
+                cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+            cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+            cursor.execute(f"PRAGMA cache_size=-{int(SQLITE_CACHE_MB * 1024)}")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+            cursor.close()
+    return engine
+
+
+engine = make_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -31,22 +62,381 @@ class Task(Base):
     model = Column(String, default="mtmt3_piano_vocal")
     mode = Column(String, default="with_accompaniment")
     quantization = Column(String, default="none")
+    precision = Column(String, nullable=True)  # fp32 / int8 / bf16，为空时使用 worker 默认
 
     input_path = Column(String)
+    input_hash = Column(String, nullable=True)   # 上传内容的 sha256
+    cache_key = Column(String, nullable=True)    # 结果缓存键（内容哈希 + 参数 + 模型版本）
     midi_path = Column(String, nullable=True)
     musicxml_path = Column(String, nullable=True)
 
+    # 上传时从文件头读取的音频时长（秒），用于把长音频分配给 GPU worker；无法识别时为空
+    input_seconds = Column(Float, nullable=True)
     duration = Column(Float, nullable=True)
     note_count = Column(Float, nullable=True)
+    # 跳过未推理的静音时长（秒）
+    skipped_seconds = Column(Float, nullable=True)
 
     error_message = Column(Text, nullable=True)
 
-    created_at = Column(DateTime, default=datetime.utcnow)
+    # 批量提交（POST /api/batches）时所属的批次
+    batch_id = Column(String, nullable=True, index=True)
+
+    # 租约：当前持有任务的 worker、已领取次数、租约到期时间
+    worker_id = Column(String, nullable=True)
+    attempts = Column(Integer, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    # 对外可见的内容（状态、进度、结果）最后变化的时间，用作状态接口的 ETag；单纯续约不更新
     updated_at = Column(DateTime, default=datetime.utcnow)
 
+    # 批量状态查询按状态 + 创建时间筛选（见 GET /api/tasks）；
+    # 领取时按 worker 最近处理的任务确定批次偏好（见 claim_preferences）
+    __table_args__ = (
+        Index("ix_tasks_status_created_at", "status", "created_at"),
+        Index("ix_tasks_worker_updated_at", "worker_id", "updated_at"),
+    )
+
     def touch(self):
         self.updated_at = datetime.utcnow()
 
 
+class Worker(Base):
+    """worker 能力登记：定期上报，API 据此分配任务并展示容量"""
+    __tablename__ = "workers"
+
+    id = Column(String, primary_key=True)        # 与领取任务时的 worker_id 相同
+    device = Column(String, default="cpu")       # cpu / cuda
+    models = Column(Text, nullable=True)         # 已加载的 mt3_infer 模型名，逗号分隔
+    slots = Column(Integer, default=1)           # 可同时推理的任务数
+    throughput = Column(Float, nullable=True)    # 实测速度：每秒处理的音频秒数
+    tasks_done = Column(Integer, default=0)
+    started_at = Column(DateTime, default=datetime.utcnow)
+    last_seen = Column(DateTime, default=datetime.utcnow)
+
+    @property
+    def model_list(self):
+        return [m for m in (self.models or "").split(",") if m]
+
+    def is_live(self, now: datetime = None) -> bool:
+        now = now or datetime.utcnow()
+        return self.last_seen is not None and now - self.last_seen < timedelta(seconds=WORKER_STALE_SECONDS)
+
+
+def register_worker(db: Session, worker_id: str, device: str = "cpu", models=(), slots: int = 1,
+                    throughput: float = None, tasks_done: int = None) -> Worker:
+    """登记或刷新 worker 的能力信息"""
+    now = datetime.utcnow()
+    worker = db.get(Worker, worker_id)
+    if worker is None or not worker.is_live(now):
+        # 新 worker 或离线后重新上线，重新计算启动时间
+        worker = worker or Worker(id=worker_id)
+        worker.started_at = now
+        db.add(worker)
+    worker.device = device
+    worker.models = ",".join(sorted(set(models)))
+    worker.slots = max(1, int(slots or 1))
+    if throughput is not None:
+        worker.throughput = throughput
+    if tasks_done is not None:
+        worker.tasks_done = tasks_done
+    worker.last_seen = now
+    db.commit()
+    return worker
+
+
+def claim_preferences(db: Session, worker_id: str = None, now: datetime = None):
+    """
+    按 worker 能力返回领取任务时的 (filters, order_by)：
+    - 已加载所需模型的任务优先（避免换模型的加载开销）
+    - 与该 worker 最近处理的任务同一批次的任务优先（同一专辑连续处理，模型保持预热）
+    - GPU worker 优先长音频，CPU worker 优先短音频；有在线 GPU worker 时，
+      长音频排队 ROUTE_MAX_DELAY_SECONDS 后才交给 CPU worker
+    - 排队超过 ROUTE_MAX_DELAY_SECONDS 的任务不再挑选，按先后顺序领取
+    未登记或已离线的 worker 只保留批次偏好，其余按先后顺序领取。
+    """
+    worker = db.get(Worker, worker_id) if worker_id else None
+    now = now or datetime.utcnow()
+    same_batch = _recent_batch_order(worker_id)
+    if worker is None or not worker.is_live(now):
+        return [], same_batch
+
+    overdue = Task.created_at < now - timedelta(seconds=ROUTE_MAX_DELAY_SECONDS)
+    long_audio = Task.input_seconds >= ROUTE_LONG_AUDIO_SECONDS
+    order = [case((overdue, 0), else_=1)]
+    aliases = model_aliases(worker.model_list)
+    if aliases:
+        order.append(case((Task.model.in_(sorted(aliases)), 0), else_=1))
+    order.extend(same_batch)
+    filters = []
+    if worker.device == "cuda":
+        order.append(case((long_audio, 0), else_=1))
+    else:
+        # 时长未知的任务按短音频处理
+        order.append(case((long_audio, 1), else_=0))
+        gpu_online = db.query(Worker.id).filter(
+            Worker.device == "cuda",
+            Worker.last_seen >= now - timedelta(seconds=WORKER_STALE_SECONDS),
+        ).first()
+        if gpu_online:
+            filters.append(or_(Task.input_seconds.is_(None), ~long_audio, overdue))
+    return filters, order
+
+
+def _recent_batch_order(worker_id: str = None):
+    """同一批次优先：批次取该 worker 最近领取或完成的任务（走 worker_id + updated_at 索引）"""
+    if not worker_id:
+        return []
+    recent_batch = (
+        select(Task.batch_id)
+        .where(Task.worker_id == worker_id)
+        .order_by(Task.updated_at.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    return [case((Task.batch_id == recent_batch, 0), else_=1)]
+
+
+# 领取任务遇到锁冲突或被其他 worker 抢先时的最大重试次数
+CLAIM_MAX_RETRIES = 20
+
+
+def claim_next_task(db: Session, progress: float = 0.05, worker_id: str = None,
+                    lease_seconds: float = TASK_LEASE_SECONDS, max_retries: int = CLAIM_MAX_RETRIES,
+                    filters=(), order_by=()):
+    """
+    原子地领取最早的 queued 任务并置为 processing，返回 Task；没有可领取的任务时返回 None。
+    领取同时写入租约（worker_id、到期时间）并累加 attempts。
+
+    数据库支持 UPDATE ... RETURNING（SQLite >= 3.35）时，选择与更新在同一条语句内完成；
+    否则先查出候选任务，再以 status='queued' 为条件更新，rowcount 为 0 说明被其他 worker
+    抢先，换下一个候选重试。并发写入导致的 "database is locked" 同样退避后重试。
+    filters 为附加的筛选条件（如只领取与已领任务参数相同的任务），
+    order_by 为排在创建时间之前的优先级排序（见 claim_preferences）。
+    """
+    now = datetime.utcnow()
+    values = {
+        Task.status: "processing",
+        Task.progress: progress,
+        Task.error_message: None,
+        Task.updated_at: now,
+        Task.worker_id: worker_id,
+        Task.attempts: func.coalesce(Task.attempts, 0) + 1,
+        Task.lease_expires_at: now + timedelta(seconds=lease_seconds),
+    }
+    oldest_queued = (
+        select(Task.id)
+        .where(Task.status == "queued", *filters)
+        .order_by(*order_by, Task.created_at.asc())
+        .limit(1)
+    )
+
+    for attempt in range(max_retries):
+        try:
+            if db.bind.dialect.update_returning:
+                task_id = db.execute(
+                    update(Task)
+                    .where(Task.id == oldest_queued.scalar_subquery(), Task.status == "queued")
+                    .values(values)
+                    .returning(Task.id)
+                    .execution_options(synchronize_session=False)
+                ).scalar()
+                db.commit()
+                if task_id is None:
+                    return None
+            else:
+                task_id = db.execute(oldest_queued).scalar()
+                if task_id is None:
+                    db.rollback()
+                    return None
+                claimed = db.execute(
+                    update(Task)
+                    .where(Task.id == task_id, Task.status == "queued")
+                    .values(values)
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+                db.commit()
+                if not claimed:
+                    continue
+            return db.get(Task, task_id, populate_existing=True)
+        except OperationalError:
+            # 其他连接持有写锁：退避后重试
+            db.rollback()
+            time.sleep(min(0.5, 0.005 * (2 ** attempt)) * random.random())
+    return None
+
+
+def same_params_as(task: Task):
+    """与 task 可以共用模型批次的任务：model、mode、precision 都相同"""
+    return [
+        Task.model == task.model,
+        Task.mode == task.mode,
+        Task.precision.is_(None) if task.precision is None else Task.precision == task.precision,
+    ]
+
+
+def claim_compatible_tasks(db: Session, limit: int, progress: float = 0.05, worker_id: str = None,
+                           lease_seconds: float = TASK_LEASE_SECONDS):
+    """
+    一次领取至多 limit 个可以共用模型批次的任务，返回 Task 列表（没有任务时为空）。
+    先按 worker 能力（claim_preferences）领取最合适的任务，再领取与它参数相同的后续任务
+    （同一批次的优先）；每个任务各自持有租约，后续的结果与进度仍逐个上报。
+    """
+    filters, order_by = claim_preferences(db, worker_id)
+    first = claim_next_task(db, progress, worker_id, lease_seconds, filters=filters, order_by=order_by)
+    if first is None:
+        return []
+    tasks = [first]
+    filters = filters + same_params_as(first)
+    if first.batch_id:
+        order_by = [case((Task.batch_id == first.batch_id, 0), else_=1), *order_by]
+    while len(tasks) < limit:
+        task = claim_next_task(db, progress, worker_id, lease_seconds, filters=filters, order_by=order_by)
+        if task is None:
+            break
+        tasks.append(task)
+    return tasks
+
+
+def lease_held_by(worker_id: str = None):
+    """
+    任务仍由该 worker 持有的过滤条件。
+    未携带 worker_id 的旧版 worker 只检查任务仍在 processing。
+    """
+    conditions = [Task.status == "processing"]
+    if worker_id:
+        conditions.append(or_(Task.worker_id.is_(None), Task.worker_id == worker_id))
+    return conditions
+
+
+def renew_lease(db: Session, task_id: str, worker_id: str = None, progress: float = None,
+                lease_seconds: float = TASK_LEASE_SECONDS) -> bool:
+    """续约（可同时更新进度）；租约已被回收或转给其他 worker 时返回 False"""
+    now = datetime.utcnow()
+    values = {Task.lease_expires_at: now + timedelta(seconds=lease_seconds)}
+    if progress is not None:
+        values[Task.progress] = progress
+        # 重发相同进度的心跳不改变对外可见的状态，保留 updated_at（状态接口的 ETag 据此计算）
+        values[Task.updated_at] = case((Task.progress == progress, Task.updated_at), else_=now)
+    renewed = (
+        db.query(Task)
+        .filter(Task.id == task_id, *lease_held_by(worker_id))
+        .update(values, synchronize_session=False)
+    )
+    db.commit()
+    return bool(renewed)
+
+
+def lease_status(db: Session, task_id: str, worker_id: str = None) -> str:
+    """
+    只读检查任务租约：ok（仍由该 worker 持有）/ finished（已结束）/ lost / not_found。
+    进度与续约的写入交给 ProgressWriter 合并提交，调用方据此立即得知是否应中止。
+    """
+    row = db.execute(select(Task.status, Task.worker_id).where(Task.id == task_id)).first()
+    db.rollback()  # 结束只读事务，WAL 下避免长期持有旧快照
+    if row is None:
+        return "not_found"
+    status, holder = row
+    if status in ("done", "failed"):
+        return "finished"
+    if status != "processing" or (worker_id and holder is not None and holder != worker_id):
+        return "lost"
+    return "ok"
+
+
+def requeue_expired_tasks(db: Session, max_attempts: int = TASK_MAX_ATTEMPTS,
+                          lease_seconds: float = TASK_LEASE_SECONDS, now: datetime = None):
+    """
+    回收租约过期的 processing 任务：已领取 max_attempts 次的标记为 failed，其余重新排队。
+    没有租约信息的旧任务按 updated_at 判断是否超时。返回 (requeued, failed)。
+    两条条件 UPDATE 各自原子，多个 API 进程同时回收也不会冲突。
+    """
+    now = now or datetime.utcnow()
+    expired = and_(
+        Task.status == "processing",
+        or_(
+            Task.lease_expires_at < now,
+            and_(Task.lease_expires_at.is_(None), Task.updated_at < now - timedelta(seconds=lease_seconds)),
+        ),
+    )
+    released = {Task.worker_id: None, Task.lease_expires_at: None, Task.updated_at: now}
+    failed = (
+        db.query(Task)
+        .filter(expired, func.coalesce(Task.attempts, 1) >= max_attempts)
+        .update({
+            **released,
+            Task.status: "failed",
+            Task.progress: 0.0,
+            Task.error_message: f"Worker lease expired {max_attempts} times, giving up",
+        }, synchronize_session=False)
+    )
+    requeued = (
+        db.query(Task)
+        .filter(expired)
+        .update({**released, Task.status: "queued", Task.progress: 0.0}, synchronize_session=False)
+    )
+    db.commit()
+    return requeued, failed
+
+
+def run_lease_reaper(interval: float = LEASE_REAPER_INTERVAL, on_requeued=None, stop=None):
+    """
+    定期回收租约过期的任务（worker 崩溃或失联），在后台线程中运行。
+    有任务重新排队时调用 on_requeued()（唤醒空闲 worker）；stop 为 threading.Event，置位后退出。
+    每个部署只需一个进程运行：单独运行的 API 进程，或 supervisor（见 API_LEASE_REAPER）。
+    """
+    while True:
+        if stop is not None:
+            if stop.wait(interval):
+                return
+        else:
+            time.sleep(interval)
+        db = SessionLocal()
+        try:
+            requeued, failed = requeue_expired_tasks(db)
+            if requeued or failed:
+                print(f"[reaper] requeued={requeued} failed={failed}")
+            if requeued and on_requeued is not None:
+                on_requeued()
+        except Exception as e:
+            print(f"[reaper] error: {e}")
+        finally:
+            db.close()
+
+
+def _add_missing_columns():
+    """create_all 不会给已存在的表加列，这里补上新增的可空列，旧库无需手动重建"""
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        missing = [c for c in table.columns if c.name not in existing]
+        if not missing:
+            continue
+        for column in missing:
+            col_type = column.type.compile(dialect=engine.dialect)
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+            except OperationalError:
+                # 多个进程同时启动时，列可能已被其他进程加上
+                pass
+
+
+def _add_missing_indexes():
+    """create_all 不会给已存在的表建新索引，这里按需补建"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except OperationalError:
+                # 多个进程同时启动时，索引可能已被其他进程建好
+                pass
+
+
 def init_db():
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+    _add_missing_indexes()
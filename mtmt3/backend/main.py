@@ -1,24 +1,96 @@
+import hashlib
+import json
+import re
+import shutil
+import time
 import uuid
+import threading
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 import python_multipart
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Header
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Header, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from sqlalchemy import and_, func, or_, select
 from sqlalchemy.orm import Session
 from pathlib import Path
 from pydantic import BaseModel
+from typing import List, Optional
 
 try:
-    from .config import UPLOAD_DIR, RESULT_DIR, WORKER_TOKEN
-    from .db import SessionLocal, init_db, Task
+    from .config import (
+        UPLOAD_DIR, RESULT_DIR, WORKER_TOKEN, ADMIN_TOKEN, API_INIT_DB, API_LEASE_REAPER, CLAIM_MAX_WAIT_SECONDS,
+        CLAIM_MAX_BATCH, MAX_UPLOAD_MB, MAX_RESULT_MB, EVENTS_KEEPALIVE_SECONDS, EVENTS_MAX_TASKS,
+        STATUS_QUERY_MAX_TASKS, MAX_BATCH_UPLOAD_MB, MAX_BATCH_FILES,
+    )
+    from .db import (
+        SessionLocal, init_db, Task, Worker, claim_compatible_tasks, lease_held_by,
+        run_lease_reaper, register_worker, lease_status,
+    )
+    from .progress_writer import get_progress_writer
+    from .result_cache import result_cache, make_cache_key, cache_task_result
+    from .notify import notify_workers, get_listener
+    from .task_events import hub as task_events, publish_task_updates
+    from .mtmt3_core.precision import PRECISION_MODES
+    from .mtmt3_core.audio_io import probe_duration
+    from .uploads import UploadLimitMiddleware, save_upload, extract_audio_files, ArchiveLimitExceeded
+    from .artifacts import artifact_index, artifact_response, precompress_results, promote
+    from .storage import storage, storage_key, StorageError, ObjectTooLarge
 except ImportError:
     # 如果相对导入失败，使用绝对导入
-    from backend.config import UPLOAD_DIR, RESULT_DIR, WORKER_TOKEN
-    from backend.db import SessionLocal, init_db, Task
-
-init_db()
-
-app = FastAPI(title="音乐转谱服务", description="基于MR-MT3模型的音乐转谱API")
+    from backend.config import (
+        UPLOAD_DIR, RESULT_DIR, WORKER_TOKEN, ADMIN_TOKEN, API_INIT_DB, API_LEASE_REAPER, CLAIM_MAX_WAIT_SECONDS,
+        CLAIM_MAX_BATCH, MAX_UPLOAD_MB, MAX_RESULT_MB, EVENTS_KEEPALIVE_SECONDS, EVENTS_MAX_TASKS,
+        STATUS_QUERY_MAX_TASKS, MAX_BATCH_UPLOAD_MB, MAX_BATCH_FILES,
+    )
+    from backend.db import (
+        SessionLocal, init_db, Task, Worker, claim_compatible_tasks, lease_held_by,
+        run_lease_reaper, register_worker, lease_status,
+    )
+    from backend.progress_writer import get_progress_writer
+    from backend.result_cache import result_cache, make_cache_key, cache_task_result
+    from backend.notify import notify_workers, get_listener
+    from backend.task_events import hub as task_events, publish_task_updates
+    from backend.mtmt3_core.precision import PRECISION_MODES
+    from backend.mtmt3_core.audio_io import probe_duration
+    from backend.uploads import UploadLimitMiddleware, save_upload, extract_audio_files, ArchiveLimitExceeded
+    from backend.artifacts import artifact_index, artifact_response, precompress_results, promote
+    from backend.storage import storage, storage_key, StorageError, ObjectTooLarge
+
+# supervisor 启动的多进程 API 不在这里迁移（supervisor 已做过一次，见 API_INIT_DB）
+if API_INIT_DB:
+    init_db()
+
+MAX_UPLOAD_BYTES = int(MAX_UPLOAD_MB * 1024 * 1024)
+MAX_RESULT_BYTES = int(MAX_RESULT_MB * 1024 * 1024)
+MAX_BATCH_UPLOAD_BYTES = int(MAX_BATCH_UPLOAD_MB * 1024 * 1024)
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    if API_LEASE_REAPER:
+        # supervisor 启动的多进程 API 由 supervisor 运行唯一的回收线程
+        threading.Thread(target=run_lease_reaper, kwargs={"on_requeued": notify_workers},
+                         name="lease-reaper", daemon=True).start()
+    # 其他进程（其他 API 进程、本地 worker）写入的状态变化经 UDP 广播转给本进程的推送连接
+    get_listener().add_update_handler(task_events.publish)
+    yield
+
+
+app = FastAPI(title="音乐转谱服务", description="基于MR-MT3模型的音乐转谱API", lifespan=lifespan)
+
+# 请求体解析前拒绝超限的上传（CORS 在其外层，413 响应同样带 CORS 头）
+app.add_middleware(
+    UploadLimitMiddleware,
+    limits=[
+        (lambda path: path == "/api/tasks", MAX_UPLOAD_BYTES),
+        (lambda path: path == "/api/batches", MAX_BATCH_UPLOAD_BYTES),
+        (lambda path: path.startswith("/api/worker/tasks/") and path.endswith("/complete"), 2 * MAX_RESULT_BYTES),
+    ],
+)
 
 # 简单 CORS，方便前端直接访问
 app.add_middleware(
@@ -45,31 +117,70 @@ def verify_worker_token(x_worker_token: str = Header(default="")):
         raise HTTPException(status_code=401, detail="Invalid worker token")
 
 
+def _ensure_lease(db: Session, task_id: str, worker_id: str) -> Task:
+    """任务不存在返回 404；租约已被回收或转给其他 worker 返回 409"""
+    task = db.query(Task).filter(Task.id == task_id).first()
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    owned = (
+        db.query(Task.id)
+        .filter(Task.id == task_id, *lease_held_by(worker_id))
+        .first()
+    )
+    if not owned:
+        raise HTTPException(status_code=409, detail="Task lease is no longer held by this worker")
+    return task
+
+
+def verify_admin_token(x_admin_token: str = Header(default="")):
+    if not ADMIN_TOKEN or ADMIN_TOKEN == "change-me":
+        # 未配置（或仍为示例值）时管理接口整体关闭
+        raise HTTPException(status_code=503, detail="Admin endpoints are disabled: set ADMIN_TOKEN on the server")
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
 class ProgressUpdate(BaseModel):
     progress: float
     status: str = "processing"
 
 
+class BatchProgressItem(ProgressUpdate):
+    task_id: str
+
+
+class BatchProgressUpdate(BaseModel):
+    updates: List[BatchProgressItem]
+
+
 class FailureUpdate(BaseModel):
     error_message: str
 
 
-@app.post("/api/tasks")
-async def create_task(
-    file: UploadFile = File(...),
-    model: str = Form("mtmt3_piano_vocal"),
-    mode: str = Form("with_accompaniment"),
-    quantization: str = Form("none"),
-    db: Session = Depends(get_db),
-):
-    task_id = str(uuid.uuid4())
-    ext = file.filename.split(".")[-1]
-    input_path = UPLOAD_DIR / f"{task_id}.{ext}"
+class WorkerInfo(BaseModel):
+    device: str = "cpu"
+    models: List[str] = []
+    slots: int = 1
+    throughput: Optional[float] = None
+    tasks_done: Optional[int] = None
+
+
+def _normalize_precision(precision: str):
+    # 推理精度：留空使用 worker 默认精度
+    precision = precision.strip().lower() or None
+    if precision and precision not in PRECISION_MODES:
+        raise HTTPException(status_code=400, detail=f"Unsupported precision, expected one of {', '.join(PRECISION_MODES)}")
+    return precision
 
-    data = await file.read()
-    with open(input_path, "wb") as f:
-        f.write(data)
 
+def _build_task(input_path: Path, input_hash: str, model: str, mode: str, quantization: str,
+                precision: str, batch_id: str = None) -> Task:
+    """
+    在线程池中执行：为已保存的上传文件（文件名为任务 id）构造 Task；
+    命中结果缓存时直接完成，不进入队列，否则把输入写入存储（对象存储后端供远程 worker 直接下载）。
+    """
+    task_id = input_path.stem
+    cache_key = make_cache_key(input_hash, model, mode, quantization, precision)
     task = Task(
         id=task_id,
         status="queued",
@@ -77,91 +188,587 @@ async def create_task(
         model=model,
         mode=mode,
         quantization=quantization,
+        precision=precision,
         input_path=str(input_path),
+        # 只读文件头，用于把长音频分配给 GPU worker
+        input_seconds=probe_duration(str(input_path)),
+        input_hash=input_hash,
+        cache_key=cache_key,
+        batch_id=batch_id,
     )
+
+    cached = result_cache.lookup(cache_key)
+    if cached:
+        paths = result_cache.materialize(cached, RESULT_DIR / task_id)
+        task.midi_path = paths["midi_path"]
+        task.musicxml_path = paths["musicxml_path"]
+        task.duration = cached.get("duration")
+        task.note_count = cached.get("note_count")
+        task.skipped_seconds = cached.get("skipped_seconds")
+        task.status = "done"
+        task.progress = 1.0
+    else:
+        storage.put_file(input_path)
+
     task.touch()
+    return task
+
+
+async def _save_audio_upload(upload: UploadFile):
+    """保存上传的音频，文件名为新的任务 id；返回 (路径, sha256)"""
+    ext = Path(upload.filename or "").suffix.lstrip(".")
+    input_path = UPLOAD_DIR / f"{uuid.uuid4()}.{ext or 'audio'}"
+
+    # 在线程池中分块写盘并计算内容哈希；文件头可以确定不是音频时拒绝
+    _, input_hash, sniffed = await save_upload(
+        upload, input_path, max_bytes=MAX_UPLOAD_BYTES, hash_content=True, sniff=True,
+    )
+    if not ext and sniffed:
+        # 没有扩展名时按文件头补上，便于解码器识别
+        input_path = input_path.rename(input_path.with_suffix(f".{sniffed}"))
+    return input_path, input_hash
+
+
+@app.post("/api/tasks")
+async def create_task(
+    file: UploadFile = File(...),
+    model: str = Form("mtmt3_piano_vocal"),
+    mode: str = Form("with_accompaniment"),
+    quantization: str = Form("none"),
+    precision: str = Form(""),
+    db: Session = Depends(get_db),
+):
+    precision = _normalize_precision(precision)
+    input_path, input_hash = await _save_audio_upload(file)
+    try:
+        task = await run_in_threadpool(_build_task, input_path, input_hash, model, mode, quantization, precision)
+    except StorageError as e:
+        input_path.unlink(missing_ok=True)
+        raise HTTPException(status_code=503, detail=f"Storage unavailable: {e}")
+
     db.add(task)
     db.commit()
+    if task.status == "queued":
+        # 唤醒空闲 worker 立即领取
+        notify_workers()
 
-    return {"task_id": task_id, "status": task.status}
+    return {"task_id": task.id, "status": task.status, "cached": task.status == "done"}
 
 
-@app.get("/api/tasks/{task_id}")
-def get_task(task_id: str, db: Session = Depends(get_db)):
-    task = db.query(Task).filter(Task.id == task_id).first()
-    if not task:
-        raise HTTPException(status_code=404, detail="Task not found")
+@app.post("/api/batches")
+async def create_batch(
+    files: List[UploadFile] = File(default=[]),
+    archive: Optional[UploadFile] = File(default=None),
+    model: str = Form("mtmt3_piano_vocal"),
+    mode: str = Form("with_accompaniment"),
+    quantization: str = Form("none"),
+    precision: str = Form(""),
+    db: Session = Depends(get_db),
+):
+    """
+    批量提交（整张专辑等）：上传一个 zip / tar 压缩包（archive）和/或多个音频文件（files）。
+    压缩包在线程池中逐个流式解出，不整体解压；非音频或超过 MAX_UPLOAD_MB 的文件跳过，列在 skipped 中。
+    所有任务在一个事务内创建，属于同一个 batch_id，进度见 GET /api/batches/{batch_id}。
+    """
+    precision = _normalize_precision(precision)
+    if not files and archive is None:
+        raise HTTPException(status_code=400, detail="No files or archive uploaded")
+
+    batch_id = str(uuid.uuid4())
+    entries = []  # [(原文件名, 保存路径, sha256)]
+    skipped = []
+    try:
+        if archive is not None:
+            archive_path = UPLOAD_DIR / f"batch-{batch_id}.part"
+            try:
+                await save_upload(archive, archive_path, max_bytes=MAX_BATCH_UPLOAD_BYTES)
+                saved, skipped_members = await run_in_threadpool(
+                    extract_audio_files,
+                    archive_path,
+                    lambda ext: UPLOAD_DIR / f"{uuid.uuid4()}.{ext}",
+                    MAX_UPLOAD_BYTES,
+                    MAX_BATCH_FILES,
+                    MAX_BATCH_UPLOAD_BYTES,
+                )
+            except ArchiveLimitExceeded as e:
+                raise HTTPException(status_code=413, detail=str(e))
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            finally:
+                archive_path.unlink(missing_ok=True)
+            entries.extend((name, path, digest) for name, path, _, digest in saved)
+            skipped.extend({"filename": name, "reason": reason} for name, reason in skipped_members)
+
+        if len(entries) + len(files) > MAX_BATCH_FILES:
+            raise HTTPException(status_code=413, detail=f"Batch contains more than {MAX_BATCH_FILES} files")
+        for upload in files:
+            try:
+                input_path, input_hash = await _save_audio_upload(upload)
+            except HTTPException as e:
+                if e.status_code not in (413, 415):
+                    raise
+                skipped.append({"filename": upload.filename, "reason": "too large" if e.status_code == 413 else "not audio"})
+                continue
+            entries.append((upload.filename, input_path, input_hash))
+
+        if not entries:
+            raise HTTPException(status_code=400, detail="No audio files in batch")
+
+        def build_tasks():
+            return [
+                _build_task(path, digest, model, mode, quantization, precision, batch_id)
+                for _, path, digest in entries
+            ]
+
+        try:
+            tasks = await run_in_threadpool(build_tasks)
+        except StorageError as e:
+            raise HTTPException(status_code=503, detail=f"Storage unavailable: {e}")
+        # 一个事务创建整批任务
+        db.add_all(tasks)
+        db.commit()
+    except BaseException:
+        for _, path, _ in entries:
+            path.unlink(missing_ok=True)
+        raise
+
+    if any(task.status == "queued" for task in tasks):
+        notify_workers()
+
+    return {
+        "batch_id": batch_id,
+        "tasks": [
+            {"task_id": task.id, "filename": name, "status": task.status, "cached": task.status == "done"}
+            for (name, _, _), task in zip(entries, tasks)
+        ],
+        "skipped": skipped,
+    }
+
+
+TASK_STATUSES = ("queued", "processing", "done", "failed")
 
-    result = None
-    if task.status == "done":
-        result = {
-            "midi_url": f"/download/{task.id}.mid",
-            "musicxml_url": f"/download/{task.id}.musicxml",
-            "duration": task.duration,
-            "note_count": task.note_count,
-        }
 
+def _task_result(task):
+    if task.status != "done":
+        return None
+    return {
+        "midi_url": f"/download/{task.id}.mid",
+        "musicxml_url": f"/download/{task.id}.musicxml",
+        "duration": task.duration,
+        "note_count": task.note_count,
+        "skipped_seconds": task.skipped_seconds,
+    }
+
+
+def _task_payload(task: Task) -> dict:
     return {
         "task_id": task.id,
         "status": task.status,
         "progress": task.progress,
         "created_at": task.created_at,
         "updated_at": task.updated_at,
-        "result": result,
+        "result": _task_result(task),
         "error_message": task.error_message,
     }
 
 
-@app.get("/download/{task_id}.{ext}")
-def download_file(task_id: str, ext: str, db: Session = Depends(get_db)):
+def _summary_query():
+    """批量查询只读取精简内容所需的列"""
+    return select(
+        Task.id, Task.status, Task.progress, Task.created_at, Task.updated_at, Task.error_message,
+        Task.duration, Task.note_count, Task.skipped_seconds,
+    )
+
+
+def _task_summary(row) -> dict:
+    """批量查询用的精简内容：只带结束任务的结果或错误信息"""
+    item = {"task_id": row.id, "status": row.status, "progress": row.progress, "updated_at": row.updated_at}
+    if row.status == "done":
+        item["result"] = _task_result(row)
+    elif row.status == "failed":
+        item["error_message"] = row.error_message
+    return item
+
+
+def _etag(rows) -> str:
+    """由任务 id 与 updated_at 计算 ETag（updated_at 在状态、进度、结果变化时更新）"""
+    digest = hashlib.sha1()
+    for row in rows:
+        updated_at = row.updated_at.isoformat() if row.updated_at else ""
+        digest.update(f"{row.id}:{updated_at};".encode())
+    return f'"{digest.hexdigest()[:24]}"'
+
+
+def _not_modified(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = {tag.strip() for tag in if_none_match.split(",")}
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def _conditional(response: Response, etag: str, if_none_match: Optional[str]):
+    """设置 ETag；客户端缓存仍有效时返回 304 响应，否则返回 None"""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _not_modified(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+def _load_task_payloads(task_ids) -> dict:
+    db = SessionLocal()
+    try:
+        tasks = db.query(Task).filter(Task.id.in_(task_ids)).all()
+        return {task.id: jsonable_encoder(_task_payload(task)) for task in tasks}
+    finally:
+        db.close()
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.get("/api/tasks/events")
+async def task_events_stream(request: Request, ids: str):
+    """
+    以 Server-Sent Events 推送任务状态，代替前端轮询 GET /api/tasks/{id}。
+    ids 为逗号分隔的任务 id。连接建立后先推送每个任务的当前状态，之后只在状态或进度变化时推送
+    （event: task，内容与 GET /api/tasks/{id} 相同）；所有任务结束后发送 event: end 并关闭连接。
+    """
+    task_ids = list(dict.fromkeys(t.strip() for t in ids.split(",") if t.strip()))
+    if not task_ids:
+        raise HTTPException(status_code=400, detail="No task ids")
+    if len(task_ids) > EVENTS_MAX_TASKS:
+        raise HTTPException(status_code=400, detail=f"Too many task ids (max {EVENTS_MAX_TASKS})")
+    # 先订阅再读取初始状态，读取期间发生的变化不会丢失
+    subscription = task_events.subscribe(task_ids)
+    try:
+        initial = await run_in_threadpool(_load_task_payloads, task_ids)
+    except BaseException:
+        task_events.unsubscribe(subscription)
+        raise
+    missing = [task_id for task_id in task_ids if task_id not in initial]
+    if missing:
+        task_events.unsubscribe(subscription)
+        raise HTTPException(status_code=404, detail=f"Task not found: {', '.join(missing)}")
+
+    async def stream():
+        sent = {}
+        payloads = initial
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                for task_id in task_ids:
+                    payload = payloads.get(task_id)
+                    if payload is not None and payload != sent.get(task_id):
+                        sent[task_id] = payload
+                        yield _sse("task", payload)
+                if all(sent.get(t, {}).get("status") in ("done", "failed") for t in task_ids):
+                    yield _sse("end", {"task_ids": task_ids})
+                    return
+                changed = await subscription.wait(EVENTS_KEEPALIVE_SECONDS)
+                if await request.is_disconnected():
+                    return
+                if not changed:
+                    # 超时：发送保活注释，并重新读取全部任务，补上可能丢失的广播
+                    yield ": keep-alive\n\n"
+                    changed = task_ids
+                payloads = await run_in_threadpool(_load_task_payloads, list(changed))
+        finally:
+            task_events.unsubscribe(subscription)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/tasks")
+def list_tasks(
+    response: Response,
+    ids: List[str] = Query(default=[]),
+    status: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    after_id: Optional[str] = None,
+    limit: int = 100,
+    if_none_match: Optional[str] = Header(default=None),
+    db: Session = Depends(get_db),
+):
+    """
+    批量查询任务状态，代替逐个请求 GET /api/tasks/{id}。
+    ids（可重复或逗号分隔）按 id 查询，结果按传入顺序排列，不存在或不满足筛选条件的列在 missing 中；
+    不传 ids 时按 status（逗号分隔）与 created_after 筛选，按创建时间升序最多返回 limit 个，
+    还有更多时 next_created_after / next_after_id 为下一页的 created_after / after_id
+    （after_id 用于区分创建时间相同的任务）。
+    响应带 ETag，请求携带 If-None-Match 且所有任务都未变化时返回 304。
+    """
+    task_ids = list(dict.fromkeys(t.strip() for value in ids for t in value.split(",") if t.strip()))
+    if len(task_ids) > STATUS_QUERY_MAX_TASKS:
+        raise HTTPException(status_code=400, detail=f"Too many task ids (max {STATUS_QUERY_MAX_TASKS})")
+    statuses = [s.strip() for s in (status or "").split(",") if s.strip()]
+    unknown = [s for s in statuses if s not in TASK_STATUSES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown status: {', '.join(unknown)}")
+    limit = max(1, min(limit, STATUS_QUERY_MAX_TASKS))
+
+    query = _summary_query()
+    if statuses:
+        query = query.where(Task.status.in_(statuses))
+    if created_after is not None:
+        if created_after.tzinfo is not None:
+            created_after = created_after.astimezone(timezone.utc).replace(tzinfo=None)
+        if after_id:
+            query = query.where(or_(
+                Task.created_at > created_after,
+                and_(Task.created_at == created_after, Task.id > after_id),
+            ))
+        else:
+            query = query.where(Task.created_at > created_after)
+
+    next_created_after = next_after_id = None
+    missing = []
+    if task_ids:
+        found = {row.id: row for row in db.execute(query.where(Task.id.in_(task_ids)))}
+        rows = [found[t] for t in task_ids if t in found]
+        missing = [t for t in task_ids if t not in found]
+    else:
+        rows = db.execute(query.order_by(Task.created_at, Task.id).limit(limit + 1)).all()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_created_after, next_after_id = rows[-1].created_at, rows[-1].id
+
+    not_modified = _conditional(response, _etag(rows), if_none_match)
+    if not_modified:
+        return not_modified
+    return {
+        "tasks": [_task_summary(row) for row in rows],
+        "missing": missing,
+        "next_created_after": next_created_after,
+        "next_after_id": next_after_id,
+    }
+
+
+@app.get("/api/batches/{batch_id}")
+def get_batch(
+    batch_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(default=None),
+    db: Session = Depends(get_db),
+):
+    """
+    批次的汇总进度与各任务的精简状态（支持 ETag）。status：
+    queued（都未开始）/ processing / done（全部成功）/ failed（全部失败）/ partial（已全部结束，部分失败）
+    """
+    rows = db.execute(
+        _summary_query().where(Task.batch_id == batch_id).order_by(Task.created_at, Task.id)
+    ).all()
+    if not rows:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    not_modified = _conditional(response, _etag(rows), if_none_match)
+    if not_modified:
+        return not_modified
+
+    counts = {status: 0 for status in TASK_STATUSES}
+    for row in rows:
+        counts[row.status] = counts.get(row.status, 0) + 1
+    finished = counts["done"] + counts["failed"]
+    if finished == len(rows):
+        status = "done" if not counts["failed"] else "failed" if not counts["done"] else "partial"
+    elif counts["queued"] == len(rows):
+        status = "queued"
+    else:
+        status = "processing"
+    # 已结束（含失败）的任务按 1 计入整体进度
+    progress = sum(1.0 if row.status in ("done", "failed") else (row.progress or 0.0) for row in rows) / len(rows)
+
+    return {
+        "batch_id": batch_id,
+        "status": status,
+        "total": len(rows),
+        "counts": counts,
+        "progress": round(progress, 4),
+        "tasks": [_task_summary(row) for row in rows],
+    }
+
+
+@app.get("/api/tasks/{task_id}")
+def get_task(
+    task_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(default=None),
+    db: Session = Depends(get_db),
+):
     task = db.query(Task).filter(Task.id == task_id).first()
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
+    not_modified = _conditional(response, _etag([task]), if_none_match)
+    if not_modified:
+        return not_modified
+    return _task_payload(task)
 
-    if ext == "mid":
-        path = task.midi_path
-    elif ext == "musicxml":
-        path = task.musicxml_path
-    else:
+
+@app.get("/download/{task_id}.{ext}")
+def download_file(
+    task_id: str,
+    ext: str,
+    accept_encoding: Optional[str] = Header(default=None),
+    if_none_match: Optional[str] = Header(default=None),
+    db: Session = Depends(get_db),
+):
+    """按 Accept-Encoding 返回预压缩副本；已完成任务的结果带强 ETag 与 immutable 缓存头，支持 Range"""
+    if ext not in ("mid", "musicxml"):
         raise HTTPException(status_code=400, detail="Unsupported ext")
 
+    # 已完成任务的结果不再变化，路径缓存在内存中，重复下载不查数据库
+    paths = artifact_index.get(task_id)
+    done = paths is not None
+    if paths is None:
+        task = db.query(Task).filter(Task.id == task_id).first()
+        if not task:
+            raise HTTPException(status_code=404, detail="Task not found")
+        paths = {"mid": task.midi_path, "musicxml": task.musicxml_path}
+        done = task.status == "done"
+        if done:
+            artifact_index.put(task_id, paths)
+
+    path = paths.get(ext)
     if not path:
         raise HTTPException(status_code=404, detail="Result not ready")
 
-    return FileResponse(path, filename=f"{task_id}.{ext}")
+    try:
+        return artifact_response(path, f"{task_id}.{ext}", ext, accept_encoding, if_none_match, immutable=done)
+    except FileNotFoundError:
+        artifact_index.discard(task_id)
+        raise HTTPException(status_code=404, detail="Result file missing")
+
+
+def _staging_dir(task_id: str, worker_id: str, attempt: int) -> Path:
+    """worker 提交结果时的暂存目录（每次领取一个），租约确认后再替换正式结果"""
+    holder = re.sub(r"[^A-Za-z0-9_.-]", "_", worker_id or "worker")
+    return RESULT_DIR / task_id / f".{holder}-{attempt or 0}"
+
+
+def _result_keys(task_id: str, worker_id: str, attempt: int) -> dict:
+    """
+    worker 直传结果的对象键，与 /complete 的暂存目录一一对应（每次领取各不相同）：
+    租约丢失的 worker 凭仍未过期的上传 URL 也只能写自己那次领取的键，不会被新持有者的提交取回
+    """
+    staging = _staging_dir(task_id, worker_id, attempt)
+    return {"midi": storage_key(staging / "result.mid"), "musicxml": storage_key(staging / "result.musicxml")}
+
+
+def _claimed_task_payload(task: Task) -> dict:
+    input_name = Path(task.input_path).name if task.input_path else f"{task.id}.audio"
+    payload = {
+        "task_id": task.id,
+        "model": task.model,
+        "mode": task.mode,
+        "quantization": task.quantization,
+        "precision": task.precision,
+        "input_filename": input_name,
+        "input_url": f"/api/worker/tasks/{task.id}/input",
+        "attempt": task.attempts,
+        "lease_expires_at": task.lease_expires_at,
+    }
+    if storage.direct_transfer and task.input_path:
+        # 对象存储：worker 凭短期签名 URL 直接下载输入，结果上传前再申请上传 URL（见 upload-urls）
+        try:
+            payload["input_download_url"] = storage.download_url(storage_key(task.input_path))
+            payload["direct_upload"] = True
+        except ValueError:
+            pass  # 输入不在 DATA_DIR 下（旧任务），经由 API 下载
+    return payload
 
 
 @app.post("/api/worker/tasks/claim")
-def claim_task(
+async def claim_task(
+    wait: float = 0.0,
+    limit: int = 1,
+    x_worker_id: str = Header(default=None),
     _: None = Depends(verify_worker_token),
     db: Session = Depends(get_db),
 ):
-    task = (
-        db.query(Task)
-        .filter(Task.status == "queued")
-        .order_by(Task.created_at.asc())
-        .first()
-    )
-    if not task:
-        return {"task": None}
+    """
+    wait > 0 时为长轮询：没有可领取的任务就挂起请求，直到新任务通知到达或超时
+    （最长 CLAIM_MAX_WAIT_SECONDS），超时返回 {"task": null, "tasks": []}。
+    limit > 1 时一次领取至多 limit 个 model/mode/precision 相同的任务（用于短音频批量推理），
+    全部放在 tasks 中；task 始终是其中第一个，兼容只处理单任务的 worker。
+    """
+    limit = max(1, min(limit, CLAIM_MAX_BATCH))
+    deadline = time.monotonic() + max(0.0, min(wait, CLAIM_MAX_WAIT_SECONDS))
+    wakeup = get_listener() if wait > 0 else None
+    while True:
+        since = wakeup.generation if wakeup else 0
+        tasks = await run_in_threadpool(claim_compatible_tasks, db, limit, 0.02, x_worker_id)
+        if tasks:
+            break
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return {"task": None, "tasks": []}
+        await wakeup.wait_async(since, remaining)
+
+    payloads = [_claimed_task_payload(task) for task in tasks]
+    publish_task_updates([task.id for task in tasks])
+    return {"task": payloads[0], "tasks": payloads}
+
+
+@app.post("/api/worker/register")
+def worker_register(
+    payload: WorkerInfo,
+    x_worker_id: str = Header(default=None),
+    _: None = Depends(verify_worker_token),
+    db: Session = Depends(get_db),
+):
+    """worker 启动时与之后定期上报能力信息，领取任务时据此分配（见 db.claim_preferences）"""
+    if not x_worker_id:
+        raise HTTPException(status_code=400, detail="x-worker-id header is required")
+    register_worker(db, x_worker_id, payload.device, payload.models, payload.slots,
+                    payload.throughput, payload.tasks_done)
+    return {"ok": True}
 
-    task.status = "processing"
-    task.progress = max(task.progress or 0.0, 0.02)
-    task.error_message = None
-    task.touch()
-    db.commit()
-    db.refresh(task)
 
-    input_name = Path(task.input_path).name if task.input_path else f"{task.id}.audio"
+@app.get("/api/workers")
+def list_workers(
+    include_offline: bool = False,
+    _: None = Depends(verify_admin_token),
+    db: Session = Depends(get_db),
+):
+    """各 worker 的实时容量与利用率（busy 为当前持有租约的任务数）"""
+    now = datetime.utcnow()
+    busy = dict(
+        db.query(Task.worker_id, func.count(Task.id))
+        .filter(Task.status == "processing", Task.worker_id.isnot(None))
+        .group_by(Task.worker_id)
+        .all()
+    )
+    workers = []
+    for worker in db.query(Worker).order_by(Worker.id).all():
+        live = worker.is_live(now)
+        if not live and not include_offline:
+            continue
+        workers.append({
+            "worker_id": worker.id,
+            "live": live,
+            "device": worker.device,
+            "models": worker.model_list,
+            "slots": worker.slots,
+            "busy": busy.get(worker.id, 0),
+            "utilization": round(busy.get(worker.id, 0) / max(worker.slots or 1, 1), 3),
+            "throughput": worker.throughput,
+            "tasks_done": worker.tasks_done,
+            "started_at": worker.started_at,
+            "last_seen": worker.last_seen,
+        })
+    live_workers = [w for w in workers if w["live"]]
+    capacity = sum(w["slots"] for w in live_workers)
+    in_use = sum(w["busy"] for w in live_workers)
     return {
-        "task": {
-            "task_id": task.id,
-            "model": task.model,
-            "mode": task.mode,
-            "quantization": task.quantization,
-            "input_filename": input_name,
-            "input_url": f"/api/worker/tasks/{task.id}/input",
-        }
+        "workers": workers,
+        "capacity": capacity,
+        "busy": in_use,
+        "utilization": round(in_use / capacity, 3) if capacity else 0.0,
+        "queued": db.query(func.count(Task.id)).filter(Task.status == "queued").scalar(),
     }
 
 
@@ -174,65 +781,171 @@ def worker_download_input(
     task = db.query(Task).filter(Task.id == task_id).first()
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
-    if not task.input_path or not Path(task.input_path).exists():
+    if not task.input_path:
+        raise HTTPException(status_code=404, detail="Input file not found")
+    if not Path(task.input_path).exists():
+        # 本地没有副本（如 API 换了机器）时转到对象存储
+        if storage.direct_transfer:
+            return RedirectResponse(storage.download_url(storage_key(task.input_path)), status_code=307)
         raise HTTPException(status_code=404, detail="Input file not found")
     return FileResponse(task.input_path, filename=Path(task.input_path).name)
 
 
+@app.post("/api/worker/tasks/{task_id}/upload-urls")
+def worker_upload_urls(
+    task_id: str,
+    x_worker_id: str = Header(default=None),
+    _: None = Depends(verify_worker_token),
+    db: Session = Depends(get_db),
+):
+    """
+    结果文件的短期签名上传 URL（仅对象存储后端），worker 直接上传后以 stored=true 调用 /complete。
+    本地存储返回 404，worker 改为把结果文件随 /complete 上传。
+    """
+    task = _ensure_lease(db, task_id, x_worker_id)
+    if not storage.direct_transfer:
+        raise HTTPException(status_code=404, detail="Direct upload is not available")
+    keys = _result_keys(task_id, x_worker_id, task.attempts)
+    urls = {name: storage.upload_url(key) for name, key in keys.items()}
+    return dict(urls, expires_in=storage.expires)
+
+
+def _apply_progress(db: Session, task_id: str, progress: float, worker_id: str) -> str:
+    """
+    进度上报同时续约，返回 ok / not_found / lost。
+    任务已被回收或转给其他 worker 时为 lost，worker 应中止；已结束的任务直接返回 ok。
+    """
+    status = lease_status(db, task_id, worker_id)
+    if status == "finished":
+        return "ok"
+    if status != "ok":
+        return status
+    # 只做读检查，写入交给本进程的合并写线程（与其他进度一起批量提交）
+    get_progress_writer().submit(task_id, worker_id, max(0.0, min(progress, 0.99)))
+    return "ok"
+
+
+@app.post("/api/worker/tasks/progress")
+def worker_update_progress_batch(
+    payload: BatchProgressUpdate,
+    x_worker_id: str = Header(default=None),
+    _: None = Depends(verify_worker_token),
+    db: Session = Depends(get_db),
+):
+    """一次上报多个任务的进度（远程 worker 的后台发送线程合并后批量提交），逐个返回结果"""
+    return {"results": {
+        item.task_id: _apply_progress(db, item.task_id, item.progress, x_worker_id)
+        for item in payload.updates
+    }}
+
+
 @app.post("/api/worker/tasks/{task_id}/progress")
 def worker_update_progress(
     task_id: str,
     payload: ProgressUpdate,
+    x_worker_id: str = Header(default=None),
     _: None = Depends(verify_worker_token),
     db: Session = Depends(get_db),
 ):
-    task = db.query(Task).filter(Task.id == task_id).first()
-    if not task:
+    outcome = _apply_progress(db, task_id, payload.progress, x_worker_id)
+    if outcome == "not_found":
         raise HTTPException(status_code=404, detail="Task not found")
-    if task.status in ("done", "failed"):
-        return {"ok": True}
-
-    task.progress = max(0.0, min(payload.progress, 0.99))
-    task.status = payload.status or "processing"
-    task.touch()
-    db.commit()
+    if outcome == "lost":
+        raise HTTPException(status_code=409, detail="Task lease is no longer held by this worker")
     return {"ok": True}
 
 
 @app.post("/api/worker/tasks/{task_id}/complete")
 async def worker_complete_task(
     task_id: str,
-    midi_file: UploadFile = File(...),
-    musicxml_file: UploadFile = File(...),
+    midi_file: Optional[UploadFile] = File(default=None),
+    musicxml_file: Optional[UploadFile] = File(default=None),
+    stored: bool = Form(False),
     duration: float = Form(0.0),
     note_count: float = Form(0.0),
+    skipped_seconds: float = Form(0.0),
+    x_worker_id: str = Header(default=None),
     _: None = Depends(verify_worker_token),
     db: Session = Depends(get_db),
 ):
-    task = db.query(Task).filter(Task.id == task_id).first()
-    if not task:
-        raise HTTPException(status_code=404, detail="Task not found")
+    """
+    提交结果：结果文件随请求上传，或 stored=true 表示已通过签名 URL 直接上传到存储，
+    此时 API 从存储取回一份到 RESULT_DIR（供下载、预压缩与结果缓存）。
+    """
+    # 租约已被接管的 worker 提交的结果直接拒绝，不覆盖新持有者的产物
+    task = _ensure_lease(db, task_id, x_worker_id)
 
     output_dir = RESULT_DIR / task_id
-    output_dir.mkdir(parents=True, exist_ok=True)
-
     midi_path = output_dir / "result.mid"
     musicxml_path = output_dir / "result.musicxml"
+    # 先写入本次领取专用的暂存目录：写文件期间租约可能被回收，
+    # 只有按租约条件更新成功后才替换正式结果，过期的提交不会覆盖新持有者的产物
+    staging = _staging_dir(task_id, x_worker_id, task.attempts)
+    staging.mkdir(parents=True, exist_ok=True)
+    staged_midi = staging / midi_path.name
+    staged_musicxml = staging / musicxml_path.name
 
-    with open(midi_path, "wb") as f:
-        f.write(await midi_file.read())
-    with open(musicxml_path, "wb") as f:
-        f.write(await musicxml_file.read())
-
-    task.midi_path = str(midi_path)
-    task.musicxml_path = str(musicxml_path)
-    task.duration = duration
-    task.note_count = note_count
-    task.status = "done"
-    task.progress = 1.0
-    task.error_message = None
-    task.touch()
-    db.commit()
+    try:
+        if stored:
+            # 只取回当前持有租约的这次领取上传的对象
+            keys = _result_keys(task_id, x_worker_id, task.attempts)
+            try:
+                for key, path in ((keys["midi"], staged_midi), (keys["musicxml"], staged_musicxml)):
+                    await run_in_threadpool(storage.fetch, key, path, MAX_RESULT_BYTES)
+            except FileNotFoundError:
+                raise HTTPException(status_code=400, detail="Result files not found in storage")
+            except ObjectTooLarge:
+                raise HTTPException(status_code=413, detail=f"Result exceeds the {MAX_RESULT_MB:g} MB limit")
+            except StorageError as e:
+                raise HTTPException(status_code=502, detail=f"Storage unavailable: {e}")
+        elif midi_file is None or musicxml_file is None:
+            raise HTTPException(status_code=400, detail="midi_file and musicxml_file are required")
+        else:
+            # 在线程池中分块写盘，先写临时文件再替换，中途失败不会留下不完整的结果
+            await save_upload(midi_file, staged_midi, max_bytes=MAX_RESULT_BYTES)
+            await save_upload(musicxml_file, staged_musicxml, max_bytes=MAX_RESULT_BYTES)
+        await run_in_threadpool(precompress_results, staged_midi, staged_musicxml)
+
+        # 按租约条件更新，成功后在同一写事务内替换正式结果再提交：
+        # 写锁保证此时没有其他持有者，任务对外可见为 done 时结果已就位
+        completed = (
+            db.query(Task)
+            .filter(Task.id == task_id, *lease_held_by(x_worker_id))
+            .update({
+                Task.midi_path: str(midi_path),
+                Task.musicxml_path: str(musicxml_path),
+                Task.duration: duration,
+                Task.note_count: note_count,
+                Task.skipped_seconds: skipped_seconds,
+                Task.status: "done",
+                Task.progress: 1.0,
+                Task.error_message: None,
+                Task.lease_expires_at: None,
+                Task.updated_at: datetime.utcnow(),
+            }, synchronize_session=False)
+        )
+        if not completed:
+            db.rollback()
+            raise HTTPException(status_code=409, detail="Task lease is no longer held by this worker")
+        promote(staged_midi, midi_path)
+        promote(staged_musicxml, musicxml_path)
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    if not stored:
+        try:
+            # 对象存储后端同样保存一份（本地存储时为空操作）
+            for path in (midi_path, musicxml_path):
+                await run_in_threadpool(storage.put_file, path)
+        except StorageError as e:
+            print(f"[storage] result upload failed task={task_id}: {e}")
+    db.refresh(task)
+    publish_task_updates([task_id])
+    cache_task_result(task)
 
     return {"ok": True}
 
@@ -241,21 +954,37 @@ async def worker_complete_task(
 def worker_fail_task(
     task_id: str,
     payload: FailureUpdate,
+    x_worker_id: str = Header(default=None),
     _: None = Depends(verify_worker_token),
     db: Session = Depends(get_db),
 ):
-    task = db.query(Task).filter(Task.id == task_id).first()
-    if not task:
-        raise HTTPException(status_code=404, detail="Task not found")
+    task = _ensure_lease(db, task_id, x_worker_id)
 
     task.status = "failed"
+    task.lease_expires_at = None
     task.progress = 0.0
     task.error_message = payload.error_message
     task.touch()
     db.commit()
+    publish_task_updates([task_id])
     return {"ok": True}
 
 
+@app.get("/api/admin/cache")
+def get_cache_stats(_: None = Depends(verify_admin_token)):
+    return result_cache.stats()
+
+
+@app.delete("/api/admin/cache")
+def purge_cache(
+    model_version: str,
+    model: str = None,
+    _: None = Depends(verify_admin_token),
+):
+    removed = result_cache.purge(model_version, model)
+    return {"ok": True, "removed": removed}
+
+
 # 挂载前端静态文件（放在最后，避免拦截API路由）
 frontend_dir = Path(__file__).parent.parent / "frontend"
 if frontend_dir.exists():
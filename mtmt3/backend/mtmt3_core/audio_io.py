@@ -0,0 +1,106 @@
+import gc
+import math
+import os
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import soundfile as sf
+    import soxr
+    STREAMING_AVAILABLE = True
+except ImportError:
+    STREAMING_AVAILABLE = False
+
+# 流式解码：按块读取、下混、重采样，直接写入预分配的 float32 缓冲区
+STREAMING_DECODE = os.getenv("MTMT3_STREAMING_DECODE", "1") == "1"
+# 解码结果写入任务目录下的内存映射 .npy，而非常驻内存
+AUDIO_MMAP = os.getenv("MTMT3_AUDIO_MMAP", "0") == "1"
+DECODE_BLOCK_FRAMES = int(os.getenv("MTMT3_DECODE_BLOCK_FRAMES", str(1 << 16)))
+
+MMAP_FILENAME = "audio_16k.npy"
+
+
+def _allocate(length: int, mmap_dir):
+    if mmap_dir is None:
+        return np.empty(length, dtype=np.float32)
+    path = Path(mmap_dir) / MMAP_FILENAME
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return np.lib.format.open_memmap(str(path), mode="w+", dtype=np.float32, shape=(length,))
+
+
+def _load_streaming(audio_path: str, sr: int, mmap_dir, block_frames: int):
+    with sf.SoundFile(audio_path) as f:
+        in_sr = f.samplerate
+        # 预留少量余量，重采样器输出长度可能与估算值相差几个样本
+        expected = math.ceil(f.frames * sr / in_sr)
+        buffer = _allocate(expected + 64, mmap_dir)
+        resampler = soxr.ResampleStream(in_sr, sr, 1, dtype="float32", quality="HQ") if in_sr != sr else None
+
+        written = 0
+        peak = 0.0
+        while True:
+            block = f.read(block_frames, dtype="float32", always_2d=True)
+            last = len(block) < block_frames
+            mono = block.mean(axis=1, dtype=np.float32) if block.shape[1] > 1 else block[:, 0]
+            if resampler is not None:
+                mono = resampler.resample_chunk(mono, last=last)
+            n = min(len(mono), len(buffer) - written)
+            if n > 0:
+                buffer[written:written + n] = mono[:n]
+                peak = max(peak, float(np.max(np.abs(mono[:n]))))
+                written += n
+            if last:
+                break
+
+    return buffer[:written], peak
+
+
+def probe_duration(audio_path: str):
+    """只读文件头获取音频时长（秒），无法识别时返回 None"""
+    if not STREAMING_AVAILABLE:
+        return None
+    try:
+        info = sf.info(audio_path)
+    except Exception:
+        return None
+    return info.frames / info.samplerate if info.samplerate else None
+
+
+def load_audio(audio_path: str, sr: int = 16000, mmap_dir=None, block_frames: int = DECODE_BLOCK_FRAMES):
+    """
+    读取音频为单声道 float32，并在同一遍中统计峰值。
+    返回 (audio, sr, peak)。
+    soundfile 无法解码的格式（如部分 mp3/m4a）回退到 librosa.load。
+    """
+    if STREAMING_DECODE and STREAMING_AVAILABLE:
+        try:
+            audio, peak = _load_streaming(audio_path, sr, mmap_dir if AUDIO_MMAP else None, block_frames)
+            return audio, sr, peak
+        except RuntimeError as e:
+            print(f"流式解码不支持该文件，回退到 librosa: {e}")
+
+    import librosa
+    audio, sr = librosa.load(audio_path, sr=sr, mono=True)
+    peak = float(np.max(np.abs(audio))) if audio.size else 0.0
+    return audio, sr, peak
+
+
+def release_audio(mmap_dir) -> bool:
+    """
+    删除任务目录下的内存映射音频文件（成功、失败、中止都要调用，可重复调用）。
+    调用前应先丢弃对解码结果的引用：Windows 上映射仍被引用时文件无法删除，
+    此时先回收一次循环引用再重试，仍失败时记录日志并返回 False。
+    """
+    if mmap_dir is None:
+        return True
+    path = Path(mmap_dir) / MMAP_FILENAME
+    for attempt in range(2):
+        try:
+            path.unlink(missing_ok=True)
+            return True
+        except OSError as e:
+            if attempt:
+                print(f"内存映射音频文件删除失败: {path}: {e}")
+                return False
+            gc.collect()
@@ -0,0 +1,66 @@
+"""
+worker 能力信息：设备、已加载模型、槽位与实测处理速度。
+worker 启动时与之后定期上报给 API，领取任务时据此分配（见 db.claim_preferences）。
+"""
+import threading
+import time
+
+from .model_registry import get_registry
+from .transcriber import RUNTIME_DEVICE
+
+
+class ThroughputMeter:
+    """处理速度（每秒处理的音频秒数）的指数滑动平均"""
+
+    def __init__(self, alpha: float = 0.3):
+        self.alpha = alpha
+        self.value = None
+        self.tasks_done = 0
+        self._lock = threading.Lock()
+
+    def record(self, audio_seconds: float, elapsed_seconds: float, tasks: int = 1):
+        with self._lock:
+            self.tasks_done += tasks
+            if not audio_seconds or elapsed_seconds <= 0:
+                return
+            speed = audio_seconds / elapsed_seconds
+            self.value = speed if self.value is None else self.alpha * speed + (1 - self.alpha) * self.value
+
+
+def capabilities(slots: int, meter: ThroughputMeter = None) -> dict:
+    """上报给 API 的能力信息"""
+    return {
+        "device": "cuda" if RUNTIME_DEVICE == "cuda" else "cpu",
+        "models": sorted(set(get_registry().loaded())),
+        "slots": max(1, slots),
+        "throughput": round(meter.value, 3) if meter and meter.value is not None else None,
+        "tasks_done": meter.tasks_done if meter else None,
+    }
+
+
+class CapacityReporter:
+    """后台线程每隔 interval 秒调用 report(capabilities)；上报失败只打印，不影响任务处理"""
+
+    def __init__(self, report, slots: int, meter: ThroughputMeter, interval: float):
+        self._report = report
+        self.slots = slots
+        self.meter = meter
+        self.interval = interval
+        self._thread = None
+
+    def report_now(self):
+        try:
+            self._report(capabilities(self.slots, self.meter))
+        except Exception as e:
+            print(f"[worker] capacity report failed: {e}")
+
+    def start(self):
+        """先同步上报一次（领取首个任务前 API 已知道本 worker 的能力），再启动后台线程"""
+        self.report_now()
+        self._thread = threading.Thread(target=self._run, name="capacity-reporter", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.report_now()
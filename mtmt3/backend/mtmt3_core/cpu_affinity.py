@@ -0,0 +1,86 @@
+"""
+CPU 核心划分：多进程 worker 各自绑定一组互不重叠的核心，并把 PyTorch 线程数设为核心数，
+避免每个进程都按全部核心开线程导致相互争抢。
+"""
+import os
+
+# 未配置时每个 worker 使用的核心数（自回归解码的单进程加速比在 4 线程左右趋于平缓）
+DEFAULT_THREADS_PER_WORKER = 4
+
+# supervisor 通过这两个环境变量把划分结果传给子进程
+CPU_CORES_ENV = "MTMT3_CPU_CORES"
+TORCH_THREADS_ENV = "MTMT3_TORCH_THREADS"
+
+
+def available_cores():
+    """当前进程允许使用的 CPU 核心编号"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_worker_cores(cores, workers: int = 0, threads: int = 0, reserved: int = 0):
+    """
+    把核心划分给 worker 进程，返回每个 worker 的核心列表。
+    - workers、threads 都为 0：每个 worker DEFAULT_THREADS_PER_WORKER 个核心，数量按机器推算
+    - 只给 workers：核心平均分配
+    - 只给 threads：按核心数推算 worker 数
+    - reserved：留给 API 与后处理的核心数，从末尾扣除
+    核心不足时多个 worker 会共享同一组核心（至少保证每个 worker 1 个线程）。
+    """
+    cores = list(cores)
+    if reserved > 0 and len(cores) - reserved >= 1:
+        cores = cores[:len(cores) - reserved]
+    total = len(cores)
+
+    if workers <= 0 and threads <= 0:
+        threads = min(DEFAULT_THREADS_PER_WORKER, total)
+    if workers <= 0:
+        workers = max(1, total // threads)
+    if threads <= 0:
+        threads = max(1, total // workers)
+    threads = min(threads, total)
+
+    return [
+        [cores[(i * threads + j) % total] for j in range(threads)]
+        for i in range(workers)
+    ]
+
+
+def worker_env(cores) -> dict:
+    """传给子进程的环境变量；OpenMP/MKL 线程数须在导入 torch 之前确定"""
+    threads = str(len(cores))
+    return {
+        CPU_CORES_ENV: ",".join(str(c) for c in cores),
+        TORCH_THREADS_ENV: threads,
+        "OMP_NUM_THREADS": threads,
+        "MKL_NUM_THREADS": threads,
+    }
+
+
+def bind_current_process():
+    """
+    按 supervisor 传入的环境变量绑定当前进程的核心与 PyTorch 线程数。
+    未设置时不做任何改动（单进程启动时沿用 PyTorch 默认行为）。
+    """
+    cores = [int(c) for c in os.getenv(CPU_CORES_ENV, "").split(",") if c.strip()]
+    threads = int(os.getenv(TORCH_THREADS_ENV, "0") or 0)
+
+    if cores and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, cores)
+        except OSError as e:
+            print(f"[cpu] sched_setaffinity failed: {e}")
+    if threads > 0:
+        try:
+            import torch
+            torch.set_num_threads(threads)
+            # 推理为单请求串行执行，不需要 inter-op 并行
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # inter-op 线程池已初始化时只能保持原状
+            pass
+        except ImportError:
+            pass
+    if cores or threads:
+        print(f"[cpu] pid={os.getpid()} cores={cores or 'all'} torch_threads={threads or 'default'}")
@@ -0,0 +1,105 @@
+import mido
+import numpy as np
+
+# 统一的音符数组格式：时间单位为秒
+NOTE_DTYPE = np.dtype([
+    ("start", np.float64),
+    ("end", np.float64),
+    ("pitch", np.int16),
+    ("velocity", np.int16),
+    ("program", np.int16),
+    ("channel", np.int16),
+])
+
+OUTPUT_TICKS_PER_BEAT = 480
+OUTPUT_TEMPO = mido.bpm2tempo(120)
+
+
+def empty_notes() -> np.ndarray:
+    return np.zeros(0, dtype=NOTE_DTYPE)
+
+
+def midi_to_notes(midi: mido.MidiFile) -> np.ndarray:
+    """把 mido.MidiFile 展开为按起始时间排序的音符数组"""
+    notes = []
+    pending = {}  # (channel, pitch) -> [(start, velocity, program), ...]
+    programs = {}
+    now = 0.0
+    # 迭代 MidiFile 会合并所有轨道，并按 tempo 把 delta time 换算为秒
+    for msg in midi:
+        now += msg.time
+        if msg.type == "program_change":
+            programs[msg.channel] = msg.program
+        elif msg.type == "note_on" and msg.velocity > 0:
+            key = (msg.channel, msg.note)
+            pending.setdefault(key, []).append((now, msg.velocity, programs.get(msg.channel, 0)))
+        elif msg.type in ("note_on", "note_off"):
+            started = pending.get((msg.channel, msg.note))
+            if started:
+                start, velocity, program = started.pop(0)
+                notes.append((start, now, msg.note, velocity, program, msg.channel))
+
+    # 没有 note_off 的音符延续到文件末尾
+    for (channel, pitch), started in pending.items():
+        for start, velocity, program in started:
+            notes.append((start, max(now, start), pitch, velocity, program, channel))
+
+    arr = np.array(notes, dtype=NOTE_DTYPE) if notes else empty_notes()
+    return arr[np.argsort(arr["start"], kind="stable")]
+
+
+def notes_to_midi(notes: np.ndarray, ticks_per_beat: int = OUTPUT_TICKS_PER_BEAT) -> mido.MidiFile:
+    """把音符数组写回单轨 mido.MidiFile（120 BPM）"""
+    midi = mido.MidiFile(ticks_per_beat=ticks_per_beat)
+    track = mido.MidiTrack()
+    midi.tracks.append(track)
+    track.append(mido.MetaMessage("set_tempo", tempo=OUTPUT_TEMPO))
+
+    for channel in np.unique(notes["channel"]):
+        if channel == 9:
+            continue
+        programs = notes["program"][notes["channel"] == channel]
+        if len(programs) and programs[0] != 0:
+            track.append(mido.Message("program_change", program=int(programs[0]), channel=int(channel), time=0))
+
+    ticks_per_second = ticks_per_beat * 1_000_000 / OUTPUT_TEMPO
+    n = len(notes)
+    times = np.concatenate([notes["start"], notes["end"]])
+    ticks = np.round(np.maximum(times, 0.0) * ticks_per_second).astype(np.int64)
+    is_on = np.concatenate([np.ones(n, dtype=bool), np.zeros(n, dtype=bool)])
+    pitches = np.concatenate([notes["pitch"], notes["pitch"]])
+    velocities = np.concatenate([notes["velocity"], np.zeros(n, dtype=np.int16)])
+    channels = np.concatenate([notes["channel"], notes["channel"]])
+    # 同一时刻先关后开，避免同音高的相邻音符被提前截断
+    order = np.lexsort((is_on, ticks))
+
+    last_tick = 0
+    for i in order:
+        track.append(mido.Message(
+            "note_on" if is_on[i] else "note_off",
+            note=int(pitches[i]),
+            velocity=int(np.clip(velocities[i], 0, 127)),
+            channel=int(channels[i]),
+            time=int(ticks[i] - last_tick),
+        ))
+        last_tick = ticks[i]
+    track.append(mido.MetaMessage("end_of_track", time=0))
+    return midi
+
+
+def dedupe_notes(notes: np.ndarray, tolerance: float = 0.05) -> np.ndarray:
+    """合并同一乐器、同一音高且起始时间相差小于 tolerance 的重复音符"""
+    if len(notes) < 2:
+        return notes
+    order = np.lexsort((notes["start"], notes["pitch"], notes["program"], notes["channel"]))
+    s = notes[order]
+    same_key = (
+        (s["channel"][1:] == s["channel"][:-1])
+        & (s["program"][1:] == s["program"][:-1])
+        & (s["pitch"][1:] == s["pitch"][:-1])
+    )
+    dup = np.concatenate([[False], same_key & (np.diff(s["start"]) < tolerance)])
+    group_starts = np.flatnonzero(~dup)
+    merged = s[group_starts].copy()
+    merged["end"] = np.maximum.reduceat(s["end"], group_starts)
+    return merged[np.argsort(merged["start"], kind="stable")]
@@ -0,0 +1,158 @@
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .precision import apply_precision, DEFAULT_PRECISION
+
+# 前端 model 表单字段 -> mt3_infer 模型名
+MODEL_VARIANTS = {
+    "mtmt3_piano_vocal": "mr_mt3",
+    "mtmt3_multi": "mr_mt3",  # 多乐器也使用mr_mt3
+}
+MT3_MODEL_NAMES = {"mr_mt3", "mt3_pytorch", "yourmt3"}
+DEFAULT_MODEL_NAME = "mr_mt3"
+
+# 模型常驻内存预算（MB），0 表示不限制
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MTMT3_MODEL_MEMORY_MB", "0"))
+# worker 启动时预热的模型，逗号分隔，可写表单字段名或 mt3_infer 模型名
+PREWARM_MODELS = [m.strip() for m in os.getenv("MTMT3_PREWARM_MODELS", "").split(",") if m.strip()]
+
+
+def resolve_model_name(model: str) -> str:
+    """根据 model 参数选择 mt3_infer 模型名"""
+    if model in MODEL_VARIANTS:
+        return MODEL_VARIANTS[model]
+    if model in MT3_MODEL_NAMES:
+        return model
+    return DEFAULT_MODEL_NAME
+
+
+def model_aliases(model_names) -> set:
+    """已加载的 mt3_infer 模型名对应的全部 model 参数取值（用于按已加载模型分配任务）"""
+    names = set(model_names)
+    return names | {form for form, name in MODEL_VARIANTS.items() if name in names}
+
+
+def _default_loader(model_name: str, device: str):
+    from mt3_infer import load_model
+    # cache=False：模型生命周期由本注册表管理，淘汰后才能真正释放内存
+    return load_model(model_name, device=device, cache=False)
+
+
+def estimate_model_bytes(model) -> int:
+    """估算模型权重占用的字节数（无法识别时返回 0）"""
+    module = getattr(model, "model", model)
+    try:
+        params = list(module.parameters())
+        buffers = list(module.buffers())
+    except Exception:
+        return 0
+    return sum(t.numel() * t.element_size() for t in params + buffers)
+
+
+def _release_device_memory(device: str):
+    gc.collect()
+    if device.startswith("cuda"):
+        try:
+            import torch
+            torch.cuda.empty_cache()
+        except Exception:
+            pass
+
+
+class ModelRegistry:
+    """
+    进程级模型注册表：每个 (模型, 设备, 精度) 只加载一次并常驻，
+    超出内存预算时按最近最少使用（LRU）淘汰。
+    """
+
+    def __init__(self, memory_budget_mb: float = MODEL_MEMORY_BUDGET_MB, loader=None):
+        self.memory_budget_bytes = int(memory_budget_mb * 1024 * 1024)
+        self._loader = loader or _default_loader
+        self._models = OrderedDict()  # key -> (model, size_bytes)
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def get(self, model_name: str, device: str, precision: str = "fp32"):
+        """
+        返回 (model, load_seconds)；已常驻的模型 load_seconds 为 0.0
+        """
+        key = (model_name, device, precision)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key][0], 0.0
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # 同一模型只允许一个线程加载，其余线程等待后直接复用
+        with load_lock:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    return self._models[key][0], 0.0
+
+            started = time.perf_counter()
+            model = apply_precision(self._loader(model_name, device), precision)
+            load_seconds = time.perf_counter() - started
+            size = estimate_model_bytes(model)
+
+            with self._lock:
+                self._models[key] = (model, size)
+                self._evict_over_budget(keep=key)
+            print(f"[registry] loaded model={model_name} device={device} precision={precision} "
+                  f"size={size / 1024 / 1024:.1f}MB in {load_seconds:.2f}s")
+            return model, load_seconds
+
+    def _evict_over_budget(self, keep):
+        if self.memory_budget_bytes <= 0:
+            return
+        while self.used_bytes() > self.memory_budget_bytes and len(self._models) > 1:
+            key = next(iter(self._models))
+            if key == keep:
+                break
+            self._models.pop(key)
+            print(f"[registry] evicted model={key[0]} device={key[1]} precision={key[2]} (memory budget)")
+            _release_device_memory(key[1])
+
+    def used_bytes(self) -> int:
+        return sum(size for _, size in self._models.values())
+
+    def loaded(self):
+        with self._lock:
+            return [key[0] for key in self._models.keys()]
+
+    def evict(self, model_name: str, device: str, precision: str = "fp32") -> bool:
+        with self._lock:
+            removed = self._models.pop((model_name, device, precision), None)
+        if removed is not None:
+            _release_device_memory(device)
+        return removed is not None
+
+    def clear(self):
+        with self._lock:
+            devices = {key[1] for key in self._models.keys()}
+            self._models.clear()
+        for device in devices:
+            _release_device_memory(device)
+
+    def prewarm(self, models, device: str, precision: str = DEFAULT_PRECISION):
+        for model in models:
+            model_name = resolve_model_name(model)
+            try:
+                self.get(model_name, device, precision)
+            except Exception as e:
+                print(f"[registry] prewarm failed model={model_name}: {e}")
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> ModelRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+        return _registry
@@ -0,0 +1,83 @@
+import io
+from pathlib import Path
+
+import mido
+import numpy as np
+
+from .midi_utils import midi_to_notes
+
+DRUM_CHANNEL = 9
+
+
+def midi_to_bytes(midi: mido.MidiFile) -> bytes:
+    buf = io.BytesIO()
+    midi.save(file=buf)
+    return buf.getvalue()
+
+
+def summarize_notes(notes: np.ndarray) -> dict:
+    """直接从音符数组统计音符数、MIDI 时长与各乐器信息（NumPy 向量化）"""
+    if len(notes) == 0:
+        return {"note_count": 0, "midi_duration": 0.0, "instruments": []}
+
+    is_drum = notes["channel"] == DRUM_CHANNEL
+    # 鼓组不区分 program，统一记为 -1
+    program = np.where(is_drum, -1, notes["program"])
+    lengths = notes["end"] - notes["start"]
+
+    instruments = []
+    for p in np.unique(program):
+        mask = program == p
+        pitches = notes["pitch"][mask]
+        instruments.append({
+            "program": int(p) if p >= 0 else None,
+            "is_drum": bool(p < 0),
+            "note_count": int(mask.sum()),
+            "pitch_min": int(pitches.min()),
+            "pitch_max": int(pitches.max()),
+            "mean_velocity": round(float(notes["velocity"][mask].mean()), 2),
+            "total_seconds": round(float(lengths[mask].sum()), 3),
+        })
+
+    return {
+        "note_count": int(len(notes)),
+        "midi_duration": float(notes["end"].max()),
+        "instruments": instruments,
+    }
+
+
+def midi_stats(midi: mido.MidiFile) -> dict:
+    return summarize_notes(midi_to_notes(midi))
+
+
+def write_musicxml(midi_data: bytes, musicxml_path: str) -> bool:
+    """
+    用 music21 解析一次 MIDI（内存中的字节，不重新读盘）并写出 MusicXML。
+    失败或 music21 不可用时写入占位文件并返回 False。
+    """
+    path = Path(musicxml_path)
+    try:
+        from music21.midi.translate import midiStringToStream
+    except ImportError:
+        path.write_text("<musicxml>music21_not_available</musicxml>", encoding="utf-8")
+        return False
+
+    try:
+        score = midiStringToStream(midi_data)
+        score.write("musicxml", str(path))
+        return True
+    except Exception as e:
+        print(f"MusicXML转换失败: {e}，将创建占位文件")
+        path.write_text("<musicxml>conversion_failed</musicxml>", encoding="utf-8")
+        return False
+
+
+def finalize_result(midi_path: str, musicxml_path: str) -> dict:
+    """
+    流水线模式下在独立进程中执行的后处理：统计音符并写出 MusicXML。
+    只接收路径参数，避免在进程间传递大对象。
+    """
+    midi_data = Path(midi_path).read_bytes()
+    stats = summarize_notes(midi_to_notes(mido.MidiFile(file=io.BytesIO(midi_data))))
+    write_musicxml(midi_data, musicxml_path)
+    return stats
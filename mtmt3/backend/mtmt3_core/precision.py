@@ -0,0 +1,162 @@
+"""
+推理精度模式：
+- fp32：原始权重
+- int8：对 T5 的 Linear 层做动态 int8 量化（仅 CPU）
+- bf16：推理时启用 bfloat16 autocast（CPU 需支持 bf16 指令，否则回落 fp32）
+
+对比命令（报告各模式相对 fp32 的加速比与音符一致率）：
+    python -m backend.mtmt3_core.precision compare sample.wav --modes fp32,int8,bf16
+"""
+import contextlib
+import os
+
+import numpy as np
+
+PRECISION_MODES = ("fp32", "int8", "bf16")
+# worker 默认精度，任务未指定时使用；取值由 check_default_precision() 在 worker 启动时校验
+DEFAULT_PRECISION = os.getenv("MTMT3_PRECISION", "fp32").strip().lower() or "fp32"
+
+
+def check_default_precision():
+    """worker / supervisor 启动时调用：MTMT3_PRECISION 无效时直接退出，而不是让每个任务在加载模型时失败"""
+    if DEFAULT_PRECISION not in PRECISION_MODES:
+        raise SystemExit(f"Invalid MTMT3_PRECISION={os.getenv('MTMT3_PRECISION')!r}, "
+                         f"expected one of {', '.join(PRECISION_MODES)}")
+
+
+def normalize_precision(precision) -> str:
+    """空值表示使用 worker 默认精度；未知取值抛出 ValueError"""
+    value = (precision or "").strip().lower() or DEFAULT_PRECISION
+    if value not in PRECISION_MODES:
+        raise ValueError(f"Unsupported precision '{precision}', expected one of {', '.join(PRECISION_MODES)}")
+    return value
+
+
+def cpu_supports_bf16() -> bool:
+    try:
+        import torch
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception:
+        return False
+
+
+def effective_precision(precision: str, device: str) -> str:
+    """根据设备能力确定实际可用的精度"""
+    if precision == "int8" and device != "cpu":
+        print("int8 动态量化仅支持 CPU，回落到 fp32")
+        return "fp32"
+    if precision == "bf16" and device == "cpu" and not cpu_supports_bf16():
+        print("当前 CPU 不支持 bf16，回落到 fp32")
+        return "fp32"
+    return precision
+
+
+def apply_precision(model, precision: str):
+    """对已加载的 mt3_infer 适配器应用权重层面的精度转换（仅 int8 需要）"""
+    if precision != "int8":
+        return model
+    import torch
+    module = getattr(model, "model", None)
+    if not isinstance(module, torch.nn.Module):
+        print("模型未暴露 torch 模块，跳过 int8 量化")
+        return model
+    model.model = torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def precision_context(precision: str, device: str):
+    """推理期间的 autocast 上下文；autocast 是线程局部的，需在执行推理的线程内进入"""
+    if precision != "bf16":
+        return contextlib.nullcontext()
+    import torch
+    return torch.autocast(device_type="cuda" if device.startswith("cuda") else "cpu", dtype=torch.bfloat16)
+
+
+def note_agreement(reference: np.ndarray, estimate: np.ndarray, onset_tolerance: float = 0.05) -> dict:
+    """音符级一致率：音高相同且起始时间相差不超过 onset_tolerance 视为匹配"""
+    matched = 0
+    for pitch in np.unique(np.concatenate([reference["pitch"], estimate["pitch"]])):
+        ref = np.sort(reference["start"][reference["pitch"] == pitch])
+        est = np.sort(estimate["start"][estimate["pitch"] == pitch])
+        i = j = 0
+        while i < len(ref) and j < len(est):
+            if abs(ref[i] - est[j]) <= onset_tolerance:
+                matched += 1
+                i += 1
+                j += 1
+            elif ref[i] < est[j]:
+                i += 1
+            else:
+                j += 1
+    precision = matched / len(estimate) if len(estimate) else 1.0
+    recall = matched / len(reference) if len(reference) else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"matched": matched, "precision": precision, "recall": recall, "f1": f1}
+
+
+def compare(audio_path: str, model: str, modes, max_seconds: float = None, repeat: int = 1):
+    import time
+    from .audio_io import load_audio
+    from .midi_utils import midi_to_notes
+    from .model_registry import ModelRegistry, resolve_model_name
+    from .transcriber import infer_midi, _target_device
+
+    audio, sr, peak = load_audio(audio_path, sr=16000)
+    if max_seconds:
+        audio = audio[:int(max_seconds * sr)]
+    if peak > 1.0:
+        audio = audio / peak
+    device = _target_device()
+    model_name = resolve_model_name(model)
+    print(f"对比音频: {audio_path} ({len(audio) / sr:.1f}秒), 模型={model_name}, 设备={device}")
+
+    results = {}
+    for mode in modes:
+        mode = effective_precision(normalize_precision(mode), device)
+        if mode in results:
+            continue
+        # 每种精度单独加载，不与常驻模型共享
+        registry = ModelRegistry(memory_budget_mb=0)
+        mt3_model, load_seconds = registry.get(model_name, device, mode)
+        elapsed = []
+        midi = None
+        for _ in range(max(1, repeat)):
+            started = time.perf_counter()
+            midi = infer_midi(mt3_model, audio, sr, device, mode)
+            elapsed.append(time.perf_counter() - started)
+        results[mode] = {"load": load_seconds, "seconds": min(elapsed), "notes": midi_to_notes(midi)}
+        registry.clear()
+
+    baseline = results.get("fp32")
+    print(f"{'mode':<6} {'load(s)':>8} {'infer(s)':>9} {'speedup':>8} {'notes':>6} {'F1':>6} {'P':>6} {'R':>6}")
+    for mode, r in results.items():
+        if baseline:
+            speedup = baseline["seconds"] / r["seconds"] if r["seconds"] else float("inf")
+            agree = note_agreement(baseline["notes"], r["notes"])
+            print(f"{mode:<6} {r['load']:>8.2f} {r['seconds']:>9.2f} {speedup:>7.2f}x {len(r['notes']):>6} "
+                  f"{agree['f1']:>6.3f} {agree['precision']:>6.3f} {agree['recall']:>6.3f}")
+        else:
+            print(f"{mode:<6} {r['load']:>8.2f} {r['seconds']:>9.2f} {'-':>8} {len(r['notes']):>6}")
+    return results
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="MR-MT3 推理精度模式对比")
+    sub = parser.add_subparsers(dest="command", required=True)
+    cmp_parser = sub.add_parser("compare", help="对比各精度模式的速度与音符一致率（以 fp32 为基准）")
+    cmp_parser.add_argument("audio")
+    cmp_parser.add_argument("--model", default="mtmt3_piano_vocal")
+    cmp_parser.add_argument("--modes", default=",".join(PRECISION_MODES))
+    cmp_parser.add_argument("--seconds", type=float, default=None, help="只使用前 N 秒音频")
+    cmp_parser.add_argument("--repeat", type=int, default=1, help="每种模式重复推理次数，取最快一次")
+    args = parser.parse_args(argv)
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    # fp32 始终作为基准，且最先运行
+    modes = ["fp32"] + [m for m in modes if m != "fp32"]
+    compare(args.audio, args.model, modes, args.seconds, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import os
+import threading
+import time
+
+# 进度上报限流（同一阶段内）：变化不足 MIN_DELTA 或距上次上报不足 MIN_INTERVAL 秒时不上报
+PROGRESS_MIN_DELTA = float(os.getenv("MTMT3_PROGRESS_MIN_DELTA", "0.02"))
+PROGRESS_MIN_INTERVAL = float(os.getenv("MTMT3_PROGRESS_MIN_INTERVAL", "2.0"))
+
+
+class TaskAborted(Exception):
+    """进度回调抛出此异常表示任务已不属于当前 worker（如租约被回收），应立即中止"""
+
+
+class ProgressReporter:
+    """
+    包装 progress_callback(stage, progress)：
+    - 只上报单调递增的进度
+    - 阶段变化时总是上报（视同 force），短任务的各个阶段也能及时送达
+    - 同一阶段内同时满足变化幅度与时间间隔两个条件才上报，force=True 时跳过这两项限制
+    """
+
+    def __init__(self, callback, min_delta: float = PROGRESS_MIN_DELTA,
+                 min_interval: float = PROGRESS_MIN_INTERVAL, clock=time.monotonic):
+        self._callback = callback
+        self.min_delta = min_delta
+        self.min_interval = min_interval
+        self._clock = clock
+        self._last_progress = 0.0
+        self._last_time = None
+        self._last_stage = None
+        self._lock = threading.Lock()
+
+    def report(self, stage: str, progress: float, force: bool = False) -> bool:
+        if self._callback is None:
+            return False
+        with self._lock:
+            now = self._clock()
+            force = force or stage != self._last_stage
+            if progress - self._last_progress < (1e-6 if force else self.min_delta):
+                return False
+            if not force and self._last_time is not None and now - self._last_time < self.min_interval:
+                return False
+            self._last_progress = progress
+            self._last_time = now
+            self._last_stage = stage
+        try:
+            self._callback(stage, progress)
+        except TaskAborted:
+            raise
+        except Exception as e:
+            # 上报失败不影响转谱主流程
+            print(f"进度上报失败: {e}")
+        return True
+
+    def stage_range(self, stage: str, start: float, end: float):
+        """返回 on_done(done, total) 回调，把已完成的工作量映射到 [start, end]"""
+        def on_done(done: int, total: int):
+            fraction = done / total if total else 1.0
+            self.report(stage, start + (end - start) * fraction, force=done >= total)
+        return on_done
@@ -0,0 +1,209 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+
+from .midi_utils import midi_to_notes, notes_to_midi, dedupe_notes, empty_notes
+from .precision import precision_context
+
+# 分段推理配置
+SEGMENTED_MODE = os.getenv("MTMT3_SEGMENTED", "auto")  # auto / 1 / 0
+SEGMENT_SECONDS = float(os.getenv("MTMT3_SEGMENT_SECONDS", "30"))
+SEGMENT_OVERLAP_SECONDS = float(os.getenv("MTMT3_SEGMENT_OVERLAP", "2"))
+# 每批送入模型的分段数，按设备分别配置
+BATCH_SIZES = {
+    "cpu": int(os.getenv("MTMT3_BATCH_SIZE_CPU", "2")),
+    "cuda": int(os.getenv("MTMT3_BATCH_SIZE_CUDA", "8")),
+}
+# CPU 上并行执行的批次数（各批次由不同线程推理，PyTorch 计算时会释放 GIL）
+CPU_PARALLEL_BATCHES = int(os.getenv("MTMT3_CPU_PARALLEL", "1"))
+# 重叠区去重时，同音高起始时间的容差（秒）
+DEDUP_TOLERANCE = 0.05
+
+
+@dataclass
+class Segment:
+    index: int
+    start: int         # 起始样本（绝对位置）
+    end: int           # 结束样本（不含）
+    keep_start: float  # 只保留起始时间落在 [keep_start, keep_end) 内的音符（秒）
+    keep_end: float
+
+
+def use_segmented(num_samples: int, sr: int) -> bool:
+    if SEGMENTED_MODE == "1":
+        return True
+    if SEGMENTED_MODE == "0":
+        return False
+    return num_samples > SEGMENT_SECONDS * sr
+
+
+def plan_segments(num_samples: int, sr: int, window_seconds: float = None, overlap_seconds: float = None):
+    """
+    把音频切分为固定长度、首尾重叠的窗口。
+    相邻窗口以重叠区中点为界划分音符归属，避免重复。
+    """
+    window = int((window_seconds or SEGMENT_SECONDS) * sr)
+    overlap = int((SEGMENT_OVERLAP_SECONDS if overlap_seconds is None else overlap_seconds) * sr)
+    overlap = min(max(overlap, 0), window // 2)
+    step = window - overlap
+
+    starts = list(range(0, max(num_samples - overlap, 1), step))
+    segments = []
+    for i, start in enumerate(starts):
+        end = min(start + window, num_samples)
+        keep_start = 0.0 if i == 0 else (start + overlap / 2) / sr
+        keep_end = float("inf") if i == len(starts) - 1 else (starts[i + 1] + overlap / 2) / sr
+        segments.append(Segment(i, start, end, keep_start, keep_end))
+    return segments
+
+
+def _slice_outputs(outputs: dict, total: int, offset: int, count: int) -> dict:
+    sliced = {}
+    for key, value in outputs.items():
+        if hasattr(value, "__len__") and len(value) == total:
+            sliced[key] = value[offset:offset + count]
+        else:
+            sliced[key] = value
+    return sliced
+
+
+def _transcribe_batch(model, chunks, sr: int):
+    """
+    一批分段合并成一次前向推理。
+    mt3_infer 适配器提供 preprocess/forward/decode 时，把各段特征拼成同一个 batch；
+    否则逐段调用 model.transcribe。
+    """
+    if len(chunks) > 1 and all(hasattr(model, attr) for attr in ("preprocess", "forward", "decode")):
+        features = [model.preprocess(chunk, sr) for chunk in chunks]
+        if all(isinstance(f, dict) and "inputs" in f and "frame_times" in f for f in features):
+            import torch
+
+            counts = [f["inputs"].shape[0] for f in features]
+            total = sum(counts)
+            merged = {
+                "inputs": torch.cat([f["inputs"] for f in features], dim=0),
+                "frame_times": np.concatenate([f["frame_times"] for f in features], axis=0),
+                "paddings": [p for f in features for p in f.get("paddings", [])],
+            }
+            outputs = model.forward(merged)
+            midis = []
+            offset = 0
+            for count in counts:
+                midis.append(model.decode(_slice_outputs(outputs, total, offset, count)))
+                offset += count
+            return midis
+    return [model.transcribe(chunk, sr=sr) for chunk in chunks]
+
+
+def _segment_notes(midi, segment: Segment, sr: int) -> np.ndarray:
+    notes = midi_to_notes(midi)
+    offset = segment.start / sr
+    notes["start"] += offset
+    notes["end"] += offset
+    keep = (notes["start"] >= segment.keep_start) & (notes["start"] < segment.keep_end)
+    return notes[keep]
+
+
+def _run_batches(run, batches, parallel: int):
+    """逐批或用线程池并行执行 run(batch)；CPU 上多个批次由不同线程推理"""
+    if parallel > 1 and len(batches) > 1:
+        with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="mtmt3-seg") as pool:
+            list(pool.map(run, batches))
+    else:
+        for batch in batches:
+            run(batch)
+
+
+def transcribe_segments(model, audio: np.ndarray, sr: int, segments, batch_size: int,
+                        parallel: int = 1, on_batch_done=None, precision: str = "fp32", device: str = "cpu"):
+    """
+    按批推理所有分段，返回每个分段（已换算为绝对时间）的音符数组列表。
+    on_batch_done(done_segments, total_segments) 在每批完成后调用。
+    """
+    batch_size = max(1, batch_size)
+    batches = [segments[i:i + batch_size] for i in range(0, len(segments), batch_size)]
+    results = [empty_notes() for _ in segments]
+    done = [0]
+    lock = threading.Lock()
+
+    def run(batch):
+        # autocast 是线程局部的，在执行推理的线程内进入
+        with precision_context(precision, device):
+            midis = _transcribe_batch(model, [audio[s.start:s.end] for s in batch], sr)
+        for segment, midi in zip(batch, midis):
+            results[segment.index] = _segment_notes(midi, segment, sr)
+        if on_batch_done:
+            with lock:
+                done[0] += len(batch)
+                on_batch_done(done[0], len(segments))
+
+    _run_batches(run, batches, parallel)
+    return results
+
+
+def stitch_segments(per_segment_notes) -> np.ndarray:
+    """拼接各分段音符，并去除重叠区内的重复音符"""
+    if not per_segment_notes:
+        return empty_notes()
+    notes = np.concatenate(per_segment_notes)
+    return dedupe_notes(notes, DEDUP_TOLERANCE)
+
+
+def transcribe_segmented(model, audio: np.ndarray, sr: int, device: str, on_batch_done=None,
+                         precision: str = "fp32"):
+    """分段、分批推理整段音频，返回拼接后的 mido.MidiFile"""
+    segments = plan_segments(len(audio), sr)
+    batch_size = BATCH_SIZES.get(device, BATCH_SIZES["cpu"])
+    parallel = CPU_PARALLEL_BATCHES if device == "cpu" else 1
+    print(f"分段推理: {len(segments)} 段, 每批 {batch_size} 段, 并行批次 {parallel}")
+    per_segment = transcribe_segments(model, audio, sr, segments, batch_size, parallel, on_batch_done,
+                                      precision, device)
+    return notes_to_midi(stitch_segments(per_segment))
+
+
+def transcribe_many(model, audios, sr: int, device: str, on_task_progress=None, precision: str = "fp32",
+                    batch_size: int = None, parallel: int = None):
+    """
+    多段独立音频（不同任务）共用模型批次推理，返回与 audios 对应的 mido.MidiFile 列表。
+    短音频整段作为一个分段，长音频按 plan_segments 切分；所有分段按顺序打包成批，
+    一批可以包含多个任务的分段，推理后按任务拆分并各自拼接。
+    on_task_progress(task_index, done_segments, total_segments) 在某任务有分段完成时调用。
+    与 transcribe_segments 相同，CPU 上按 CPU_PARALLEL_BATCHES 并行执行多个批次。
+    """
+    batch_size = max(1, batch_size or BATCH_SIZES.get(device, BATCH_SIZES["cpu"]))
+    if parallel is None:
+        parallel = CPU_PARALLEL_BATCHES if device == "cpu" else 1
+    items = []  # [(task_index, segment)]
+    for t, audio in enumerate(audios):
+        if use_segmented(len(audio), sr):
+            segments = plan_segments(len(audio), sr)
+        else:
+            segments = [Segment(0, 0, len(audio), 0.0, float("inf"))]
+        items.extend((t, segment) for segment in segments)
+
+    per_task = [[None] * sum(1 for t, _ in items if t == i) for i in range(len(audios))]
+    done = [0] * len(audios)
+    lock = threading.Lock()
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    print(f"批量推理: {len(audios)} 个任务, {len(items)} 段, 每批 {batch_size} 段, 共 {len(batches)} 批, "
+          f"并行批次 {parallel}")
+
+    def run(batch):
+        # autocast 是线程局部的，在执行推理的线程内进入
+        with precision_context(precision, device):
+            midis = _transcribe_batch(model, [audios[t][s.start:s.end] for t, s in batch], sr)
+        for (t, segment), midi in zip(batch, midis):
+            per_task[t][segment.index] = _segment_notes(midi, segment, sr)
+        with lock:
+            for t, _ in batch:
+                done[t] += 1
+            if on_task_progress:
+                for t in sorted({t for t, _ in batch}):
+                    on_task_progress(t, done[t], len(per_task[t]))
+
+    _run_batches(run, batches, parallel)
+
+    return [notes_to_midi(stitch_segments(notes)) for notes in per_task]
@@ -0,0 +1,130 @@
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+from .midi_utils import midi_to_notes, notes_to_midi
+
+# 静音跳过：按帧 RMS 能量找出长静音段，只把有声区域送入模型
+SKIP_SILENCE = os.getenv("MTMT3_SKIP_SILENCE", "1") == "1"
+# 帧能量低于峰值该分贝数时视为静音（相对峰值，音量偏小的录音同样适用）
+SILENCE_THRESHOLD_DB = float(os.getenv("MTMT3_SILENCE_DB", "-50"))
+# 连续静音达到该长度才跳过（秒），短停顿仍交给模型
+SILENCE_MIN_SECONDS = float(os.getenv("MTMT3_SILENCE_MIN_SECONDS", "2.0"))
+# 有声区域两端保留的余量（秒），保护起音与余音
+SILENCE_PAD_SECONDS = float(os.getenv("MTMT3_SILENCE_PAD_SECONDS", "0.25"))
+# 短于该长度的孤立有声区域（如爆音）视为静音，0 表示全部保留
+ACTIVE_MIN_SECONDS = float(os.getenv("MTMT3_ACTIVE_MIN_SECONDS", "0"))
+FRAME_SECONDS = 0.02
+
+
+@dataclass
+class ActivePlan:
+    regions: list          # [(start_sample, end_sample), ...]，按时间排序、互不重叠
+    total_samples: int
+    sr: int
+
+    @property
+    def active_samples(self) -> int:
+        return sum(end - start for start, end in self.regions)
+
+    @property
+    def skipped_seconds(self) -> float:
+        return (self.total_samples - self.active_samples) / self.sr
+
+    @property
+    def is_trivial(self) -> bool:
+        """没有可跳过的部分"""
+        return self.active_samples == self.total_samples
+
+
+def frame_rms_db(audio: np.ndarray, frame: int) -> np.ndarray:
+    """不重叠分帧的 RMS 能量（dBFS），末尾不足一帧的部分单独成帧"""
+    n_full = len(audio) // frame
+    frames = audio[:n_full * frame].reshape(n_full, frame)
+    # einsum 逐帧求平方和，不生成整段音频的平方副本
+    energy = np.einsum("ij,ij->i", frames, frames, dtype=np.float64) / frame
+    tail = audio[n_full * frame:]
+    if len(tail):
+        energy = np.append(energy, np.dot(tail, tail) / len(tail))
+    return 10.0 * np.log10(np.maximum(energy, 1e-20))
+
+
+def _runs(mask: np.ndarray):
+    """返回 mask 中连续 True 段的 (start, end) 帧下标"""
+    padded = np.concatenate([[False], mask, [False]])
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    return edges[0::2], edges[1::2]
+
+
+def find_active_regions(audio: np.ndarray, sr: int, peak: float = None,
+                        threshold_db: float = SILENCE_THRESHOLD_DB,
+                        min_silence_seconds: float = SILENCE_MIN_SECONDS,
+                        pad_seconds: float = SILENCE_PAD_SECONDS,
+                        min_active_seconds: float = ACTIVE_MIN_SECONDS) -> ActivePlan:
+    total = len(audio)
+    frame = max(1, int(FRAME_SECONDS * sr))
+    if total == 0:
+        return ActivePlan([], 0, sr)
+
+    if peak is None:
+        peak = float(np.max(np.abs(audio)))
+    if peak <= 0:
+        # 全静音
+        return ActivePlan([], total, sr)
+    active = frame_rms_db(audio, frame) > threshold_db + 20.0 * np.log10(peak)
+
+    # 去掉过短的孤立有声段
+    if min_active_seconds > 0:
+        starts, ends = _runs(active)
+        short = (ends - starts) * frame < min_active_seconds * sr
+        for s, e in zip(starts[short], ends[short]):
+            active[s:e] = False
+
+    # 只有足够长的静音段才跳过，其余短停顿并入有声区域
+    starts, ends = _runs(~active)
+    long_enough = (ends - starts) * frame >= min_silence_seconds * sr
+    skip = np.zeros_like(active)
+    for s, e in zip(starts[long_enough], ends[long_enough]):
+        skip[s:e] = True
+
+    pad = int(pad_seconds * sr)
+    regions = []
+    for s, e in zip(*_runs(~skip)):
+        start = max(0, s * frame - pad)
+        end = min(total, e * frame + pad)
+        if regions and start <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], end)
+        else:
+            regions.append((start, end))
+    return ActivePlan(regions, total, sr)
+
+
+def compact_audio(audio: np.ndarray, plan: ActivePlan) -> np.ndarray:
+    """把有声区域首尾相接拼成一段音频"""
+    if plan.is_trivial:
+        return audio
+    if not plan.regions:
+        return audio[:0]
+    return np.concatenate([audio[start:end] for start, end in plan.regions])
+
+
+def restore_note_times(midi, plan: ActivePlan):
+    """把拼接后音频上的音符时间换算回原音频中的绝对位置，返回新的 mido.MidiFile"""
+    if plan.is_trivial:
+        return midi
+    notes = midi_to_notes(midi)
+    if len(notes) == 0 or not plan.regions:
+        return notes_to_midi(notes[:0])
+
+    sr = plan.sr
+    lengths = np.array([end - start for start, end in plan.regions], dtype=np.int64)
+    compact_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]) / sr
+    region_starts = np.array([start for start, _ in plan.regions], dtype=np.float64) / sr
+
+    # 按起始时间所在的区域平移，音符时长保持不变
+    idx = np.clip(np.searchsorted(compact_starts, notes["start"], side="right") - 1, 0, len(lengths) - 1)
+    shift = region_starts[idx] - compact_starts[idx]
+    notes["start"] += shift
+    notes["end"] += shift
+    return notes_to_midi(notes)
@@ -1,10 +1,17 @@
 import os
 import time
-import threading
 import inspect
+import traceback
 from pathlib import Path
-import librosa
-import numpy as np
+
+from .model_registry import get_registry, resolve_model_name, PREWARM_MODELS
+from .segmentation import use_segmented, transcribe_segmented, transcribe_many
+from .audio_io import load_audio, release_audio
+from .postprocess import midi_to_bytes, midi_stats, write_musicxml
+from .progress import ProgressReporter, TaskAborted
+from .precision import normalize_precision, effective_precision, precision_context
+from .silence import SKIP_SILENCE, find_active_regions, compact_audio, restore_note_times
+from .midi_utils import empty_notes, notes_to_midi
 
 def _configure_runtime_device():
     """
@@ -34,7 +41,7 @@ def _configure_runtime_device():
 RUNTIME_DEVICE = _configure_runtime_device()
 
 try:
-    from mt3_infer import transcribe
+    from mt3_infer import load_model  # noqa: F401  模型由 model_registry 加载
     MT3_AVAILABLE = True
 except ImportError:
     MT3_AVAILABLE = False
@@ -74,14 +81,171 @@ def _patch_mt3_transformers_compat():
 
 _patch_mt3_transformers_compat()
 
+def _target_device():
+    return "cuda" if RUNTIME_DEVICE == "cuda" else "cpu"
+
+
+def prewarm_models(models=None):
+    """worker 启动时预加载模型，避免首个任务承担加载耗时"""
+    models = PREWARM_MODELS if models is None else models
+    if not MT3_AVAILABLE or not models:
+        return
+    device = _target_device()
+    get_registry().prewarm(models, device, effective_precision(normalize_precision(None), device))
+
+
+def infer_midi(mt3_model, audio, sr: int, device: str, precision: str = "fp32", on_batch_done=None):
+    """对整段音频推理，返回 mido.MidiFile；长音频走分段批量推理"""
+    if use_segmented(len(audio), sr):
+        # 长音频：固定窗口分段，按批推理后拼接
+        return transcribe_segmented(mt3_model, audio, sr, device, on_batch_done=on_batch_done,
+                                    precision=precision)
+    with precision_context(precision, device):
+        return mt3_model.transcribe(audio, sr=sr)
+
+
 try:
-    from music21 import converter, stream
+    from music21 import stream
     MUSIC21_AVAILABLE = True
 except ImportError:
     MUSIC21_AVAILABLE = False
     print("警告: music21 未安装，无法生成MusicXML文件")
 
 
+def _mock_result(model: str, output_dir: str, precision: str = None):
+    """mt3_infer 不可用时的模拟结果"""
+    out_dir = Path(output_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    midi_path = out_dir / "result.mid"
+    musicxml_path = out_dir / "result.musicxml"
+
+    print("使用模拟模式（mt3_infer未安装）")
+    time.sleep(5)
+    midi_path.write_bytes(b"dummy midi")
+    if MUSIC21_AVAILABLE:
+        try:
+            # 尝试创建简单的MusicXML
+            score = stream.Score()
+            score.write('musicxml', musicxml_path)
+        except:
+            musicxml_path.write_text("<musicxml>dummy</musicxml>", encoding="utf-8")
+    else:
+        musicxml_path.write_text("<musicxml>dummy</musicxml>", encoding="utf-8")
+
+    return {
+        "midi_path": str(midi_path),
+        "musicxml_path": str(musicxml_path),
+        "duration": 120.0,
+        "note_count": 500,
+        "model_name": resolve_model_name(model),
+        "model_load_seconds": 0.0,
+        "precision": precision,
+        "skipped_seconds": 0.0,
+    }
+
+
+def _load_model(model: str, precision: str):
+    """根据model参数选择模型，从进程级注册表获取（已常驻则无需重新加载）"""
+    model_name = resolve_model_name(model)
+    target_device = _target_device()
+    precision = effective_precision(normalize_precision(precision), target_device)
+    mt3_model, model_load_seconds = get_registry().get(model_name, target_device, precision)
+    if model_load_seconds > 0:
+        print(f"模型加载完成: {model_name} ({precision})，耗时 {model_load_seconds:.2f}秒")
+    else:
+        print(f"复用已加载模型: {model_name} ({precision})")
+    return model_name, target_device, precision, mt3_model, model_load_seconds
+
+
+class _PreparedAudio:
+    """解码、归一化并去除长静音后的音频，model_audio 为实际送入模型的部分"""
+
+    def __init__(self, audio_path: str, out_dir: Path, reporter: ProgressReporter, decoded_audio=None):
+        # 1. 读取音频文件，转换为单声道、16kHz
+        reporter.report("loading_audio", 0.10)  # 10%
+        if decoded_audio is not None:
+            audio, sr, max_val = decoded_audio
+        else:
+            print(f"正在加载音频: {audio_path}")
+            # 流式解码+重采样，峰值在同一遍中统计
+            audio, sr, max_val = load_audio(audio_path, sr=16000, mmap_dir=out_dir)
+        print(f"音频加载完成: shape={audio.shape}, sample_rate={sr}")
+
+        # 2. 归一化到 [-1, 1]
+        reporter.report("normalizing", 0.15)  # 15%
+        if max_val > 1.0:
+            audio /= max_val
+            print(f"已归一化音频，max={max_val:.3f} -> 1.0")
+
+        # 跳过长静音段，只把有声区域拼接后送入模型
+        self.plan = find_active_regions(audio, sr, peak=min(max_val, 1.0)) if SKIP_SILENCE else None
+        self.model_audio = compact_audio(audio, self.plan) if self.plan else audio
+        self.skipped_seconds = self.plan.skipped_seconds if self.plan else 0.0
+        if self.skipped_seconds > 0:
+            print(f"跳过静音 {self.skipped_seconds:.1f}秒，实际推理 {len(self.model_audio) / sr:.1f}秒"
+                  f"（{len(self.plan.regions)} 个有声区域）")
+        self.sr = sr
+        self.duration = len(audio) / sr
+        self.out_dir = out_dir
+
+    def release(self):
+        """丢弃音频引用并删除内存映射文件（可重复调用）"""
+        self.model_audio = None
+        release_audio(self.out_dir)
+
+    def restore(self, midi):
+        """音符时间换算回原音频中的绝对位置，并释放音频"""
+        self.release()
+        if self.plan:
+            midi = restore_note_times(midi, self.plan)
+        return midi
+
+
+def _save_outputs(midi, prepared: _PreparedAudio, reporter: ProgressReporter, defer_postprocess: bool,
+                  meta: dict) -> dict:
+    """保存MIDI，统计音符并转换MusicXML，返回任务结果"""
+    midi_path = prepared.out_dir / "result.mid"
+    musicxml_path = prepared.out_dir / "result.musicxml"
+
+    # 转谱完成，更新进度到80%
+    reporter.report("transcribing_done", 0.80, force=True)  # 80%
+    print("转谱完成！")
+
+    # 4. 保存MIDI文件
+    reporter.report("saving_midi", 0.85)  # 85%
+    print("正在保存MIDI文件...")
+    midi_data = midi_to_bytes(midi)
+    midi_path.write_bytes(midi_data)
+    print(f"MIDI文件已保存: {midi_path}")
+
+    # 5. 音频时长
+    duration = prepared.duration
+    result = dict(
+        meta,
+        midi_path=str(midi_path),
+        musicxml_path=str(musicxml_path),
+        duration=duration,
+        skipped_seconds=prepared.skipped_seconds,
+    )
+
+    if defer_postprocess:
+        print(f"推理完成，后处理已延后: 时长={duration:.2f}秒")
+        return dict(result, note_count=None, postprocess_pending=True)
+
+    # 6. 直接从MIDI事件统计音符数量与乐器信息（不经过music21）
+    stats = midi_stats(midi)
+    note_count = stats["note_count"]
+
+    # 7. 转换为MusicXML（music21 只解析一次）
+    reporter.report("converting_musicxml", 0.90)  # 90%
+    print("正在转换为MusicXML...")
+    if write_musicxml(midi_data, str(musicxml_path)):
+        print(f"MusicXML文件已保存: {musicxml_path}")
+
+    print(f"转谱完成: 时长={duration:.2f}秒, 音符数={note_count}")
+    return dict(result, note_count=note_count, instruments=stats["instruments"])
+
+
 def run_mtmt3(
     audio_path: str,
     model: str,
@@ -89,155 +253,159 @@ def run_mtmt3(
     quantization: str,
     output_dir: str,
     progress_callback=None,
+    defer_postprocess: bool = False,
+    precision: str = None,
+    decoded_audio=None,
 ):
     """
     使用MR-MT3模型进行音乐转谱（自动设备检测，无GPU则CPU）
+    defer_postprocess=True 时只保存MIDI，音符统计与MusicXML转换交给调用方
+    （见 postprocess.finalize_result），返回结果中 postprocess_pending 为 True
+    precision 为推理精度（fp32/int8/bf16），为空时使用 worker 默认精度 MTMT3_PRECISION
+    decoded_audio 为调用方已解码的 load_audio() 返回值 (audio, sr, peak)，提供时跳过解码
+    （远程 worker 在推理上一个任务时预先下载并解码下一个任务）
     """
-    out_dir = Path(output_dir)
-    out_dir.mkdir(parents=True, exist_ok=True)
-
-    midi_path = out_dir / "result.mid"
-    musicxml_path = out_dir / "result.musicxml"
-
     if not MT3_AVAILABLE:
         # 如果mt3_infer不可用，使用模拟模式
-        print("使用模拟模式（mt3_infer未安装）")
-        time.sleep(5)
-        midi_path.write_bytes(b"dummy midi")
-        if MUSIC21_AVAILABLE:
-            try:
-                # 尝试创建简单的MusicXML
-                score = stream.Score()
-                score.write('musicxml', musicxml_path)
-            except:
-                musicxml_path.write_text("<musicxml>dummy</musicxml>", encoding="utf-8")
-        else:
-            musicxml_path.write_text("<musicxml>dummy</musicxml>", encoding="utf-8")
-        
-        return {
-            "midi_path": str(midi_path),
-            "musicxml_path": str(musicxml_path),
-            "duration": 120.0,
-            "note_count": 500,
-        }
+        return _mock_result(model, output_dir, precision)
 
-    try:
-        # 1. 读取音频文件，转换为单声道、16kHz
-        if progress_callback:
-            progress_callback("loading_audio", 0.10)  # 10%
-        print(f"正在加载音频: {audio_path}")
-        audio, sr = librosa.load(audio_path, sr=16000, mono=True)
-        print(f"音频加载完成: shape={audio.shape}, sample_rate={sr}")
+    out_dir = Path(output_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    # 进度按变化幅度与时间间隔限流，避免无意义的数据库写入
+    reporter = ProgressReporter(progress_callback)
 
-        # 2. 归一化到 [-1, 1]
-        if progress_callback:
-            progress_callback("normalizing", 0.15)  # 15%
-        max_val = np.max(np.abs(audio))
-        if max_val > 1.0:
-            audio = audio / max_val
-            print(f"已归一化音频，max={max_val:.3f} -> 1.0")
+    prepared = None
+    try:
+        prepared = _PreparedAudio(audio_path, out_dir, reporter, decoded_audio)
+        decoded_audio = None
 
         # 3. 使用MR-MT3进行转谱（自动设备检测）
-        if progress_callback:
-            progress_callback("transcribing", 0.20)  # 20% - 开始转谱
+        reporter.report("transcribing", 0.20)  # 20% - 开始转谱
         print(f"开始使用MR-MT3转谱（设备: {RUNTIME_DEVICE}）...")
         if RUNTIME_DEVICE.startswith("cpu"):
             print("提示: 当前为 CPU 模式，处理速度较慢属正常，处理时间取决于音频长度。")
-        
-        # 根据model参数选择模型
-        model_name = "mr_mt3"  # 默认使用mr_mt3
-        if model == "mtmt3_multi":
-            model_name = "mr_mt3"  # 多乐器也使用mr_mt3
-        
-        # 启动进度更新线程（模拟进度，让用户知道系统还在工作）
-        progress_stop = threading.Event()
-        if progress_callback:
-            def update_progress_loop():
-                """定期更新进度，从20%慢慢增加到75%"""
-                base_progress = 0.20
-                max_progress = 0.75
-                elapsed = 0
-                while not progress_stop.is_set():
-                    # 每10秒更新一次进度，减少数据库连接压力
-                    time.sleep(10)
-                    elapsed += 10
-                    # 根据时间线性增加进度（但不超过75%）
-                    progress = min(base_progress + (elapsed / 300.0) * (max_progress - base_progress), max_progress)
-                    try:
-                        progress_callback("transcribing", progress)
-                    except Exception as e:
-                        # 如果更新失败，静默处理，避免影响主流程
-                        pass
-            
-            progress_thread = threading.Thread(target=update_progress_loop, daemon=True)
-            progress_thread.start()
-        
+        model_name, target_device, precision, mt3_model, model_load_seconds = _load_model(model, precision)
+
         # 转谱过程（这是最耗时的部分，CPU可能需要几分钟）
-        try:
-            target_device = "cuda" if RUNTIME_DEVICE == "cuda" else "cpu"
-            midi = transcribe(
-                audio,
-                sr=sr,
-                model=model_name,
-                device=target_device,
+        # 进度按实际完成的分段数在 20%~80% 之间推进
+        if len(prepared.model_audio):
+            midi = infer_midi(
+                mt3_model, prepared.model_audio, prepared.sr, target_device, precision,
+                on_batch_done=reporter.stage_range("transcribing", 0.20, 0.80),
             )
-        finally:
-            # 停止进度更新线程
-            if progress_callback:
-                progress_stop.set()
-        
-        # 转谱完成，更新进度到80%
-        if progress_callback:
-            progress_callback("transcribing_done", 0.80)  # 80%
-        print("转谱完成！")
-
-        # 4. 保存MIDI文件
-        if progress_callback:
-            progress_callback("saving_midi", 0.85)  # 85%
-        print("正在保存MIDI文件...")
-        midi.save(str(midi_path))
-        print(f"MIDI文件已保存: {midi_path}")
-
-        # 5. 转换为MusicXML
-        if progress_callback:
-            progress_callback("converting_musicxml", 0.90)  # 90%
-        if MUSIC21_AVAILABLE:
-            try:
-                print("正在转换为MusicXML...")
-                score = converter.parse(str(midi_path))
-                score.write('musicxml', str(musicxml_path))
-                print(f"MusicXML文件已保存: {musicxml_path}")
-            except Exception as e:
-                print(f"MusicXML转换失败: {e}，将创建占位文件")
-                musicxml_path.write_text("<musicxml>conversion_failed</musicxml>", encoding="utf-8")
         else:
-            # 如果没有music21，创建占位文件
-            musicxml_path.write_text("<musicxml>music21_not_available</musicxml>", encoding="utf-8")
-
-        # 6. 计算音频时长和音符数量
-        duration = len(audio) / sr
-        
-        # 尝试从MIDI中获取音符数量
-        note_count = 0
-        if MUSIC21_AVAILABLE:
-            try:
-                score = converter.parse(str(midi_path))
-                note_count = len(score.flat.notes)
-            except:
-                # 如果解析失败，使用估算值
-                note_count = int(duration * 4)  # 假设每秒4个音符
+            midi = notes_to_midi(empty_notes())
+        midi = prepared.restore(midi)
 
-        print(f"转谱完成: 时长={duration:.2f}秒, 音符数={note_count}")
-
-        return {
-            "midi_path": str(midi_path),
-            "musicxml_path": str(musicxml_path),
-            "duration": duration,
-            "note_count": note_count,
-        }
+        return _save_outputs(midi, prepared, reporter, defer_postprocess, {
+            "model_name": model_name,
+            "model_load_seconds": model_load_seconds,
+            "precision": precision,
+        })
 
     except Exception as e:
         print(f"转谱过程中出错: {e}")
-        import traceback
         traceback.print_exc()
+        # 异常的调用栈仍引用着解码后的音频（内存映射），清掉后映射文件才能删除
+        traceback.clear_frames(e.__traceback__)
         raise
+    finally:
+        # 出错、中止（TaskAborted）时同样删除内存映射音频文件
+        decoded_audio = None
+        if prepared is not None:
+            prepared.release()
+        prepared = None
+        release_audio(out_dir)
+
+
+def run_mtmt3_batch(items, model: str, mode: str, quantization: str, precision: str = None):
+    """
+    多个同参数（model/mode/precision）任务共用模型批次推理，适合大量短音频。
+    items 为字典列表：audio_path、output_dir，可选 progress_callback、decoded_audio。
+    各任务的分段混合打包进同一批次，推理后按任务拆分、各自拼接并保存结果。
+    返回与 items 对应的列表，元素为结果字典；单个任务出错时为该异常，不影响其他任务。
+    """
+    if not MT3_AVAILABLE:
+        results = []
+        for item in items:
+            try:
+                results.append(_mock_result(model, item["output_dir"], precision))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    results = [None] * len(items)
+    reporters = [ProgressReporter(item.get("progress_callback")) for item in items]
+    prepared = {}
+    for i, item in enumerate(items):
+        out_dir = Path(item["output_dir"])
+        out_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            prepared[i] = _PreparedAudio(item["audio_path"], out_dir, reporters[i], item.pop("decoded_audio", None))
+        except Exception as e:
+            print(f"音频准备失败: {item['audio_path']}: {e}")
+            traceback.clear_frames(e.__traceback__)
+            release_audio(out_dir)
+            results[i] = e
+
+    try:
+        return _run_prepared_batch(items, prepared, reporters, results, model, precision)
+    finally:
+        # 出错、中止时同样删除各任务的内存映射音频文件
+        for audio in prepared.values():
+            audio.release()
+        prepared.clear()
+
+
+def _run_prepared_batch(items, prepared: dict, reporters, results: list, model: str, precision: str):
+    if not prepared:
+        return results
+
+    try:
+        model_name, target_device, precision, mt3_model, model_load_seconds = _load_model(model, precision)
+        aborted = {}
+
+        def report(i: int, on_report):
+            # 某个任务被中止（如租约被回收）只影响它自己，其余任务继续推理
+            if i in aborted:
+                return
+            try:
+                on_report(reporters[i])
+            except TaskAborted as e:
+                aborted[i] = e
+
+        for i in prepared:
+            report(i, lambda r: r.report("transcribing", 0.20))
+        indices = [i for i in prepared if len(prepared[i].model_audio) and i not in aborted]
+
+        def on_task_progress(k: int, done: int, total: int):
+            report(indices[k], lambda r: r.stage_range("transcribing", 0.20, 0.80)(done, total))
+
+        sr = next(iter(prepared.values())).sr
+        midis = transcribe_many(
+            mt3_model, [prepared[i].model_audio for i in indices], sr, target_device,
+            on_task_progress=on_task_progress, precision=precision,
+        )
+        midi_by_task = dict(zip(indices, midis))
+    except Exception as e:
+        # 共用的模型或推理出错时，本批全部任务失败
+        print(f"批量推理出错: {e}")
+        traceback.clear_frames(e.__traceback__)
+        for i in prepared:
+            prepared[i].release()
+            results[i] = e
+        return results
+
+    meta = {"model_name": model_name, "model_load_seconds": model_load_seconds, "precision": precision}
+    for i, audio in prepared.items():
+        if i in aborted:
+            audio.release()
+            results[i] = aborted[i]
+            continue
+        try:
+            midi = audio.restore(midi_by_task[i] if i in midi_by_task else notes_to_midi(empty_notes()))
+            results[i] = _save_outputs(midi, audio, reporters[i], False, meta)
+        except Exception as e:
+            print(f"保存结果失败: {items[i]['output_dir']}: {e}")
+            results[i] = e
+    return results
@@ -0,0 +1,326 @@
+"""
+新任务唤醒通知：API 提交任务后通知同机的空闲 worker 立即领取，代替每秒轮询数据库。
+
+每个监听进程在 127.0.0.1 上绑定一个 UDP 端口，并把端口写入 DATA_DIR/wakeup/<pid>.port；
+notify_workers() 向所有登记的端口各发一个数据报。数据报丢失或进程已退出都无害，
+worker 仍保留低频轮询作为兜底。
+
+同一通道也用于广播任务状态变化（notify_task_updates），API 进程据此推送给订阅的前端
+（见 task_events.py）。只有注册了处理函数的进程另外登记 <pid>.updates，状态变化只发给它们，
+转谱 worker 不会收到进度广播。
+
+发送方缓存登记的端口（目录修改时间变化或超过 PORT_CACHE_SECONDS 时重新读取），发送路径上不检查
+进程存活；已退出进程的登记由监听器在启动时与每 PRUNE_INTERVAL 秒清理一次，期间发往它们的数据报直接丢弃。
+"""
+import asyncio
+import atexit
+import os
+import select
+import socket
+import threading
+import time
+from pathlib import Path
+
+try:
+    from .config import DATA_DIR
+except ImportError:
+    from backend.config import DATA_DIR
+
+WAKEUP_DIR = DATA_DIR / "wakeup"
+WAKEUP_HOST = "127.0.0.1"
+WAKEUP_MESSAGE = b"task"
+UPDATE_PREFIX = b"upd:"
+# 单个数据报内任务 id 列表的最大长度，超过时拆分发送
+MAX_DATAGRAM = 1400
+WAKEUP_SUFFIX = ".port"
+UPDATES_SUFFIX = ".updates"
+# 发送方缓存端口登记的最长时间（目录修改时间变化时立即重新读取）
+PORT_CACHE_SECONDS = 5.0
+# 监听器清理已退出进程登记的间隔
+PRUNE_INTERVAL = 60.0
+
+
+def _pid_alive_windows(pid: int) -> bool:
+    # Windows 上 os.kill 会终止进程，不能用来探测；改为打开进程句柄查询退出码
+    import ctypes
+    from ctypes import wintypes
+
+    PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+    STILL_ACTIVE = 259
+    ERROR_ACCESS_DENIED = 5
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    kernel32.OpenProcess.restype = wintypes.HANDLE
+    kernel32.OpenProcess.argtypes = [wintypes.DWORD, wintypes.BOOL, wintypes.DWORD]
+    kernel32.GetExitCodeProcess.argtypes = [wintypes.HANDLE, ctypes.POINTER(wintypes.DWORD)]
+    kernel32.CloseHandle.argtypes = [wintypes.HANDLE]
+
+    handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+    if not handle:
+        # 无权访问说明进程存在；其他错误（参数无效）说明进程已不存在
+        return ctypes.get_last_error() == ERROR_ACCESS_DENIED
+    try:
+        code = wintypes.DWORD()
+        if not kernel32.GetExitCodeProcess(handle, ctypes.byref(code)):
+            return True
+        return code.value == STILL_ACTIVE
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        try:
+            return _pid_alive_windows(pid)
+        except (OSError, AttributeError):
+            return True
+    if os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class _PortDirectory:
+    """登记目录的缓存：{后缀: [(登记文件, 端口)]}；目录修改时间变化或缓存过期时重新读取"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache = {}  # directory -> (mtime_ns, loaded_at, {suffix: [(path, port)]})
+
+    def entries(self, directory: Path, suffix: str):
+        try:
+            mtime = directory.stat().st_mtime_ns
+        except OSError:
+            return []
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(directory)
+            if cached is not None and cached[0] == mtime and now - cached[1] < PORT_CACHE_SECONDS:
+                return cached[2][suffix]
+        ports = {WAKEUP_SUFFIX: [], UPDATES_SUFFIX: []}
+        try:
+            paths = list(directory.iterdir())
+        except OSError:
+            paths = []
+        for path in paths:
+            if path.suffix not in ports:
+                continue
+            try:
+                ports[path.suffix].append((path, int(path.read_text())))
+            except (OSError, ValueError):
+                continue
+        with self._lock:
+            self._cache[directory] = (mtime, now, ports)
+        return ports[suffix]
+
+    def invalidate(self):
+        with self._lock:
+            self._cache.clear()
+
+
+_ports = _PortDirectory()
+
+
+def _broadcast(messages, on_local, directory: Path = None, suffix: str = WAKEUP_SUFFIX):
+    """向登记了 suffix 的监听进程发送数据报；本进程的监听器直接调用 on_local，不经过 socket"""
+    entries = _ports.entries(directory or WAKEUP_DIR, suffix)
+    if not entries:
+        return
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        for path, port in entries:
+            if _listener is not None and path in _listener.registrations:
+                on_local(_listener)
+                continue
+            for message in messages:
+                try:
+                    sock.sendto(message, (WAKEUP_HOST, port))
+                except OSError:
+                    pass
+    finally:
+        sock.close()
+
+
+def prune_port_files(directory: Path = None) -> int:
+    """删除已退出进程留下的端口登记，返回删除的数量（监听器启动时与定期调用，不在发送路径上）"""
+    removed = 0
+    try:
+        entries = [p for p in (directory or WAKEUP_DIR).iterdir() if p.suffix in (WAKEUP_SUFFIX, UPDATES_SUFFIX)]
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            pid = int(entry.stem)
+        except ValueError:
+            continue
+        if pid != os.getpid() and not _pid_alive(pid):
+            entry.unlink(missing_ok=True)
+            removed += 1
+    if removed:
+        _ports.invalidate()
+    return removed
+
+
+def notify_workers(directory: Path = None):
+    """通知所有已登记的监听进程有新任务；失败时静默（轮询兜底）"""
+    _broadcast([WAKEUP_MESSAGE], lambda listener: listener.signal(), directory)
+
+
+def _update_messages(task_ids):
+    messages, current = [], []
+    for task_id in task_ids:
+        if current and len(UPDATE_PREFIX) + sum(len(t) + 1 for t in current) + len(task_id) > MAX_DATAGRAM:
+            messages.append(UPDATE_PREFIX + ",".join(current).encode())
+            current = []
+        current.append(task_id)
+    if current:
+        messages.append(UPDATE_PREFIX + ",".join(current).encode())
+    return messages
+
+
+def notify_task_updates(task_ids, directory: Path = None):
+    """向同机其他进程广播任务状态/进度已变化（只带任务 id，接收方自行读取最新状态）；
+    本进程的订阅者由调用方直接通知"""
+    task_ids = list(task_ids)
+    if task_ids:
+        _broadcast(_update_messages(task_ids), lambda listener: None, directory, UPDATES_SUFFIX)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+class WakeupListener:
+    """
+    进程内的唤醒信号。后台线程接收数据报并递增 generation，
+    等待方先记下 generation 再查询数据库，查询期间到达的通知不会丢失。
+    """
+
+    def __init__(self, directory: Path = None):
+        directory = directory or WAKEUP_DIR
+        self._cond = threading.Condition()
+        self._generation = 0
+        self._async_waiters = []  # [(loop, future)]，供 API 的长轮询在事件循环内等待
+        self._update_handlers = []  # 任务状态变化的处理函数 handler(task_ids)
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((WAKEUP_HOST, 0))
+        directory.mkdir(parents=True, exist_ok=True)
+        self._directory = directory
+        prune_port_files(directory)
+        self._last_prune = time.monotonic()
+        self._port_file = directory / f"{os.getpid()}{WAKEUP_SUFFIX}"
+        self._updates_file = directory / f"{os.getpid()}{UPDATES_SUFFIX}"
+        self._port_file.write_text(str(self._sock.getsockname()[1]))
+        _ports.invalidate()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="wakeup-listener", daemon=True)
+        self._thread.start()
+
+    @property
+    def registrations(self):
+        """本监听器的登记文件（本进程发送时据此识别自己，直接在进程内处理）"""
+        return (self._port_file, self._updates_file)
+
+    @property
+    def generation(self) -> int:
+        with self._cond:
+            return self._generation
+
+    def _run(self):
+        while not self._closed:
+            try:
+                readable, _, _ = select.select([self._sock], [], [], 1.0)
+                if not readable:
+                    if time.monotonic() - self._last_prune >= PRUNE_INTERVAL:
+                        self._last_prune = time.monotonic()
+                        prune_port_files(self._directory)
+                    continue
+                data = self._sock.recv(2048)
+            except OSError:
+                if self._closed:
+                    return
+                continue
+            if data.startswith(UPDATE_PREFIX):
+                self.dispatch_updates(data[len(UPDATE_PREFIX):].decode(errors="ignore").split(","))
+            else:
+                self.signal()
+
+    def add_update_handler(self, handler):
+        """注册任务状态变化的处理函数（API 进程用于推送进度）；首次注册时登记 <pid>.updates 接收广播"""
+        with self._cond:
+            if handler not in self._update_handlers:
+                self._update_handlers.append(handler)
+            first = len(self._update_handlers) == 1 and not self._updates_file.exists()
+        if first and not self._closed:
+            self._updates_file.write_text(str(self._sock.getsockname()[1]))
+            _ports.invalidate()
+
+    def dispatch_updates(self, task_ids):
+        with self._cond:
+            handlers = list(self._update_handlers)
+        task_ids = [t for t in task_ids if t]
+        for handler in handlers:
+            try:
+                handler(task_ids)
+            except Exception as e:
+                print(f"[notify] update handler failed: {e}")
+
+    def signal(self):
+        """进程内直接唤醒（本进程提交任务时使用）"""
+        with self._cond:
+            self._generation += 1
+            self._cond.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    def wait(self, since: int, timeout: float) -> bool:
+        """等待 generation 超过 since；收到通知返回 True，超时返回 False"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._generation != since, timeout=timeout)
+
+    async def wait_async(self, since: int, timeout: float) -> bool:
+        """wait() 的协程版本，不占用线程池线程"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._cond:
+            if self._generation != since:
+                return True
+            self._async_waiters.append((loop, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            with self._cond:
+                if (loop, future) in self._async_waiters:
+                    self._async_waiters.remove((loop, future))
+                return self._generation != since
+
+    def close(self):
+        self._closed = True
+        self._port_file.unlink(missing_ok=True)
+        self._updates_file.unlink(missing_ok=True)
+        _ports.invalidate()
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def get_listener() -> WakeupListener:
+    """本进程共享的监听器（首次调用时创建）"""
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            _listener = WakeupListener()
+            atexit.register(_listener.close)
+        return _listener
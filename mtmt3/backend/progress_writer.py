@@ -0,0 +1,161 @@
+"""
+进度与续约的合并写入。
+
+SQLite 同一时刻只允许一个写事务，每次进度回调各开一个写事务会在负载高时相互等待。
+ProgressWriter 在每个进程内只保留每个任务最新的一条进度/续约，由一个写线程按
+PROGRESS_WRITE_INTERVAL 定期用一个事务批量提交（executemany）。
+领取、完成、失败等状态变更不经过这里，仍然立即写入。
+写入条件与 renew_lease 相同：任务已不由该 worker 持有时不做任何修改。
+提交成功后调用 on_write(task_ids)（共享写入器用它发布进度变化，见 task_events.py）。
+"""
+import atexit
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, case, func, or_, select
+from sqlalchemy.exc import OperationalError
+
+try:
+    from .config import PROGRESS_WRITE_INTERVAL, TASK_LEASE_SECONDS
+    from .db import engine as default_engine, Task
+    from .task_events import publish_task_updates
+except ImportError:
+    from backend.config import PROGRESS_WRITE_INTERVAL, TASK_LEASE_SECONDS
+    from backend.db import engine as default_engine, Task
+    from backend.task_events import publish_task_updates
+
+_tasks = Task.__table__
+
+# 连续写入失败达到该次数后丢弃这批内容（续约由之后的进度或心跳补上）
+MAX_WRITE_RETRIES = 5
+
+# 一条语句覆盖进度更新与单纯续约（b_progress 为空时保留原进度），以 executemany 批量执行
+_RENEW = (
+    _tasks.update()
+    .where(
+        _tasks.c.id == bindparam("b_id"),
+        _tasks.c.status == "processing",
+        or_(
+            bindparam("b_worker").is_(None),
+            _tasks.c.worker_id.is_(None),
+            _tasks.c.worker_id == bindparam("b_worker"),
+        ),
+    )
+    .values(
+        progress=func.coalesce(bindparam("b_progress"), _tasks.c.progress),
+        lease_expires_at=bindparam("b_lease"),
+        # 单纯续约（含远程 worker 重发相同进度的心跳）不改变对外可见的状态，
+        # 保留 updated_at（状态接口的 ETag 据此计算）
+        updated_at=case(
+            (or_(bindparam("b_progress").is_(None), _tasks.c.progress == bindparam("b_progress")), _tasks.c.updated_at),
+            else_=bindparam("b_now"),
+        ),
+    )
+)
+
+
+class ProgressWriter:
+    def __init__(self, engine=None, interval: float = PROGRESS_WRITE_INTERVAL,
+                 lease_seconds: float = TASK_LEASE_SECONDS, on_write=None):
+        self.engine = engine or default_engine
+        self.on_write = on_write
+        self.interval = interval
+        self.lease_seconds = lease_seconds
+        self._pending = {}  # (task_id, worker_id) -> progress（None 表示只续约）
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        # submitted：提交的更新数；coalesced：写入前被同一任务更新的值覆盖的数量；
+        # written：实际写入的行数；batches：写事务数；retries：写入失败后重试的次数；
+        # dropped：连续失败后丢弃的条数
+        self.counters = {"submitted": 0, "coalesced": 0, "written": 0, "batches": 0, "retries": 0, "dropped": 0}
+        self._failures = 0
+        self._thread = None
+        if self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name="progress-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, task_id: str, worker_id: str = None, progress: float = None):
+        """记录一次进度/续约；合并模式下立即返回，interval 为 0 时同步写入"""
+        key = (task_id, worker_id)
+        with self._lock:
+            self.counters["submitted"] += 1
+            if key in self._pending:
+                self.counters["coalesced"] += 1
+                if progress is None:
+                    progress = self._pending[key]
+            self._pending[key] = progress
+        if self._thread is None:
+            self.flush()
+
+    def flush(self) -> int:
+        """把待写内容在一个事务内提交，返回写入的条数；写锁冲突时放回，下一轮重试"""
+        with self._write_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            now = datetime.utcnow()
+            lease = now + timedelta(seconds=self.lease_seconds)
+            params = [
+                {"b_id": task_id, "b_worker": worker_id, "b_progress": progress, "b_lease": lease, "b_now": now}
+                for (task_id, worker_id), progress in batch.items()
+            ]
+            try:
+                with self.engine.begin() as conn:
+                    # 写入前的进度，用于判断哪些任务的进度确实发生了变化
+                    current = dict(conn.execute(
+                        select(_tasks.c.id, _tasks.c.progress).where(_tasks.c.id.in_({task_id for task_id, _ in batch}))
+                    ).all())
+                    conn.execute(_RENEW, params)
+            except OperationalError as e:
+                self._failures += 1
+                with self._lock:
+                    if self._failures >= MAX_WRITE_RETRIES:
+                        self.counters["dropped"] += len(batch)
+                        self._failures = 0
+                        print(f"[db] progress write dropped ({len(batch)} tasks): {e}")
+                        return 0
+                    self.counters["retries"] += 1
+                    for key, progress in batch.items():
+                        if key not in self._pending:
+                            self._pending[key] = progress
+                print(f"[db] progress write deferred ({len(batch)} tasks): {e}")
+                return 0
+            self._failures = 0
+            with self._lock:
+                self.counters["written"] += len(batch)
+                self.counters["batches"] += 1
+            # 单纯续约不改变对外可见的状态，只发布有进度变化的任务
+            changed = {
+                task_id for (task_id, _), progress in batch.items()
+                if progress is not None and current.get(task_id) != progress
+            }
+            if changed and self.on_write is not None:
+                try:
+                    self.on_write(changed)
+                except Exception as e:
+                    print(f"[db] progress publish failed: {e}")
+            return len(batch)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[db] progress writer error: {e}")
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_progress_writer() -> ProgressWriter:
+    """本进程共享的写入器；进程退出前提交剩余内容"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ProgressWriter(on_write=publish_task_updates)
+            atexit.register(_writer.flush)
+        return _writer
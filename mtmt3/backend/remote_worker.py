@@ -1,24 +1,85 @@
 import os
 import time
+import queue
+import shutil
+import socket
+import threading
+import traceback
+import uuid
 import tempfile
 from pathlib import Path
 
 import requests
+from requests.adapters import HTTPAdapter
 
 try:
-    from .mtmt3_core.transcriber import run_mtmt3
+    from .mtmt3_core.transcriber import run_mtmt3, run_mtmt3_batch, prewarm_models
+    from .mtmt3_core.audio_io import load_audio, release_audio
+    from .mtmt3_core.progress import TaskAborted
+    from .mtmt3_core.precision import check_default_precision
+    from .mtmt3_core.capacity import ThroughputMeter, CapacityReporter
 except ImportError:
-    from backend.mtmt3_core.transcriber import run_mtmt3
+    from backend.mtmt3_core.transcriber import run_mtmt3, run_mtmt3_batch, prewarm_models
+    from backend.mtmt3_core.audio_io import load_audio, release_audio
+    from backend.mtmt3_core.progress import TaskAborted
+    from backend.mtmt3_core.precision import check_default_precision
+    from backend.mtmt3_core.capacity import ThroughputMeter, CapacityReporter
 
 
 API_BASE = os.getenv("REMOTE_API_BASE", "http://127.0.0.1:8000").rstrip("/")
 WORKER_TOKEN = os.getenv("WORKER_TOKEN", "")
 POLL_SECONDS = float(os.getenv("REMOTE_WORKER_POLL_SECONDS", "2"))
 REQUEST_TIMEOUT = int(os.getenv("REMOTE_WORKER_TIMEOUT", "120"))
+# 长轮询：服务端在没有任务时挂起领取请求的秒数（0 表示按 POLL_SECONDS 轮询）
+CLAIM_WAIT_SECONDS = float(os.getenv("REMOTE_WORKER_CLAIM_WAIT", "25"))
+# 流水线模式（默认关闭，与本地 WORKER_PIPELINE 一致）：预取下一个任务的输入（下载 + 解码）、多个推理槽位、后台上传
+PIPELINE = os.getenv("REMOTE_WORKER_PIPELINE", "0") == "1"
+INFERENCE_SLOTS = int(os.getenv("REMOTE_WORKER_SLOTS", "1"))
+# 已下载解码、等待推理槽位的任务上限
+PREFETCH_DEPTH = int(os.getenv("REMOTE_WORKER_PREFETCH", "1"))
+# 推理完成、等待上传的任务上限
+UPLOAD_QUEUE_SIZE = int(os.getenv("REMOTE_WORKER_UPLOAD_QUEUE", "2"))
+# 保持长连接的连接池大小（领取、进度、下载、上传共用），默认按并发线程数：推理槽位 + 预取 + 上传 + 心跳
+HTTP_POOL_SIZE = int(os.getenv("REMOTE_WORKER_HTTP_POOL", "0")) or INFERENCE_SLOTS + 3
+# 排队或上传中的任务没有进度上报，按该间隔续约（需小于服务端 TASK_LEASE_SECONDS）
+HEARTBEAT_SECONDS = float(os.getenv("REMOTE_WORKER_HEARTBEAT", "30"))
+# 进度在后台合并发送：每轮等待该秒数收集更新，失败后按指数退避重试（上限 PROGRESS_MAX_BACKOFF）
+PROGRESS_FLUSH_SECONDS = float(os.getenv("REMOTE_WORKER_PROGRESS_FLUSH", "0.5"))
+PROGRESS_MAX_BACKOFF = float(os.getenv("REMOTE_WORKER_PROGRESS_MAX_BACKOFF", "30"))
+PROGRESS_TIMEOUT = float(os.getenv("REMOTE_WORKER_PROGRESS_TIMEOUT", "15"))
+# 短音频批量推理：一次领取至多 N 个参数相同的任务，分段混合打包进同一模型批次（1 表示逐个处理）
+BATCH_TASKS = int(os.getenv("REMOTE_WORKER_BATCH_TASKS", "1"))
+# 向服务端登记能力信息（设备、已加载模型、槽位、实测速度）的间隔
+REGISTER_SECONDS = float(os.getenv("REMOTE_WORKER_REGISTER_SECONDS", "30"))
+# 租约持有者标识，领取、进度与提交结果时携带
+WORKER_ID = os.getenv("REMOTE_WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
 
 
 def _headers():
-    return {"x-worker-token": WORKER_TOKEN}
+    return {"x-worker-token": WORKER_TOKEN, "x-worker-id": WORKER_ID}
+
+
+def _make_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(_headers())
+    return session
+
+
+# 所有请求复用同一个 Session，避免每次请求重新建立 TCP/TLS 连接
+http = _make_session()
+# 直连对象存储（签名 URL）的请求不能携带 worker token
+storage_http = requests.Session()
+storage_http.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE))
+storage_http.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE))
+
+
+def _check_lease(resp, task_id: str):
+    """409 表示租约已被服务端回收或转给其他 worker"""
+    if resp is not None and resp.status_code == 409:
+        raise TaskAborted(f"lease lost for task {task_id}")
 
 
 def _url(path: str) -> str:
@@ -28,18 +89,16 @@ def _url(path: str) -> str:
 
 
 def _post_json(path: str, payload: dict):
-    requests.post(
+    return http.post(
         _url(path),
         json=payload,
-        headers=_headers(),
         timeout=REQUEST_TIMEOUT,
     )
 
 
-def _download_file(url_path: str, target_path: Path):
-    with requests.get(
+def _download_file(url_path: str, target_path: Path, session: requests.Session = None):
+    with (session or http).get(
         _url(url_path),
-        headers=_headers(),
         timeout=REQUEST_TIMEOUT,
         stream=True,
     ) as r:
@@ -50,101 +109,595 @@ def _download_file(url_path: str, target_path: Path):
                     f.write(chunk)
 
 
-def _upload_result(task_id: str, midi_path: Path, musicxml_path: Path, duration: float, note_count: float):
+def _download_input(task: dict, target_path: Path):
+    """优先凭签名 URL 直接从对象存储下载输入，失败（如 URL 已过期）时经由 API 下载"""
+    direct_url = task.get("input_download_url")
+    if direct_url:
+        try:
+            _download_file(direct_url, target_path, session=storage_http)
+            return
+        except requests.RequestException as e:
+            print(f"[worker] direct download failed task={task.get('task_id')}: {e}")
+    _download_file(task["input_url"], target_path)
+
+
+def _fetch_upload_urls(task_id: str) -> dict:
+    """申请结果文件的签名上传 URL；服务端为本地存储时返回 404"""
+    resp = http.post(_url(f"/api/worker/tasks/{task_id}/upload-urls"), timeout=REQUEST_TIMEOUT)
+    _check_lease(resp, task_id)
+    resp.raise_for_status()
+    return resp.json()
+
+
+def _put_direct(url: str, path: Path):
+    with open(path, "rb") as f:
+        resp = storage_http.put(url, data=f, timeout=REQUEST_TIMEOUT)
+    resp.raise_for_status()
+
+
+def _upload_result(task_id: str, midi_path: Path, musicxml_path: Path, duration: float, note_count: float,
+                   skipped_seconds: float = 0.0, direct: bool = False):
+    """
+    提交结果。direct=True（领取时服务端下发了 direct_upload）时先把结果文件直接上传到对象存储，
+    再以 stored=true 调用 /complete；直传失败时退回随 /complete 上传文件。
+    """
+    data = {"duration": str(duration), "note_count": str(note_count), "skipped_seconds": str(skipped_seconds)}
+    if direct:
+        try:
+            urls = _fetch_upload_urls(task_id)
+            _put_direct(urls["midi"], midi_path)
+            _put_direct(urls["musicxml"], musicxml_path)
+        except (requests.RequestException, KeyError) as e:
+            print(f"[worker] direct upload failed task={task_id}: {e}")
+        else:
+            resp = http.post(
+                _url(f"/api/worker/tasks/{task_id}/complete"),
+                data=dict(data, stored="true"),
+                timeout=REQUEST_TIMEOUT,
+            )
+            _check_lease(resp, task_id)
+            resp.raise_for_status()
+            return
     with open(midi_path, "rb") as mf, open(musicxml_path, "rb") as xf:
         files = {
             "midi_file": ("result.mid", mf, "audio/midi"),
             "musicxml_file": ("result.musicxml", xf, "application/xml"),
         }
-        data = {"duration": str(duration), "note_count": str(note_count)}
-        resp = requests.post(
+        resp = http.post(
             _url(f"/api/worker/tasks/{task_id}/complete"),
-            headers=_headers(),
             files=files,
             data=data,
             timeout=REQUEST_TIMEOUT,
         )
+        _check_lease(resp, task_id)
+        resp.raise_for_status()
+
+
+def register(capabilities: dict):
+    """登记能力信息，服务端据此分配任务（旧版服务端没有该接口时忽略）"""
+    resp = http.post(_url("/api/worker/register"), json=capabilities, timeout=REQUEST_TIMEOUT)
+    if resp.status_code != 404:
         resp.raise_for_status()
 
 
-def claim_task():
-    resp = requests.post(
+# 实测处理速度，随能力信息定期登记
+throughput = ThroughputMeter()
+
+
+def claim_tasks(wait: float = CLAIM_WAIT_SECONDS, limit: int = BATCH_TASKS):
+    """
+    领取至多 limit 个参数相同的任务，返回列表（没有任务时为空）。
+    wait > 0 时长轮询：服务端在有新任务或超时前不返回
+    """
+    params = {}
+    if wait > 0:
+        params["wait"] = wait
+    if limit > 1:
+        params["limit"] = limit
+    resp = http.post(
         _url("/api/worker/tasks/claim"),
-        headers=_headers(),
-        timeout=REQUEST_TIMEOUT,
+        params=params or None,
+        timeout=REQUEST_TIMEOUT + wait,
     )
     resp.raise_for_status()
     data = resp.json()
-    return data.get("task")
+    if "tasks" in data:
+        return data["tasks"]
+    # 旧版服务端只返回单个任务
+    return [data["task"]] if data.get("task") else []
 
 
-def process_task(task: dict):
-    task_id = task["task_id"]
-    input_filename = task.get("input_filename", f"{task_id}.audio")
-    suffix = Path(input_filename).suffix or ".audio"
+def claim_task(wait: float = CLAIM_WAIT_SECONDS):
+    tasks = claim_tasks(wait, limit=1)
+    return tasks[0] if tasks else None
 
-    print(f"[worker] claimed task={task_id}")
 
-    with tempfile.TemporaryDirectory(prefix=f"task_{task_id}_") as temp_dir:
-        temp_dir_path = Path(temp_dir)
-        input_path = temp_dir_path / f"input{suffix}"
-        output_dir = temp_dir_path / "result"
-        output_dir.mkdir(parents=True, exist_ok=True)
+class PreparedTask:
+    """已领取并下载（可能已解码）的任务，以及它的临时工作目录"""
 
-        _post_json(f"/api/worker/tasks/{task_id}/progress", {"progress": 0.05, "status": "processing"})
-        _download_file(task["input_url"], input_path)
-        _post_json(f"/api/worker/tasks/{task_id}/progress", {"progress": 0.10, "status": "processing"})
+    def __init__(self, task: dict):
+        self.task = task
+        self.task_id = task["task_id"]
+        input_filename = task.get("input_filename", f"{self.task_id}.audio")
+        suffix = Path(input_filename).suffix or ".audio"
+        self.temp_dir = Path(tempfile.mkdtemp(prefix=f"task_{self.task_id}_"))
+        self.input_path = self.temp_dir / f"input{suffix}"
+        self.output_dir = self.temp_dir / "result"
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.decoded = None
+        self.result = None
 
-        def progress_callback(_stage: str, progress: float):
-            try:
-                _post_json(
-                    f"/api/worker/tasks/{task_id}/progress",
-                    {"progress": float(progress), "status": "processing"},
-                )
-            except Exception:
-                pass
-
-        result = run_mtmt3(
-            audio_path=str(input_path),
-            model=task.get("model", "mtmt3_piano_vocal"),
-            mode=task.get("mode", "with_accompaniment"),
-            quantization=task.get("quantization", "none"),
-            output_dir=str(output_dir),
-            progress_callback=progress_callback,
+    def take_decoded(self):
+        """交出解码结果，本对象不再引用（推理结束后内存映射文件才能删除）"""
+        decoded, self.decoded = self.decoded, None
+        return decoded
+
+    def cleanup(self):
+        # 先丢弃解码结果的引用再删除内存映射文件，Windows 上映射仍被引用时无法删除
+        self.decoded = None
+        release_audio(self.output_dir)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+
+def _send_progress_batch(updates: dict) -> dict:
+    """
+    把 {task_id: progress} 一次提交给服务端，返回 {task_id: "ok" / "lost" / "not_found"}。
+    旧版服务端没有批量接口（404）时逐个提交。
+    """
+    global _batch_progress_supported
+    if _batch_progress_supported:
+        resp = http.post(
+            _url("/api/worker/tasks/progress"),
+            json={"updates": [{"task_id": task_id, "progress": float(progress), "status": "processing"}
+                              for task_id, progress in updates.items()]},
+            timeout=PROGRESS_TIMEOUT,
         )
+        if resp.status_code != 404:
+            resp.raise_for_status()
+            return resp.json().get("results", {})
+        _batch_progress_supported = False
 
-        midi_path = Path(result["midi_path"])
-        musicxml_path = Path(result["musicxml_path"])
-        _upload_result(
-            task_id,
-            midi_path,
-            musicxml_path,
-            float(result.get("duration") or 0.0),
-            float(result.get("note_count") or 0.0),
+    results = {}
+    for task_id, progress in updates.items():
+        resp = http.post(
+            _url(f"/api/worker/tasks/{task_id}/progress"),
+            json={"progress": float(progress), "status": "processing"},
+            timeout=PROGRESS_TIMEOUT,
         )
-        print(f"[worker] task done={task_id}")
+        if resp.status_code == 409:
+            results[task_id] = "lost"
+        elif resp.status_code == 404:
+            results[task_id] = "not_found"
+        else:
+            resp.raise_for_status()
+            results[task_id] = "ok"
+    return results
+
+
+_batch_progress_supported = True
+
+
+class ProgressSender:
+    """
+    后台线程负责进度上报与续约，推理、下载与上传线程只写内存，从不等待网络：
+    - 同一任务尚未发出的进度只保留最新值
+    - 每轮把所有任务待发的进度合并成一个批量请求
+    - 请求失败时保留待发内容，按指数退避重试
+    - 长时间没有新进度的任务（排队等待推理、等待上传）按 interval 重发最后的进度以续约
+    服务端报告租约丢失的任务记录下来，各阶段通过 check() 据此放弃任务。
+    """
+
+    def __init__(self, interval: float = HEARTBEAT_SECONDS, flush_seconds: float = PROGRESS_FLUSH_SECONDS,
+                 max_backoff: float = PROGRESS_MAX_BACKOFF, send=None):
+        self.interval = interval
+        self.flush_seconds = flush_seconds
+        self.max_backoff = max_backoff
+        self._send = send or _send_progress_batch
+        self._tasks = {}    # task_id -> [last_progress, last_sent]
+        self._pending = {}  # task_id -> 待发送的最新进度
+        self._lost = set()
+        self._sending = False  # 后台线程正在发送一批进度
+        self._cond = threading.Condition()
+        # updates：调用方提交的进度数；coalesced：发送前被更新的值覆盖的数量；
+        # dropped：任务释放或租约丢失时尚未发出、被丢弃的数量
+        self.counters = {"updates": 0, "coalesced": 0, "dropped": 0, "sent": 0, "failed_requests": 0}
+        self._thread = threading.Thread(target=self._run, name="progress-sender", daemon=True)
+        self._thread.start()
+
+    def hold(self, task_id: str, progress: float):
+        """开始为任务续约（领取后立即调用）"""
+        with self._cond:
+            self._tasks[task_id] = [progress, time.monotonic()]
+            self._lost.discard(task_id)
+
+    def update(self, task_id: str, progress: float):
+        """提交进度，立即返回"""
+        with self._cond:
+            self.counters["updates"] += 1
+            if task_id in self._lost:
+                self.counters["dropped"] += 1
+                return
+            if task_id in self._pending:
+                self.counters["coalesced"] += 1
+            self._pending[task_id] = progress
+            if task_id in self._tasks:
+                self._tasks[task_id][0] = progress
+            self._cond.notify_all()
+
+    def release(self, task_id: str):
+        with self._cond:
+            self._tasks.pop(task_id, None)
+            self._lost.discard(task_id)
+            if self._pending.pop(task_id, None) is not None:
+                self.counters["dropped"] += 1
+
+    def check(self, task_id: str):
+        with self._cond:
+            lost = task_id in self._lost
+        if lost:
+            raise TaskAborted(f"lease lost for task {task_id}")
+
+    def flush(self, timeout: float = None) -> bool:
+        """等待待发内容全部发出（测试与退出前使用）"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._sending, timeout=timeout)
+
+    def _due(self, now: float) -> dict:
+        batch = dict(self._pending)
+        for task_id, (progress, sent) in self._tasks.items():
+            if task_id not in batch and now - sent >= self.interval:
+                batch[task_id] = progress
+        return batch
+
+    def _run(self):
+        backoff = 0.0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending, timeout=min(self.interval, 5.0))
+            # 短暂等待，把同一时间段内的多次进度合并成一个请求
+            time.sleep(self.flush_seconds)
+            with self._cond:
+                batch = self._due(time.monotonic())
+                self._pending.clear()
+                self._sending = bool(batch)
+            if not batch:
+                continue
+
+            try:
+                results = self._send(batch)
+            except Exception as e:
+                with self._cond:
+                    self.counters["failed_requests"] += 1
+                    # 发送期间没有新值的任务放回待发队列，退避后重试；已释放的任务不再重试
+                    for task_id, progress in batch.items():
+                        if task_id in self._tasks:
+                            self._pending.setdefault(task_id, progress)
+                    self._sending = False
+                backoff = min(self.max_backoff, backoff * 2 if backoff else 1.0)
+                print(f"[worker] progress report failed ({e}), retry in {backoff:.0f}s {self.counters}")
+                time.sleep(backoff)
+                continue
+
+            backoff = 0.0
+            now = time.monotonic()
+            with self._cond:
+                self.counters["sent"] += len(batch)
+                for task_id in batch:
+                    if task_id in self._tasks:
+                        self._tasks[task_id][1] = now
+                    if results.get(task_id) in ("lost", "not_found"):
+                        print(f"[worker] lease lost task={task_id}")
+                        self._lost.add(task_id)
+                        if self._pending.pop(task_id, None) is not None:
+                            self.counters["dropped"] += 1
+                self._sending = False
+                self._cond.notify_all()
+
+
+_progress = None
+_progress_lock = threading.Lock()
+
+
+def get_progress_sender() -> ProgressSender:
+    """本进程共享的进度发送器（首次调用时启动后台线程）"""
+    global _progress
+    with _progress_lock:
+        if _progress is None:
+            _progress = ProgressSender()
+        return _progress
+
+
+def _report_progress(task_id: str, progress: float):
+    """提交进度（后台发送，同时续约），不等待网络；租约已丢失时抛出 TaskAborted"""
+    sender = get_progress_sender()
+    sender.update(task_id, float(progress))
+    sender.check(task_id)
+
+
+def prepare_task(task: dict, decode: bool = False) -> PreparedTask:
+    """下载输入文件；decode=True 时同时解码，供推理槽位直接使用"""
+    prepared = PreparedTask(task)
+    try:
+        _report_progress(prepared.task_id, 0.05)
+        _download_input(task, prepared.input_path)
+        _report_progress(prepared.task_id, 0.10)
+        if decode:
+            # 解码到输出目录，内存映射文件（MTMT3_AUDIO_MMAP=1）由 run_mtmt3 推理结束后删除，
+            # 推理前被中止时由 cleanup() 删除
+            prepared.decoded = load_audio(str(prepared.input_path), sr=16000, mmap_dir=prepared.output_dir)
+    except BaseException as e:
+        # 异常的调用栈可能仍引用着解码缓冲区
+        traceback.clear_frames(e.__traceback__)
+        prepared.cleanup()
+        raise
+    return prepared
+
+
+def infer_task(prepared: PreparedTask) -> dict:
+    task = prepared.task
+    task_id = prepared.task_id
+
+    def progress_callback(_stage: str, progress: float):
+        _report_progress(task_id, progress)
+
+    started = time.monotonic()
+    result = run_mtmt3(
+        audio_path=str(prepared.input_path),
+        model=task.get("model", "mtmt3_piano_vocal"),
+        mode=task.get("mode", "with_accompaniment"),
+        quantization=task.get("quantization", "none"),
+        output_dir=str(prepared.output_dir),
+        progress_callback=progress_callback,
+        precision=task.get("precision"),
+        decoded_audio=prepared.take_decoded(),
+    )
+    throughput.record(result.get("duration"), time.monotonic() - started)
+    print(f"[worker] task={task_id} model={result.get('model_name')} precision={result.get('precision')} "
+          f"model_load={result.get('model_load_seconds', 0.0):.2f}s")
+    prepared.result = result
+    return result
+
+
+def upload_task(prepared: PreparedTask):
+    result = prepared.result
+    _upload_result(
+        prepared.task_id,
+        Path(result["midi_path"]),
+        Path(result["musicxml_path"]),
+        float(result.get("duration") or 0.0),
+        float(result.get("note_count") or 0.0),
+        float(result.get("skipped_seconds") or 0.0),
+        direct=bool(prepared.task.get("direct_upload")),
+    )
+    print(f"[worker] task done={prepared.task_id}")
+
+
+def infer_group(group) -> list:
+    """
+    多个已准备好的任务共用模型批次推理，返回 [(prepared, error)]，error 为 None 表示成功。
+    各任务的进度仍分别上报，单个任务失败不影响同组其他任务。
+    """
+    first = group[0].task
+    items = []
+    for prepared in group:
+        def progress_callback(_stage: str, progress: float, task_id=prepared.task_id):
+            _report_progress(task_id, progress)
+
+        items.append({
+            "audio_path": str(prepared.input_path),
+            "output_dir": str(prepared.output_dir),
+            "progress_callback": progress_callback,
+            "decoded_audio": prepared.take_decoded(),
+        })
+
+    started = time.monotonic()
+    results = run_mtmt3_batch(
+        items,
+        model=first.get("model", "mtmt3_piano_vocal"),
+        mode=first.get("mode", "with_accompaniment"),
+        quantization=first.get("quantization", "none"),
+        precision=first.get("precision"),
+    )
+    done = [r for r in results if not isinstance(r, Exception)]
+    throughput.record(sum(r.get("duration") or 0.0 for r in done), time.monotonic() - started, len(done))
+    outcome = []
+    for prepared, result in zip(group, results):
+        if isinstance(result, Exception):
+            outcome.append((prepared, result))
+        else:
+            prepared.result = result
+            outcome.append((prepared, None))
+    print(f"[worker] batch of {len(group)} tasks model={first.get('model')} precision={first.get('precision')}")
+    return outcome
+
+
+def process_task(task: dict):
+    print(f"[worker] claimed task={task['task_id']}")
+    sender = get_progress_sender()
+    sender.hold(task["task_id"], 0.05)
+    try:
+        prepared = prepare_task(task)
+        try:
+            infer_task(prepared)
+            upload_task(prepared)
+        finally:
+            prepared.cleanup()
+    finally:
+        sender.release(task["task_id"])
+
+
+def _handle_failure(task_id: str, error: Exception):
+    if isinstance(error, TaskAborted):
+        # 任务已交给其他 worker，不能再标记失败
+        print(f"[worker] task aborted={task_id}: {error}")
+        return
+    err_msg = f"{type(error).__name__}: {error}"
+    try:
+        _post_json(f"/api/worker/tasks/{task_id}/fail", {"error_message": err_msg})
+    except Exception as e:
+        print(f"[worker] report failure failed task={task_id}: {e}")
+    print(f"[worker] task failed={task_id} error={err_msg}")
+
+
+def process_group(tasks: list):
+    """批量模式（串行循环）：逐个下载，共用模型批次推理，再逐个上传"""
+    sender = get_progress_sender()
+    group = []
+    for task in tasks:
+        print(f"[worker] claimed task={task['task_id']}")
+        sender.hold(task["task_id"], 0.05)
+    for task in tasks:
+        try:
+            group.append(prepare_task(task))
+        except Exception as e:
+            _handle_failure(task["task_id"], e)
+    if not group:
+        return
+    try:
+        for prepared, error in infer_group(group):
+            if error is not None:
+                _handle_failure(prepared.task_id, error)
+                continue
+            try:
+                upload_task(prepared)
+            except Exception as e:
+                _handle_failure(prepared.task_id, e)
+    finally:
+        for prepared in group:
+            prepared.cleanup()
+        for task in tasks:
+            sender.release(task["task_id"])
+
+
+def _claim_with_backoff():
+    """领取任务，返回任务列表；没有任务时返回空列表（长轮询已在服务端等待过）"""
+    try:
+        started = time.monotonic()
+        if BATCH_TASKS > 1:
+            tasks = claim_tasks(limit=BATCH_TASKS)
+        else:
+            task = claim_task()
+            tasks = [task] if task else []
+        if not tasks and time.monotonic() - started < min(CLAIM_WAIT_SECONDS, POLL_SECONDS):
+            # 服务端不支持长轮询（立即返回）时退回定时轮询
+            time.sleep(POLL_SECONDS)
+        return tasks
+    except Exception as e:
+        print(f"[worker] poll error: {e}")
+        time.sleep(max(POLL_SECONDS, 3))
+        return []
+
+
+def pipelined_worker_loop():
+    """
+    三段流水线，阶段之间用有界队列衔接：
+    预取线程（领取 + 下载 + 解码）-> N 个推理槽位 -> 后台上传线程。
+    预取队列满时暂停领取，上传队列满时推理槽位等待，内存与磁盘占用可预期。
+    BATCH_TASKS > 1 时预取与推理的单位是一组参数相同的任务，组内共用模型批次，逐个上传。
+    """
+    sender = get_progress_sender()
+    ready = queue.Queue(maxsize=max(1, PREFETCH_DEPTH))
+    uploads = queue.Queue(maxsize=max(1, UPLOAD_QUEUE_SIZE))
+    # 已领取但尚未交给推理槽位的任务数（含正在下载的），保证不超过预取深度
+    prefetch_slots = threading.BoundedSemaphore(max(1, PREFETCH_DEPTH))
+
+    def prefetcher():
+        while True:
+            prefetch_slots.acquire()
+            tasks = _claim_with_backoff()
+            group = []
+            for task in tasks:
+                task_id = task["task_id"]
+                print(f"[worker] claimed task={task_id} (prefetch)")
+                sender.hold(task_id, 0.05)
+            for task in tasks:
+                try:
+                    group.append(prepare_task(task, decode=True))
+                except Exception as e:
+                    sender.release(task["task_id"])
+                    _handle_failure(task["task_id"], e)
+            if not group:
+                prefetch_slots.release()
+                continue
+            ready.put(group)
+
+    def _failed(prepared: PreparedTask, error: Exception):
+        sender.release(prepared.task_id)
+        prepared.cleanup()
+        _handle_failure(prepared.task_id, error)
+
+    def inference_slot():
+        while True:
+            group = ready.get()
+            prefetch_slots.release()
+            if len(group) == 1:
+                prepared = group[0]
+                try:
+                    sender.check(prepared.task_id)
+                    infer_task(prepared)
+                except Exception as e:
+                    _failed(prepared, e)
+                    continue
+                outcome = [(prepared, None)]
+            else:
+                try:
+                    outcome = infer_group(group)
+                except Exception as e:
+                    outcome = [(prepared, e) for prepared in group]
+            for prepared, error in outcome:
+                if error is not None:
+                    _failed(prepared, error)
+                    continue
+                sender.update(prepared.task_id, 0.95)
+                uploads.put(prepared)
+
+    def uploader():
+        while True:
+            prepared = uploads.get()
+            try:
+                sender.check(prepared.task_id)
+                upload_task(prepared)
+            except Exception as e:
+                _handle_failure(prepared.task_id, e)
+            finally:
+                sender.release(prepared.task_id)
+                prepared.cleanup()
+
+    print(f"[worker] pipeline mode: inference_slots={INFERENCE_SLOTS} prefetch={PREFETCH_DEPTH} "
+          f"upload_queue={UPLOAD_QUEUE_SIZE} batch_tasks={BATCH_TASKS}")
+    threads = [threading.Thread(target=prefetcher, name="prefetch", daemon=True),
+               threading.Thread(target=uploader, name="upload", daemon=True)]
+    threads += [threading.Thread(target=inference_slot, name=f"inference-{i}", daemon=True)
+                for i in range(max(1, INFERENCE_SLOTS))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
 
 
 def worker_loop():
     if not WORKER_TOKEN:
         raise RuntimeError("WORKER_TOKEN is required for remote_worker")
+    check_default_precision()
+
+    print(f"[worker] start remote worker id={WORKER_ID}, api={API_BASE}")
+    prewarm_models()
+    slots = (max(1, INFERENCE_SLOTS) if PIPELINE else 1) * max(1, BATCH_TASKS)
+    CapacityReporter(register, slots, throughput, REGISTER_SECONDS).start()
+    if PIPELINE:
+        pipelined_worker_loop()
+        return
 
-    print(f"[worker] start remote worker, api={API_BASE}")
     while True:
-        try:
-            task = claim_task()
-            if not task:
-                time.sleep(POLL_SECONDS)
-                continue
+        tasks = _claim_with_backoff()
+        if len(tasks) > 1:
+            process_group(tasks)
+            continue
+        for task in tasks:
             try:
                 process_task(task)
             except Exception as e:
-                err_msg = f"{type(e).__name__}: {e}"
-                _post_json(f"/api/worker/tasks/{task['task_id']}/fail", {"error_message": err_msg})
-                print(f"[worker] task failed={task['task_id']} error={err_msg}")
-        except Exception as e:
-            print(f"[worker] poll error: {e}")
-            time.sleep(max(POLL_SECONDS, 3))
+                _handle_failure(task["task_id"], e)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,269 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+
+try:
+    from .config import RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES, MODEL_VERSION, TRANSCRIBER_MOCK
+    from .artifacts import compressed_siblings
+except ImportError:
+    from backend.config import RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES, MODEL_VERSION, TRANSCRIBER_MOCK
+    from backend.artifacts import compressed_siblings
+
+META_NAME = "meta.json"
+# 命中/未命中计数：每个进程一个文件（<pid>.json），stats() 汇总所有进程
+STATS_DIR_NAME = ".stats"
+ARTIFACTS = {"midi_path": "result.mid", "musicxml_path": "result.musicxml"}
+# postprocess.write_musicxml 转换失败、模拟模式写出的占位 MusicXML 以此开头
+PLACEHOLDER_MUSICXML = b"<musicxml>"
+
+
+def make_cache_key(content_hash: str, model: str, mode: str, quantization: str,
+                   precision: str = None, model_version: str = MODEL_VERSION, mock: bool = TRANSCRIBER_MOCK) -> str:
+    parts = [content_hash, model or "", mode or "", quantization or "", precision or "", model_version]
+    if mock:
+        parts.append("mock")
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def _read_head(path, size: int = 16) -> bytes:
+    try:
+        with open(path, "rb") as f:
+            return f.read(size)
+    except OSError:
+        return b""
+
+
+def is_cacheable_result(midi_path, musicxml_path) -> bool:
+    """
+    只缓存真实的转谱结果：MIDI 须为标准 MIDI 文件（模拟模式写的是占位字节），
+    MusicXML 不能是转换失败或模拟模式的占位文件，否则之后相同的上传会一直拿到坏结果
+    """
+    return (
+        _read_head(midi_path).startswith(b"MThd")
+        and not _read_head(musicxml_path).lstrip().startswith(PLACEHOLDER_MUSICXML)
+    )
+
+
+def _link_or_copy(src: Path, dst: Path):
+    """优先硬链接（不占额外空间），跨文件系统时退回复制"""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if dst.exists():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class ResultCache:
+    """
+    按内容寻址的转谱结果缓存，存放在 RESULT_DIR/_cache/<key>/ 下。
+    API 与 worker 是不同进程，因此以磁盘为准：meta.json 的 mtime 记录最近访问时间，
+    写入新条目后按 LRU 淘汰到容量上限以内。
+    命中/未命中计数同样写在磁盘上（每进程一个文件），多进程部署时 stats() 给出全部进程的合计；
+    hits / misses 属性只是本进程的计数。
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._counter_pid = None
+        self._lock = threading.Lock()
+
+    def _record(self, field: str):
+        """本进程计数加一并写入本进程的计数文件（先写临时文件再替换）"""
+        path = self.root / STATS_DIR_NAME / f"{os.getpid()}.json"
+        with self._lock:
+            if self._counter_pid != os.getpid():
+                # 首次计数（或 fork 出的子进程）：PID 被复用时接着该文件已有的计数累加
+                self._counter_pid = os.getpid()
+                previous = self._read_counters(path)
+                self.hits, self.misses = previous["hits"], previous["misses"]
+            setattr(self, field, getattr(self, field) + 1)
+            counters = {"hits": self.hits, "misses": self.misses}
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_name(path.name + ".part")
+                tmp.write_text(json.dumps(counters), encoding="utf-8")
+                os.replace(tmp, path)
+            except OSError as e:
+                print(f"[cache] counter write failed: {e}")
+
+    @staticmethod
+    def _read_counters(path: Path) -> dict:
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+            return {"hits": int(data.get("hits", 0)), "misses": int(data.get("misses", 0))}
+        except (OSError, ValueError, TypeError, AttributeError):
+            return {"hits": 0, "misses": 0}
+
+    def counters(self) -> dict:
+        """所有进程的命中/未命中合计"""
+        total = {"hits": 0, "misses": 0}
+        try:
+            paths = list((self.root / STATS_DIR_NAME).glob("*.json"))
+        except OSError:
+            paths = []
+        for path in paths:
+            for field, value in self._read_counters(path).items():
+                total[field] += value
+        return total
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _entry_dir(self, key: str) -> Path:
+        return self.root / key
+
+    def _read_meta(self, entry_dir: Path):
+        try:
+            return json.loads((entry_dir / META_NAME).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def lookup(self, key: str):
+        """命中时返回条目元数据（含产物路径），并刷新其访问时间"""
+        if not self.enabled:
+            return None
+        entry_dir = self._entry_dir(key)
+        meta = self._read_meta(entry_dir)
+        if meta is None or not all((entry_dir / name).exists() for name in ARTIFACTS.values()):
+            self._record("misses")
+            return None
+        try:
+            os.utime(entry_dir / META_NAME)
+        except OSError:
+            pass
+        self._record("hits")
+        meta["dir"] = str(entry_dir)
+        return meta
+
+    def materialize(self, meta: dict, output_dir: Path) -> dict:
+        """把缓存产物（连同预压缩副本）链接到任务自己的结果目录，返回 {midi_path, musicxml_path}"""
+        entry_dir = Path(meta["dir"])
+        paths = {}
+        for attr, name in ARTIFACTS.items():
+            dst = Path(output_dir) / name
+            _link_or_copy(entry_dir / name, dst)
+            for sibling in compressed_siblings(entry_dir / name):
+                _link_or_copy(sibling, Path(output_dir) / sibling.name)
+            paths[attr] = str(dst)
+        return paths
+
+    def store(self, key: str, midi_path: str, musicxml_path: str, meta: dict):
+        if not self.enabled or not key:
+            return
+        sources = {"midi_path": midi_path, "musicxml_path": musicxml_path}
+        if not all(p and Path(p).exists() for p in sources.values()):
+            return
+        if not is_cacheable_result(midi_path, musicxml_path):
+            return
+        if self._entry_dir(key).exists():
+            return
+
+        # 先写临时目录再整体改名，其他进程不会看到写了一半的条目
+        tmp_dir = self.root / f".tmp-{uuid.uuid4().hex}"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        size = 0
+        for attr, name in ARTIFACTS.items():
+            _link_or_copy(Path(sources[attr]), tmp_dir / name)
+            size += (tmp_dir / name).stat().st_size
+            for sibling in compressed_siblings(sources[attr]):
+                target = tmp_dir / (name + sibling.name[len(Path(sources[attr]).name):])
+                _link_or_copy(sibling, target)
+                size += target.stat().st_size
+        meta = dict(meta, key=key, size=size, created_at=time.time())
+        (tmp_dir / META_NAME).write_text(json.dumps(meta), encoding="utf-8")
+        try:
+            os.rename(tmp_dir, self._entry_dir(key))
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        self.evict()
+
+    def _entries(self):
+        if not self.root.exists():
+            return []
+        entries = []
+        for entry_dir in self.root.iterdir():
+            if not entry_dir.is_dir() or entry_dir.name.startswith("."):
+                continue
+            meta = self._read_meta(entry_dir)
+            if meta is None:
+                continue
+            try:
+                last_used = (entry_dir / META_NAME).stat().st_mtime
+            except OSError:
+                continue
+            entries.append((last_used, entry_dir, meta))
+        return entries
+
+    def evict(self) -> int:
+        """按最近访问时间淘汰，直到总大小不超过上限"""
+        entries = sorted(self._entries(), key=lambda e: e[0])
+        total = sum(meta.get("size", 0) for _, _, meta in entries)
+        removed = 0
+        for _, entry_dir, meta in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= meta.get("size", 0)
+            removed += 1
+        return removed
+
+    def purge(self, model_version: str, model: str = None) -> int:
+        """删除指定模型版本（可选再限定 model）的全部条目"""
+        removed = 0
+        for _, entry_dir, meta in self._entries():
+            if meta.get("model_version") != model_version:
+                continue
+            if model and meta.get("model") != model:
+                continue
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            removed += 1
+        return removed
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        return {
+            "enabled": self.enabled,
+            "entries": len(entries),
+            "bytes": sum(meta.get("size", 0) for _, _, meta in entries),
+            "max_bytes": self.max_bytes,
+            **self.counters(),
+        }
+
+
+result_cache = ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES)
+
+
+def cache_task_result(task):
+    """任务完成后写入结果缓存（task.cache_key 为空、结果为占位或模拟结果时跳过）"""
+    if not getattr(task, "cache_key", None):
+        return
+    try:
+        result_cache.store(
+            task.cache_key,
+            task.midi_path,
+            task.musicxml_path,
+            {
+                "model": task.model,
+                "mode": task.mode,
+                "quantization": task.quantization,
+                "precision": task.precision,
+                "model_version": MODEL_VERSION,
+                "duration": task.duration,
+                "note_count": task.note_count,
+                "skipped_seconds": task.skipped_seconds,
+            },
+        )
+    except Exception as e:
+        print(f"[cache] store failed task={task.id}: {e}")
@@ -0,0 +1,218 @@
+"""
+输入音频与结果文件的存储后端。
+
+对象键为文件相对 DATA_DIR 的路径（uploads/<task_id>.wav、results/<task_id>/result.mid），
+两种后端共用：
+- LocalStorage（默认）：文件就在 UPLOAD_DIR / RESULT_DIR 下，没有签名 URL，远程 worker 经由 API 传输
+- S3Storage：S3 兼容的对象存储（路径风格 <endpoint>/<bucket>/<key>，适用于 AWS S3 与 MinIO）。
+  API 收到上传后写入存储，领取任务时给远程 worker 下发短期有效的签名 URL（AWS SigV4 查询串签名），
+  输入与结果直接在 worker 与存储之间传输，不经过 API
+
+S3Storage 只用 requests 与标准库实现签名与传输，不依赖 boto3。
+"""
+import hashlib
+import hmac
+import os
+import shutil
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import quote, urlsplit
+
+import requests
+
+try:
+    from .config import (
+        DATA_DIR, STORAGE_BACKEND, STORAGE_URL_EXPIRES,
+        S3_ENDPOINT, S3_BUCKET, S3_ACCESS_KEY, S3_SECRET_KEY, S3_REGION, S3_PREFIX,
+    )
+except ImportError:
+    from backend.config import (
+        DATA_DIR, STORAGE_BACKEND, STORAGE_URL_EXPIRES,
+        S3_ENDPOINT, S3_BUCKET, S3_ACCESS_KEY, S3_SECRET_KEY, S3_REGION, S3_PREFIX,
+    )
+
+TRANSFER_CHUNK_SIZE = 1024 * 1024
+TRANSFER_TIMEOUT = 120
+
+
+class StorageError(Exception):
+    pass
+
+
+class ObjectTooLarge(StorageError):
+    pass
+
+
+def storage_key(path) -> str:
+    """本地路径对应的对象键（相对 DATA_DIR）"""
+    return Path(path).resolve().relative_to(Path(DATA_DIR).resolve()).as_posix()
+
+
+def _copy_limited(read, target: Path, max_bytes: int = 0) -> int:
+    """分块写入 target（先写临时文件再替换），超过 max_bytes 时抛出 ObjectTooLarge"""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(target.name + ".part")
+    size = 0
+    try:
+        with open(tmp, "wb") as f:
+            for chunk in read():
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise ObjectTooLarge(f"object exceeds {max_bytes} bytes")
+                f.write(chunk)
+        os.replace(tmp, target)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return size
+
+
+class LocalStorage:
+    """文件保存在 DATA_DIR 下；远程 worker 经由 API 的 /input 与 /complete 传输"""
+
+    direct_transfer = False
+
+    def __init__(self, root: Path = DATA_DIR):
+        self.root = Path(root)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key
+
+    def put_file(self, path, key: str = None):
+        target = self._path(key or storage_key(path))
+        if target.resolve() == Path(path).resolve():
+            return
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(path, target)
+
+    def fetch(self, key: str, target, max_bytes: int = 0) -> int:
+        source = self._path(key)
+        if not source.exists():
+            raise FileNotFoundError(key)
+        if source.resolve() == Path(target).resolve():
+            return source.stat().st_size
+
+        def read():
+            with open(source, "rb") as f:
+                yield from iter(lambda: f.read(TRANSFER_CHUNK_SIZE), b"")
+
+        return _copy_limited(read, Path(target), max_bytes)
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def download_url(self, key: str, expires: int = None):
+        return None
+
+    def upload_url(self, key: str, expires: int = None):
+        return None
+
+
+def _hmac(key: bytes, msg: str) -> bytes:
+    return hmac.new(key, msg.encode("utf-8"), hashlib.sha256).digest()
+
+
+class S3Storage:
+    """S3 兼容对象存储；签名 URL 使用 AWS SigV4 查询串签名（UNSIGNED-PAYLOAD）"""
+
+    direct_transfer = True
+
+    def __init__(self, endpoint: str, bucket: str, access_key: str, secret_key: str,
+                 region: str = "us-east-1", prefix: str = "", expires: int = STORAGE_URL_EXPIRES):
+        if not endpoint or not bucket:
+            raise ValueError("S3 storage requires S3_ENDPOINT and S3_BUCKET")
+        self.endpoint = endpoint.rstrip("/")
+        self.host = urlsplit(self.endpoint).netloc
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.prefix = prefix.strip("/")
+        self.expires = expires
+        self._local = threading.local()
+
+    @property
+    def _http(self) -> requests.Session:
+        # requests.Session 不保证线程安全，每个线程各用一个
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _object_path(self, key: str) -> str:
+        full_key = f"{self.prefix}/{key}" if self.prefix else key
+        return "/" + quote(f"{self.bucket}/{full_key}", safe="/")
+
+    def presign(self, method: str, key: str, expires: int = None, now: datetime = None) -> str:
+        """生成签名 URL；now 仅用于校验签名（见测试中的存储替身）"""
+        now = now or datetime.now(timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        scope = f"{now.strftime('%Y%m%d')}/{self.region}/s3/aws4_request"
+        path = self._object_path(key)
+        params = {
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{self.access_key}/{scope}",
+            "X-Amz-Date": amz_date,
+            "X-Amz-Expires": str(int(expires or self.expires)),
+            "X-Amz-SignedHeaders": "host",
+        }
+        query = "&".join(f"{quote(k, safe='~')}={quote(v, safe='~')}" for k, v in sorted(params.items()))
+        canonical_request = "\n".join([method, path, query, f"host:{self.host}\n", "host", "UNSIGNED-PAYLOAD"])
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+        ])
+        signing_key = _hmac(("AWS4" + self.secret_key).encode("utf-8"), now.strftime("%Y%m%d"))
+        for part in (self.region, "s3", "aws4_request"):
+            signing_key = _hmac(signing_key, part)
+        signature = hmac.new(signing_key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+        return f"{self.endpoint}{path}?{query}&X-Amz-Signature={signature}"
+
+    def download_url(self, key: str, expires: int = None) -> str:
+        return self.presign("GET", key, expires)
+
+    def upload_url(self, key: str, expires: int = None) -> str:
+        return self.presign("PUT", key, expires)
+
+    def put_file(self, path, key: str = None):
+        key = key or storage_key(path)
+        try:
+            with open(path, "rb") as f:
+                resp = self._http.put(self.upload_url(key), data=f, timeout=TRANSFER_TIMEOUT)
+        except requests.RequestException as e:
+            raise StorageError(f"PUT {key} failed: {e}") from e
+        if resp.status_code >= 300:
+            raise StorageError(f"PUT {key} failed: HTTP {resp.status_code}")
+
+    def fetch(self, key: str, target, max_bytes: int = 0) -> int:
+        try:
+            with self._http.get(self.download_url(key), stream=True, timeout=TRANSFER_TIMEOUT) as resp:
+                if resp.status_code == 404:
+                    raise FileNotFoundError(key)
+                if resp.status_code >= 300:
+                    raise StorageError(f"GET {key} failed: HTTP {resp.status_code}")
+                return _copy_limited(lambda: resp.iter_content(TRANSFER_CHUNK_SIZE), Path(target), max_bytes)
+        except requests.RequestException as e:
+            raise StorageError(f"GET {key} failed: {e}") from e
+
+    def exists(self, key: str) -> bool:
+        try:
+            resp = self._http.head(self.presign("HEAD", key), timeout=TRANSFER_TIMEOUT)
+        except requests.RequestException as e:
+            raise StorageError(f"HEAD {key} failed: {e}") from e
+        if resp.status_code == 404:
+            return False
+        if resp.status_code >= 300:
+            raise StorageError(f"HEAD {key} failed: HTTP {resp.status_code}")
+        return True
+
+
+def make_storage(backend: str = STORAGE_BACKEND):
+    if backend == "local":
+        return LocalStorage()
+    if backend == "s3":
+        return S3Storage(S3_ENDPOINT, S3_BUCKET, S3_ACCESS_KEY, S3_SECRET_KEY, S3_REGION, S3_PREFIX)
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+
+
+storage = make_storage()
@@ -0,0 +1,176 @@
+"""
+本地部署入口：启动多进程 API（uvicorn --workers）与 N 个转谱 worker 进程。
+每个 worker 绑定一组互不重叠的 CPU 核心，进程意外退出后自动重启。
+
+    python -m backend.supervisor                       # 按机器核心数推算
+    python -m backend.supervisor --workers 8 --threads 4
+    python -m backend.supervisor --dry-run             # 只打印核心划分
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+try:
+    from .config import (
+        WORKER_PROCESSES, WORKER_THREADS, WORKER_RESERVED_CORES,
+        API_HOST, API_PORT, API_WORKERS,
+    )
+    from .mtmt3_core.cpu_affinity import available_cores, plan_worker_cores, worker_env
+    from .mtmt3_core.precision import check_default_precision
+except ImportError:
+    from backend.config import (
+        WORKER_PROCESSES, WORKER_THREADS, WORKER_RESERVED_CORES,
+        API_HOST, API_PORT, API_WORKERS,
+    )
+    from backend.mtmt3_core.cpu_affinity import available_cores, plan_worker_cores, worker_env
+    from backend.mtmt3_core.precision import check_default_precision
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+# 进程存活超过该秒数后退出，视为偶发崩溃，立即重启；否则按指数退避
+STABLE_SECONDS = 30
+MAX_RESTART_DELAY = 60
+
+
+class ManagedProcess:
+    def __init__(self, name: str, args, env: dict = None):
+        self.name = name
+        self.args = args
+        self.env = env or {}
+        self.proc = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.restart_delay = 1.0
+        self.next_start = 0.0
+
+    def start(self):
+        env = dict(os.environ, **self.env)
+        self.proc = subprocess.Popen(self.args, cwd=str(PROJECT_ROOT), env=env)
+        self.started_at = time.monotonic()
+        print(f"[supervisor] started {self.name} pid={self.proc.pid}")
+
+    def check(self, now: float):
+        """进程已退出时安排重启；到达重启时间后重新启动"""
+        if self.proc is not None:
+            code = self.proc.poll()
+            if code is None:
+                return
+            lived = now - self.started_at
+            if lived >= STABLE_SECONDS:
+                self.restart_delay = 1.0
+            else:
+                self.restart_delay = min(self.restart_delay * 2, MAX_RESTART_DELAY)
+            print(f"[supervisor] {self.name} pid={self.proc.pid} exited code={code} after {lived:.0f}s, "
+                  f"restarting in {self.restart_delay:.0f}s")
+            self.proc = None
+            self.next_start = now + self.restart_delay
+            self.restarts += 1
+        if now >= self.next_start:
+            self.start()
+
+    def stop(self, timeout: float = 10.0):
+        if self.proc is None or self.proc.poll() is not None:
+            return
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+
+def build_processes(workers: int, threads: int, reserved: int, api_workers: int,
+                    host: str, port: int, with_api: bool = True):
+    processes = []
+    if with_api:
+        processes.append(ManagedProcess(
+            "api",
+            [sys.executable, "-m", "uvicorn", "backend.main:app",
+             "--host", host, "--port", str(port), "--workers", str(max(1, api_workers))],
+            # 建表与租约回收由 supervisor 各做一份，uvicorn 的各个 worker 进程都不再重复
+            {"API_INIT_DB": "0", "API_LEASE_REAPER": "0"},
+        ))
+    plan = plan_worker_cores(available_cores(), workers, threads, reserved)
+    for i, cores in enumerate(plan):
+        processes.append(ManagedProcess(
+            f"worker-{i}",
+            [sys.executable, "-m", "backend.worker"],
+            worker_env(cores),
+        ))
+    return processes, plan
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="启动 API 与多进程转谱 worker")
+    parser.add_argument("--workers", type=int, default=WORKER_PROCESSES, help="worker 进程数，0 为自动")
+    parser.add_argument("--threads", type=int, default=WORKER_THREADS, help="每个 worker 的线程/核心数，0 为自动")
+    parser.add_argument("--reserved-cores", type=int, default=WORKER_RESERVED_CORES)
+    parser.add_argument("--api-workers", type=int, default=API_WORKERS)
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--no-api", action="store_true", help="只启动 worker")
+    parser.add_argument("--dry-run", action="store_true", help="只打印核心划分，不启动进程")
+    args = parser.parse_args(argv)
+    # 无效的默认精度会让每个 worker 启动即退出、被反复重启，在这里先报错
+    check_default_precision()
+
+    processes, plan = build_processes(args.workers, args.threads, args.reserved_cores,
+                                      args.api_workers, args.host, args.port, with_api=not args.no_api)
+    print(f"[supervisor] {len(available_cores())} cores available, {len(plan)} workers x "
+          f"{len(plan[0]) if plan else 0} threads")
+    for i, cores in enumerate(plan):
+        print(f"  worker-{i}: cores {','.join(str(c) for c in cores)}")
+    if args.dry_run:
+        return
+
+    # 建表与补列只在这里做一次，避免多个 API 进程同时迁移
+    try:
+        from .db import init_db, run_lease_reaper
+        from .notify import notify_workers
+    except ImportError:
+        from backend.db import init_db, run_lease_reaper
+        from backend.notify import notify_workers
+    init_db()
+
+    # API 进程不再各自回收过期租约，由这里运行唯一的回收线程（--no-api 时由外部的 API 负责）
+    reaper_stop = threading.Event()
+    if not args.no_api:
+        threading.Thread(target=run_lease_reaper, kwargs={"on_requeued": notify_workers, "stop": reaper_stop},
+                         name="lease-reaper", daemon=True).start()
+
+    stopping = []
+
+    def _stop(signum, frame):
+        stopping.append(signum)
+
+    signal.signal(signal.SIGINT, _stop)
+    signal.signal(signal.SIGTERM, _stop)
+
+    for p in processes:
+        p.start()
+    print(f"\n📡 API服务器: http://{args.host}:{args.port}\n按 Ctrl+C 停止所有服务\n")
+
+    try:
+        while not stopping:
+            now = time.monotonic()
+            for p in processes:
+                p.check(now)
+            time.sleep(1)
+    finally:
+        print("\n[supervisor] stopping...")
+        reaper_stop.set()
+        for p in processes:
+            if p.proc is not None and p.proc.poll() is None:
+                p.proc.terminate()
+        for p in processes:
+            p.stop()
+        print("✅ 服务已停止")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+任务状态变化的发布/订阅，供前端通过 SSE 接收进度推送，代替每隔几秒轮询 /api/tasks/{id}。
+
+事件只携带任务 id，不携带内容：订阅方收到通知后自行读取数据库中的最新状态，
+因此同一任务在一次读取前的多次变化会合并为一次推送，且推送内容与 GET /api/tasks/{id} 一致。
+
+publish_task_updates() 通知本进程的订阅者，并经 notify.py 的 UDP 通道广播给同机其他进程
+（多 API 进程、直接写库的本地 worker）；收到广播的 API 进程转发给自己的订阅者。
+数据报可能丢失，订阅方在等待超时后也会重新读取一次状态作为兜底。
+"""
+import asyncio
+import threading
+
+try:
+    from .notify import notify_task_updates
+except ImportError:
+    from backend.notify import notify_task_updates
+
+
+class Subscription:
+    """一个订阅者（一条 SSE 连接）：在所属事件循环内等待关注的任务发生变化"""
+
+    def __init__(self, task_ids, loop: asyncio.AbstractEventLoop):
+        self.task_ids = set(task_ids)
+        self._loop = loop
+        self._event = asyncio.Event()
+        self._changed = set()
+        self._lock = threading.Lock()
+
+    def notify(self, task_id: str):
+        """可在任意线程调用"""
+        with self._lock:
+            first = not self._changed
+            self._changed.add(task_id)
+        if first:
+            try:
+                self._loop.call_soon_threadsafe(self._event.set)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+
+    async def wait(self, timeout: float) -> set:
+        """等待变化，返回期间发生变化的任务 id；超时返回空集合"""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._event.clear()
+        with self._lock:
+            changed, self._changed = self._changed, set()
+        return changed
+
+
+class TaskEventHub:
+    def __init__(self):
+        self._subscribers = {}  # task_id -> set(Subscription)
+        self._lock = threading.Lock()
+
+    def subscribe(self, task_ids) -> Subscription:
+        """在事件循环内调用"""
+        subscription = Subscription(task_ids, asyncio.get_running_loop())
+        with self._lock:
+            for task_id in subscription.task_ids:
+                self._subscribers.setdefault(task_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            for task_id in subscription.task_ids:
+                subscribers = self._subscribers.get(task_id)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[task_id]
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len({s for subscribers in self._subscribers.values() for s in subscribers})
+
+    def publish(self, task_ids):
+        """只通知本进程的订阅者（UDP 广播的接收端调用这里）"""
+        with self._lock:
+            targets = [(s, task_id) for task_id in task_ids for s in self._subscribers.get(task_id, ())]
+        for subscription, task_id in targets:
+            subscription.notify(task_id)
+
+
+hub = TaskEventHub()
+
+
+def publish_task_updates(task_ids):
+    """任务状态或进度已写入数据库后调用：通知本进程订阅者并广播给同机其他进程"""
+    task_ids = [task_id for task_id in task_ids if task_id]
+    if not task_ids:
+        return
+    hub.publish(task_ids)
+    notify_task_updates(task_ids)
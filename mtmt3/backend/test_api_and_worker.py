@@ -1,6 +1,8 @@
 import os
+import time
 from pathlib import Path
 
+import numpy as np
 import pytest
 from fastapi.testclient import TestClient
 
@@ -86,6 +88,7 @@ def test_get_task_returns_correct_status_and_details(client):
         "musicxml_url": f"/download/{task_id}.musicxml",
         "duration": pytest.approx(12.3),
         "note_count": pytest.approx(456),
+        "skipped_seconds": None,
     }
     assert data["error_message"] is None
 
@@ -154,7 +157,7 @@ def test_process_one_task_processes_queued_task(monkeypatch):
         db.commit()
         db.refresh(task)
 
-        def fake_run_mtmt3(audio_path, model, mode, quantization, output_dir):
+        def fake_run_mtmt3(audio_path, model, mode, quantization, output_dir, progress_callback=None, **kwargs):
             return {
                 "midi_path": str(RESULT_DIR / f"{task_id}.mid"),
                 "musicxml_path": str(RESULT_DIR / f"{task_id}.musicxml"),
@@ -177,3 +180,1190 @@ def test_process_one_task_processes_queued_task(monkeypatch):
         assert task.error_message is None
     finally:
         db.close()
+
+
+def test_duplicate_upload_served_from_result_cache(client, monkeypatch, tmp_path):
+    # 6. 相同内容与参数的重复上传直接命中结果缓存，无需排队
+    from backend import main, result_cache as cache_module
+
+    cache = cache_module.ResultCache(tmp_path / "cache", 10 * 1024 * 1024)
+    monkeypatch.setattr(cache_module, "result_cache", cache)
+    monkeypatch.setattr(main, "result_cache", cache)
+    monkeypatch.setattr(main, "WORKER_TOKEN", "secret")
+
+    file_content = b"same song uploaded twice"
+    first = client.post("/api/tasks", files={"file": ("a.wav", file_content, "audio/wav")}).json()
+    assert first["status"] == "queued"
+
+    claimed = client.post("/api/worker/tasks/claim", headers={"x-worker-token": "secret"}).json()
+    assert claimed["task"]["task_id"] == first["task_id"]
+    response = client.post(
+        f"/api/worker/tasks/{first['task_id']}/complete",
+        headers={"x-worker-token": "secret"},
+        files={
+            "midi_file": ("result.mid", b"MThd midi bytes", "audio/midi"),
+            "musicxml_file": ("result.musicxml", b"<?xml version='1.0'?><score-partwise/>", "application/xml"),
+        },
+        data={"duration": "3.5", "note_count": "42"},
+    )
+    assert response.status_code == 200
+
+    second = client.post("/api/tasks", files={"file": ("b.wav", file_content, "audio/wav")}).json()
+    assert second["status"] == "done"
+    assert second["cached"] is True
+
+    data = client.get(f"/api/tasks/{second['task_id']}").json()
+    assert data["result"]["note_count"] == pytest.approx(42)
+    assert client.get(f"/download/{second['task_id']}.mid").content == b"MThd midi bytes"
+
+    other_mode = client.post(
+        "/api/tasks",
+        files={"file": ("c.wav", file_content, "audio/wav")},
+        data={"mode": "a_cappella"},
+    ).json()
+    assert other_mode["status"] == "queued"
+    assert cache.stats()["hits"] == 1
+    # 计数写在磁盘上，多进程部署时汇总所有进程（这里模拟另一个 API 进程的计数文件）
+    (tmp_path / "cache" / ".stats" / "1.json").write_text('{"hits": 2, "misses": 3}')
+    stats = cache.stats()
+    assert stats["hits"] == 3 and stats["misses"] == cache.misses + 3
+    assert cache.purge(cache_module.MODEL_VERSION) == 1
+
+    # MusicXML 转换失败的占位文件与模拟模式的结果不进入缓存
+    failed = tmp_path / "failed"
+    failed.mkdir()
+    (failed / "result.mid").write_bytes(b"MThd midi bytes")
+    (failed / "result.musicxml").write_text("<musicxml>conversion_failed</musicxml>", encoding="utf-8")
+    (failed / "mock.mid").write_bytes(b"dummy midi")
+    (failed / "mock.musicxml").write_text("<?xml version='1.0'?><score-partwise/>", encoding="utf-8")
+    cache.store("k-failed", str(failed / "result.mid"), str(failed / "result.musicxml"), {})
+    cache.store("k-mock", str(failed / "mock.mid"), str(failed / "mock.musicxml"), {})
+    assert cache.stats()["entries"] == 0
+    assert cache_module.make_cache_key("h", "m", "x", "none", mock=True) != cache_module.make_cache_key(
+        "h", "m", "x", "none", mock=False)
+
+
+def test_pipelined_worker_defers_postprocess(monkeypatch, tmp_path):
+    # 7. 流水线模式：推理返回后任务仍为 processing，后处理完成后才变为 done
+    from concurrent.futures import ThreadPoolExecutor
+    from backend import worker
+    from backend.mtmt3_core.midi_utils import NOTE_DTYPE, notes_to_midi
+
+    db = SessionLocal()
+    try:
+        task = Task(id="pipelined-task", status="queued", input_path="input.wav")
+        db.add(task)
+        db.commit()
+
+        def fake_run_mtmt3(audio_path, model, mode, quantization, output_dir, progress_callback=None,
+                           defer_postprocess=False, **kwargs):
+            assert defer_postprocess is True
+            notes = np.zeros(3, dtype=NOTE_DTYPE)
+            notes["start"] = [0.0, 0.5, 1.0]
+            notes["end"] = notes["start"] + 0.4
+            notes["pitch"] = [60, 62, 64]
+            notes["velocity"] = 90
+            midi_path = tmp_path / "result.mid"
+            notes_to_midi(notes).save(str(midi_path))
+            return {
+                "midi_path": str(midi_path),
+                "musicxml_path": str(tmp_path / "result.musicxml"),
+                "duration": 2.0,
+                "note_count": None,
+                "postprocess_pending": True,
+            }
+
+        monkeypatch.setattr(worker, "run_mtmt3", fake_run_mtmt3)
+
+        finished = []
+        post_pool = ThreadPoolExecutor(max_workers=1)
+        post_pool.submit(time.sleep, 0.2)  # 占住后处理线程，确认推理阶段先返回
+        assert worker.process_one_task_pipelined(db, post_pool, on_finished=lambda: finished.append(1))
+
+        db.refresh(task)
+        assert task.status == "processing"
+
+        post_pool.shutdown(wait=True)
+        db.refresh(task)
+        assert task.status == "done"
+        assert task.note_count == 3
+        assert (tmp_path / "result.musicxml").exists()
+        assert finished == [1]
+    finally:
+        db.close()
+
+
+def test_create_task_precision_parameter(client):
+    # 8. 推理精度作为任务参数保存；非法取值返回 400
+    response = client.post(
+        "/api/tasks",
+        files={"file": ("test.wav", b"fake audio content", "audio/wav")},
+        data={"precision": "INT8"},
+    )
+    assert response.status_code == 200
+
+    db = SessionLocal()
+    try:
+        task = db.query(Task).filter(Task.id == response.json()["task_id"]).first()
+        assert task.precision == "int8"
+    finally:
+        db.close()
+
+    response = client.post(
+        "/api/tasks",
+        files={"file": ("test.wav", b"fake audio content", "audio/wav")},
+        data={"precision": "fp8"},
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("use_returning", [True, False])
+def test_concurrent_claims_never_double_claim(tmp_path, use_returning):
+    # 9. 数十个并发领取者争抢同一个 SQLite 文件中的任务：每个任务只被领取一次
+    import threading
+    from datetime import datetime, timedelta
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from backend.db import claim_next_task
+
+    stress_engine = create_engine(
+        f"sqlite:///{tmp_path / 'claims.sqlite3'}",
+        connect_args={"check_same_thread": False},
+        pool_size=40,
+    )
+    # False 时走"先查候选、再条件更新"的回退路径
+    stress_engine.dialect.update_returning = use_returning
+    Base.metadata.create_all(bind=stress_engine)
+    StressSession = sessionmaker(autocommit=False, autoflush=False, bind=stress_engine)
+
+    task_count, claimers = 600, 32
+    base = datetime.utcnow()
+    db = StressSession()
+    db.add_all([
+        Task(id=f"task-{i:04d}", status="queued", input_path="x",
+             created_at=base + timedelta(microseconds=i))
+        for i in range(task_count)
+    ])
+    db.commit()
+    db.close()
+
+    claimed = [[] for _ in range(claimers)]
+    start = threading.Barrier(claimers)
+
+    def claimer(slot):
+        session = StressSession()
+        try:
+            start.wait()
+            while True:
+                task = claim_next_task(session)
+                if task is None:
+                    break
+                claimed[slot].append(task.id)
+        finally:
+            session.close()
+
+    threads = [threading.Thread(target=claimer, args=(i,)) for i in range(claimers)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    all_claims = [task_id for ids in claimed for task_id in ids]
+    print(f"\n[returning={use_returning}] {claimers} claimers: {len(all_claims)} claims in {elapsed:.2f}s "
+          f"({len(all_claims) / elapsed:.0f} claims/s)")
+    assert len(all_claims) == len(set(all_claims)) == task_count
+
+    db = StressSession()
+    try:
+        assert db.query(Task).filter(Task.status == "queued").count() == 0
+    finally:
+        db.close()
+    stress_engine.dispose()
+
+
+def test_expired_lease_requeued_and_stale_worker_rejected(client, monkeypatch):
+    # 10. 租约过期的任务被回收重新排队；原 worker 的进度与结果被拒绝（409），超过重试次数后失败
+    from datetime import datetime, timedelta
+    from backend import main
+    from backend.db import requeue_expired_tasks
+
+    monkeypatch.setattr(main, "WORKER_TOKEN", "secret")
+    task_id = client.post("/api/tasks", files={"file": ("a.wav", b"audio", "audio/wav")}).json()["task_id"]
+
+    def claim(worker_id):
+        return client.post(
+            "/api/worker/tasks/claim",
+            headers={"x-worker-token": "secret", "x-worker-id": worker_id},
+        ).json()["task"]
+
+    def progress(worker_id):
+        return client.post(
+            f"/api/worker/tasks/{task_id}/progress",
+            headers={"x-worker-token": "secret", "x-worker-id": worker_id},
+            json={"progress": 0.5},
+        )
+
+    assert claim("worker-a")["attempt"] == 1
+    assert progress("worker-a").status_code == 200
+
+    later = datetime.utcnow() + timedelta(hours=1)
+    db = SessionLocal()
+    try:
+        assert requeue_expired_tasks(db, max_attempts=2, now=later) == (1, 0)
+        task = db.query(Task).filter(Task.id == task_id).first()
+        assert task.status == "queued" and task.worker_id is None
+    finally:
+        db.close()
+
+    # 已被回收：原 worker 的进度上报返回 409
+    assert progress("worker-a").status_code == 409
+    assert claim("worker-b")["attempt"] == 2
+    assert progress("worker-a").status_code == 409
+    assert progress("worker-b").status_code == 200
+
+    stale = client.post(
+        f"/api/worker/tasks/{task_id}/complete",
+        headers={"x-worker-token": "secret", "x-worker-id": "worker-a"},
+        files={
+            "midi_file": ("result.mid", b"midi", "audio/midi"),
+            "musicxml_file": ("result.musicxml", b"<xml/>", "application/xml"),
+        },
+    )
+    assert stale.status_code == 409
+
+    # 第二次也过期：达到重试上限，标记失败
+    db = SessionLocal()
+    try:
+        assert requeue_expired_tasks(db, max_attempts=2, now=later + timedelta(hours=1)) == (0, 1)
+        task = db.query(Task).filter(Task.id == task_id).first()
+        assert task.status == "failed"
+        assert "lease expired" in task.error_message
+    finally:
+        db.close()
+
+
+def test_create_task_wakes_idle_worker(client, monkeypatch, tmp_path):
+    # 11. 提交任务后空闲 worker 通过唤醒通知立即返回，而不是等到轮询超时
+    from backend import notify
+
+    monkeypatch.setattr(notify, "WAKEUP_DIR", tmp_path / "wakeup")
+    (tmp_path / "wakeup").mkdir()
+    (tmp_path / "wakeup" / "999999998.port").write_text("8")
+    listener = notify.WakeupListener()
+    try:
+        # 已退出进程留下的端口文件在监听器启动时被清理；发送通知时不检查进程存活，由定期清理负责
+        assert not (tmp_path / "wakeup" / "999999998.port").exists()
+        (tmp_path / "wakeup" / "999999999.port").write_text("9")
+
+        since = listener.generation
+        assert listener.wait(since, timeout=0.05) is False
+
+        started = time.perf_counter()
+        response = client.post("/api/tasks", files={"file": ("a.wav", b"audio", "audio/wav")})
+        assert response.status_code == 200
+        assert listener.wait(since, timeout=5.0) is True
+        assert time.perf_counter() - started < 1.0
+        assert (tmp_path / "wakeup" / "999999999.port").exists()
+        assert notify.prune_port_files() == 1
+        assert not (tmp_path / "wakeup" / "999999999.port").exists()
+    finally:
+        listener.close()
+    assert not list((tmp_path / "wakeup").glob("*.port"))
+
+
+def test_long_poll_claim_returns_when_task_arrives(client, monkeypatch):
+    # 12. 长轮询领取：没有任务时挂起，新任务提交后立即返回；超时返回 null
+    import threading
+    from backend import main
+    from backend.notify import notify_workers
+
+    monkeypatch.setattr(main, "WORKER_TOKEN", "secret")
+    headers = {"x-worker-token": "secret", "x-worker-id": "remote-1"}
+
+    started = time.perf_counter()
+    response = client.post("/api/worker/tasks/claim", params={"wait": 0.3}, headers=headers)
+    assert response.json() == {"task": None, "tasks": []}
+    assert 0.25 <= time.perf_counter() - started < 2.0
+
+    def submit_later():
+        time.sleep(0.3)
+        db = SessionLocal()
+        try:
+            db.add(Task(id="late-task", status="queued", input_path="x"))
+            db.commit()
+        finally:
+            db.close()
+        notify_workers()
+
+    submitter = threading.Thread(target=submit_later)
+    started = time.perf_counter()
+    submitter.start()
+    response = client.post("/api/worker/tasks/claim", params={"wait": 10}, headers=headers)
+    elapsed = time.perf_counter() - started
+    submitter.join()
+
+    assert response.json()["task"]["task_id"] == "late-task"
+    assert elapsed < 2.0
+
+
+def test_remote_worker_prefetches_next_task_during_inference(monkeypatch, tmp_path):
+    # 13. 远程 worker 流水线：推理当前任务时预先下载并解码下一个任务，结果在后台上传
+    import threading
+    from backend import remote_worker
+
+    events = []
+    lock = threading.Lock()
+    uploaded = threading.Event()
+    pending = [{"task_id": f"t{i}", "input_url": f"/in/{i}", "input_filename": "a.wav"} for i in range(3)]
+
+    def log(event):
+        with lock:
+            events.append(event)
+
+    def fake_claim_task(wait=0):
+        with lock:
+            if pending:
+                return pending.pop(0)
+        threading.Event().wait()  # 没有更多任务：一直挂起
+
+    class Ok:
+        status_code = 200
+
+    def fake_load_audio(path, sr=16000, mmap_dir=None):
+        log(f"decode:{Path(path).parent.name.split('_')[1]}")
+        return np.zeros(sr, dtype=np.float32), sr, 0.5
+
+    def fake_run_mtmt3(audio_path, model, mode, quantization, output_dir, progress_callback=None,
+                       decoded_audio=None, **kwargs):
+        task_id = Path(output_dir).parent.name.split("_")[1]
+        assert decoded_audio is not None
+        log(f"infer-start:{task_id}")
+        time.sleep(0.3)
+        Path(output_dir, "result.mid").write_bytes(b"midi")
+        Path(output_dir, "result.musicxml").write_text("<xml/>")
+        log(f"infer-end:{task_id}")
+        return {"midi_path": str(Path(output_dir, "result.mid")),
+                "musicxml_path": str(Path(output_dir, "result.musicxml")),
+                "duration": 1.0, "note_count": 1}
+
+    def fake_upload(task_id, *args, **kwargs):
+        log(f"upload:{task_id}")
+        if task_id == "t2":
+            uploaded.set()
+
+    monkeypatch.setattr(remote_worker, "_progress", remote_worker.ProgressSender(send=lambda updates: {}))
+    monkeypatch.setattr(remote_worker, "claim_task", fake_claim_task)
+    monkeypatch.setattr(remote_worker, "_download_file", lambda url, path: Path(path).write_bytes(b"x"))
+    monkeypatch.setattr(remote_worker, "_post_json", lambda path, payload: Ok())
+    monkeypatch.setattr(remote_worker, "load_audio", fake_load_audio)
+    monkeypatch.setattr(remote_worker, "run_mtmt3", fake_run_mtmt3)
+    monkeypatch.setattr(remote_worker, "_upload_result", fake_upload)
+
+    threading.Thread(target=remote_worker.pipelined_worker_loop, daemon=True).start()
+    assert uploaded.wait(timeout=10)
+
+    with lock:
+        order = list(events)
+    # 下一个任务在当前任务推理结束前已解码完成
+    assert order.index("decode:t1") < order.index("infer-end:t0")
+    assert order.index("decode:t2") < order.index("infer-end:t1")
+    assert [e for e in order if e.startswith("upload")] == ["upload:t0", "upload:t1", "upload:t2"]
+
+
+def test_batch_claim_groups_compatible_tasks(client, monkeypatch):
+    # 14. 批量领取：只领取与最早任务 model/mode/precision 相同的任务，各自持有租约
+    from datetime import datetime, timedelta
+    from backend import main
+
+    monkeypatch.setattr(main, "WORKER_TOKEN", "secret")
+    headers = {"x-worker-token": "secret", "x-worker-id": "remote-1"}
+    base = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        specs = [("a", "mtmt3_piano_vocal", None), ("b", "yourmt3", None), ("c", "mtmt3_piano_vocal", "int8"),
+                 ("d", "mtmt3_piano_vocal", None), ("e", "mtmt3_piano_vocal", None)]
+        for i, (task_id, model, precision) in enumerate(specs):
+            db.add(Task(id=task_id, status="queued", input_path="x", model=model, precision=precision,
+                        created_at=base + timedelta(seconds=i)))
+        db.commit()
+    finally:
+        db.close()
+
+    response = client.post("/api/worker/tasks/claim", params={"limit": 2}, headers=headers)
+    data = response.json()
+    assert [t["task_id"] for t in data["tasks"]] == ["a", "d"]
+    assert data["task"]["task_id"] == "a"
+
+    response = client.post("/api/worker/tasks/claim", params={"limit": 8}, headers=headers)
+    assert [t["task_id"] for t in response.json()["tasks"]] == ["b"]
+
+    db = SessionLocal()
+    try:
+        claimed = {t.id: t for t in db.query(Task).all()}
+        assert {k for k, t in claimed.items() if t.status == "processing"} == {"a", "b", "d"}
+        assert all(claimed[k].worker_id == "remote-1" and claimed[k].lease_expires_at for k in "abd")
+    finally:
+        db.close()
+
+
+def test_remote_progress_sender_coalesces_and_retries(client, monkeypatch):
+    # 15. 远程 worker 进度后台发送：不阻塞调用方，合并为最新值，失败后退避重试，批量接口逐个返回租约状态
+    import threading
+    from backend import main, remote_worker
+
+    calls = []
+    release = threading.Event()
+
+    def flaky_send(updates):
+        calls.append(dict(updates))
+        if len(calls) == 1:
+            release.wait(5)  # 模拟缓慢的 API
+            raise ConnectionError("api down")
+        return {"t2": "lost"} if "t2" in updates else {}
+
+    sender = remote_worker.ProgressSender(interval=60, flush_seconds=0.05, max_backoff=0.1, send=flaky_send)
+    sender.hold("t1", 0.05)
+    sender.hold("t2", 0.05)
+    sender.update("t1", 0.1)
+    time.sleep(0.2)  # 第一批发送中并挂起
+
+    started = time.perf_counter()
+    for p in (0.2, 0.3, 0.4):
+        sender.update("t1", p)
+    sender.update("t2", 0.5)
+    assert time.perf_counter() - started < 0.05  # 调用方不等待网络
+    release.set()
+
+    assert sender.flush(timeout=5)
+    assert calls[0] == {"t1": 0.1}
+    # 失败的一批与期间的新值合并重试，只发送最新值
+    assert calls[-1] == {"t1": 0.4, "t2": 0.5}
+    assert sender.counters["coalesced"] == 2
+    assert sender.counters["failed_requests"] == 1
+    with pytest.raises(remote_worker.TaskAborted):
+        sender.check("t2")
+    sender.check("t1")
+    sender.update("t2", 0.6)
+    assert sender.counters["dropped"] == 1
+
+    monkeypatch.setattr(main, "WORKER_TOKEN", "secret")
+    headers = {"x-worker-token": "secret", "x-worker-id": "remote-1"}
+    db = SessionLocal()
+    try:
+        db.add(Task(id="mine", status="processing", input_path="x", worker_id="remote-1"))
+        db.add(Task(id="theirs", status="processing", input_path="x", worker_id="remote-2"))
+        db.commit()
+    finally:
+        db.close()
+    response = client.post("/api/worker/tasks/progress", headers=headers, json={"updates": [
+        {"task_id": "mine", "progress": 0.5}, {"task_id": "theirs", "progress": 0.5},
+        {"task_id": "missing", "progress": 0.5},
+    ]})
+    assert response.json() == {"results": {"mine": "ok", "theirs": "lost", "missing": "not_found"}}
+
+
+def test_worker_registry_routes_by_model_and_device(client, monkeypatch):
+    # 16. worker 能力登记：已加载所需模型的任务优先，长音频交给 GPU、短音频交给 CPU，/api/workers 展示容量
+    from datetime import datetime, timedelta
+    from backend import main
+
+    from backend.config import ADMIN_TOKEN
+
+    monkeypatch.setattr(main, "WORKER_TOKEN", "secret")
+    # 未设置 ADMIN_TOKEN（或仍为示例值）时管理接口关闭，示例令牌无法访问
+    if not os.getenv("ADMIN_TOKEN"):
+        assert ADMIN_TOKEN == ""
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "change-me")
+    assert client.get("/api/workers", headers={"x-admin-token": "change-me"}).status_code == 503
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "admin")
+    gpu = {"x-worker-token": "secret", "x-worker-id": "gpu-1"}
+    cpu = {"x-worker-token": "secret", "x-worker-id": "cpu-1"}
+    assert client.post("/api/worker/register", headers=gpu,
+                       json={"device": "cuda", "models": ["mr_mt3"], "slots": 2}).status_code == 200
+    assert client.post("/api/worker/register", headers=cpu,
+                       json={"device": "cpu", "models": ["yourmt3"], "slots": 1, "throughput": 0.5}).status_code == 200
+
+    base = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        specs = [("short-mr", "mtmt3_piano_vocal", 20.0), ("long-mr", "mtmt3_piano_vocal", 600.0),
+                 ("short-your", "yourmt3", 15.0), ("long-your", "yourmt3", 900.0)]
+        for i, (task_id, model, seconds) in enumerate(specs):
+            db.add(Task(id=task_id, status="queued", input_path="x", model=model, input_seconds=seconds,
+                        created_at=base + timedelta(seconds=i)))
+        db.commit()
+    finally:
+        db.close()
+
+    def claim(headers):
+        task = client.post("/api/worker/tasks/claim", headers=headers).json()["task"]
+        return task and task["task_id"]
+
+    # GPU：已加载模型的长音频优先；CPU：已加载模型的短音频优先，长音频留给在线的 GPU
+    assert claim(gpu) == "long-mr"
+    assert claim(cpu) == "short-your"
+    assert claim(cpu) == "short-mr"
+    assert claim(cpu) is None
+    assert claim(gpu) == "long-your"
+
+    view = client.get("/api/workers", headers={"x-admin-token": "admin"}).json()
+    by_id = {w["worker_id"]: w for w in view["workers"]}
+    assert by_id["gpu-1"]["busy"] == 2 and by_id["gpu-1"]["utilization"] == 1.0
+    assert by_id["cpu-1"]["busy"] == 2 and by_id["cpu-1"]["throughput"] == 0.5
+    assert view["capacity"] == 3 and view["queued"] == 0
+
+
+def test_upload_limits_and_audio_sniffing(client, monkeypatch):
+    # 17. 上传分块写盘：超过大小上限返回 413，可以确定不是音频的文件返回 415，不留下部分文件
+    from fastapi import FastAPI, File, UploadFile
+    from backend import main
+    from backend.config import UPLOAD_DIR
+    from backend.uploads import UploadLimitMiddleware, sniff_audio
+
+    assert sniff_audio(b"RIFF\x00\x00\x00\x00WAVEfmt ") == "wav"
+    assert sniff_audio(b"\x00\x00\x00\x20ftypM4A ") == "m4a"
+    assert sniff_audio(b"fake audio content") is None
+
+    before = set(UPLOAD_DIR.iterdir())
+    response = client.post("/api/tasks", files={"file": ("cover.png", b"\x89PNG\r\n\x1a\n" + b"0" * 64, "image/png")})
+    assert response.status_code == 415
+
+    monkeypatch.setattr(main, "MAX_UPLOAD_BYTES", 1024)
+    response = client.post("/api/tasks", files={"file": ("big.wav", b"RIFF" + b"0" * 4096, "audio/wav")})
+    assert response.status_code == 413
+    assert set(UPLOAD_DIR.iterdir()) == before
+    with SessionLocal() as db:
+        assert db.query(Task).count() == 0
+
+    # 中间件在解析请求体之前拒绝：Content-Length 超限，或分块传输时累计超限
+    reached = []
+    small = FastAPI()
+    small.add_middleware(UploadLimitMiddleware, limits=[(lambda path: path == "/up", 1024 * 1024)])
+
+    @small.post("/up")
+    async def up(file: UploadFile = File(...)):
+        reached.append(True)
+        return {"ok": True}
+
+    small_client = TestClient(small)
+    assert small_client.post("/up", files={"file": ("a.wav", b"0" * 1000)}).status_code == 200
+    assert small_client.post("/up", content=b"0" * (2 * 1024 * 1024),
+                             headers={"content-type": "application/octet-stream"}).status_code == 413
+
+    def chunks():
+        for _ in range(40):
+            yield b"0" * 65536
+
+    response = small_client.post("/up", content=chunks(),
+                                 headers={"content-type": "multipart/form-data; boundary=x"})
+    assert response.status_code == 413
+    assert reached == [True]
+
+
+def test_progress_writer_coalesces_into_one_transaction():
+    # 18. WAL 模式；进度与续约按任务合并，一个事务批量写入，不改动已被回收的任务
+    from sqlalchemy import text
+    from backend.db import engine
+    from backend.progress_writer import ProgressWriter
+
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() > 0
+
+    db = SessionLocal()
+    try:
+        db.add(Task(id="mine", status="processing", input_path="x", worker_id="w1", progress=0.1))
+        db.add(Task(id="taken", status="processing", input_path="x", worker_id="w2", progress=0.1))
+        db.commit()
+    finally:
+        db.close()
+
+    writer = ProgressWriter(interval=3600)  # 后台线程不会在测试期间触发，手动 flush
+    for p in (0.2, 0.3, 0.4):
+        writer.submit("mine", "w1", p)
+    writer.submit("mine", "w1")  # 单纯续约保留最新进度
+    writer.submit("taken", "w1", 0.9)
+    assert writer.flush() == 2
+    assert writer.counters["coalesced"] == 3 and writer.counters["batches"] == 1
+
+    db = SessionLocal()
+    try:
+        mine = db.get(Task, "mine")
+        taken = db.get(Task, "taken")
+        assert mine.progress == 0.4 and mine.lease_expires_at is not None
+        assert taken.progress == 0.1 and taken.lease_expires_at is None
+    finally:
+        db.close()
+
+
+def test_task_events_stream_pushes_progress(client, monkeypatch, tmp_path):
+    # 19. SSE 推送：先推送当前状态，进度与完成写入后立即推送，全部结束后关闭；跨进程广播经 UDP 转发
+    import json
+    import socket
+    import threading
+    from backend import notify
+    from backend.progress_writer import ProgressWriter
+    from backend.task_events import publish_task_updates
+
+    monkeypatch.setattr(notify, "WAKEUP_DIR", tmp_path / "wakeup")
+    db = SessionLocal()
+    try:
+        db.add(Task(id="watched", status="processing", input_path="x", worker_id="w1", progress=0.1))
+        db.commit()
+    finally:
+        db.close()
+
+    assert client.get("/api/tasks/events", params={"ids": "watched,missing"}).status_code == 404
+
+    def work():
+        time.sleep(0.3)
+        writer = ProgressWriter(interval=0, on_write=publish_task_updates)
+        writer.submit("watched", "w1", 0.5)
+        time.sleep(0.3)
+        db = SessionLocal()
+        try:
+            db.query(Task).filter(Task.id == "watched").update({Task.status: "done", Task.progress: 1.0})
+            db.commit()
+        finally:
+            db.close()
+        publish_task_updates(["watched"])
+
+    worker = threading.Thread(target=work)
+    events = []
+    started = time.perf_counter()
+    worker.start()
+    with client.stream("GET", "/api/tasks/events", params={"ids": "watched"}) as response:
+        assert response.headers["content-type"].startswith("text/event-stream")
+        event = None
+        for line in response.iter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                events.append((event, json.loads(line[len("data: "):])))
+    worker.join()
+
+    assert time.perf_counter() - started < 5.0
+    progress = [data["progress"] for name, data in events if name == "task"]
+    assert progress == [0.1, 0.5, 1.0]
+    assert events[-2][1]["status"] == "done" and events[-2][1]["result"]["midi_url"]
+    assert events[-1] == ("end", {"task_ids": ["watched"]})
+
+    # 其他进程的监听器收到广播后转给自己的订阅者
+    # 没有订阅者的监听器（如转谱 worker）不登记 .updates，收不到进度广播
+    listener = notify.WakeupListener()
+    bystander = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    received = threading.Event()
+    try:
+        bystander.bind((notify.WAKEUP_HOST, 0))
+        bystander.settimeout(0.2)
+        (notify.WAKEUP_DIR / f"{os.getpid() + 1}.port").write_text(str(bystander.getsockname()[1]))
+        listener.add_update_handler(lambda ids: ids == ["a", "b"] and received.set())
+        notify.notify_task_updates(["a", "b"])
+        assert received.wait(2.0)
+        assert listener.generation == 0
+        with pytest.raises(socket.timeout):
+            bystander.recv(2048)
+    finally:
+        (notify.WAKEUP_DIR / f"{os.getpid() + 1}.port").unlink(missing_ok=True)
+        bystander.close()
+        listener.close()
+
+
+def test_bulk_status_and_etag(client):
+    # 20. 批量状态查询（按 id / 按状态与创建时间分页）；单个与批量查询支持 ETag，未变化返回 304
+    from datetime import datetime, timedelta
+    from backend.db import renew_lease
+
+    base = datetime(2026, 1, 1)
+    db = SessionLocal()
+    try:
+        for i, status in enumerate(["queued", "processing", "done", "failed", "done"]):
+            db.add(Task(id=f"t{i}", status=status, input_path="x", progress=0.5, worker_id="w1",
+                        error_message="boom" if status == "failed" else None,
+                        created_at=base + timedelta(seconds=i // 2), updated_at=base))
+        db.commit()
+    finally:
+        db.close()
+
+    data = client.get("/api/tasks", params={"ids": "t3,nope,t2"}).json()
+    assert [t["task_id"] for t in data["tasks"]] == ["t3", "t2"]
+    assert data["missing"] == ["nope"]
+    assert data["tasks"][0]["error_message"] == "boom" and "result" not in data["tasks"][0]
+    assert data["tasks"][1]["result"]["midi_url"] == "/download/t2.mid"
+
+    # 按创建时间分页，创建时间相同的任务不会被跳过
+    seen, params = [], {"status": "queued,processing,done", "limit": 1}
+    while True:
+        page = client.get("/api/tasks", params=params).json()
+        seen += [t["task_id"] for t in page["tasks"]]
+        if not page["next_created_after"]:
+            break
+        params.update(created_after=page["next_created_after"], after_id=page["next_after_id"])
+    assert seen == ["t0", "t1", "t2", "t4"]
+    assert client.get("/api/tasks", params={"status": "cancelled"}).status_code == 400
+
+    # 条件请求：单纯续约不改变 ETag，进度变化后失效
+    single = client.get("/api/tasks/t1")
+    bulk = client.get("/api/tasks", params={"ids": ["t1", "t2"]})
+    etag, bulk_etag = single.headers["etag"], bulk.headers["etag"]
+    db = SessionLocal()
+    try:
+        assert renew_lease(db, "t1", "w1")
+    finally:
+        db.close()
+    not_modified = client.get("/api/tasks/t1", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304 and not_modified.content == b""
+    assert client.get("/api/tasks", params={"ids": ["t1", "t2"]},
+                      headers={"If-None-Match": bulk_etag}).status_code == 304
+
+    db = SessionLocal()
+    try:
+        assert renew_lease(db, "t1", "w1", progress=0.7)
+    finally:
+        db.close()
+    changed = client.get("/api/tasks/t1", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.json()["progress"] == 0.7
+    assert client.get("/api/tasks", params={"ids": ["t1", "t2"]},
+                      headers={"If-None-Match": bulk_etag}).status_code == 200
+
+
+def test_download_precompressed_range_and_caching(client, tmp_path):
+    # 21. 结果下载：按 Accept-Encoding 返回预压缩副本，强 ETag + immutable，支持 Range；路径走内存 LRU
+    import gzip
+    from backend.artifacts import precompress_results, artifact_index
+
+    xml = ("<?xml version='1.0'?><score-partwise>"
+           + "<note><pitch><step>C</step><octave>4</octave></pitch></note>" * 500
+           + "</score-partwise>").encode()
+    musicxml_path = tmp_path / "result.musicxml"
+    midi_path = tmp_path / "result.mid"
+    musicxml_path.write_bytes(xml)
+    midi_path.write_bytes(os.urandom(256))  # 不可压缩：不生成副本
+    precompress_results(str(midi_path), str(musicxml_path))
+    assert (tmp_path / "result.musicxml.gz").stat().st_size < len(xml) / 10
+    assert not (tmp_path / "result.mid.gz").exists()
+
+    db = SessionLocal()
+    try:
+        db.add(Task(id="dl", status="done", input_path="x", midi_path=str(midi_path),
+                    musicxml_path=str(musicxml_path)))
+        db.add(Task(id="dl-running", status="processing", input_path="x", musicxml_path=str(musicxml_path)))
+        db.commit()
+    finally:
+        db.close()
+
+    gz = client.get("/download/dl.musicxml", headers={"Accept-Encoding": "gzip"})
+    assert gz.status_code == 200 and gz.content == xml  # httpx 自动解压
+    assert gz.headers["content-encoding"] == "gzip"
+    assert "immutable" in gz.headers["cache-control"] and "Accept-Encoding" in gz.headers["vary"]
+
+    plain = client.get("/download/dl.musicxml", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers and plain.content == xml
+    assert plain.headers["etag"] != gz.headers["etag"]
+    midi = client.get("/download/dl.mid", headers={"Accept-Encoding": "gzip, br"})
+    assert "content-encoding" not in midi.headers and midi.content == midi_path.read_bytes()
+
+    cached = client.get("/download/dl.musicxml", headers={"Accept-Encoding": "gzip",
+                                                         "If-None-Match": gz.headers["etag"]})
+    assert cached.status_code == 304 and cached.content == b""
+
+    partial = client.get("/download/dl.musicxml", headers={"Accept-Encoding": "identity", "Range": "bytes=0-9"})
+    assert partial.status_code == 206 and partial.content == xml[:10]
+    compressed = (tmp_path / "result.musicxml.gz").read_bytes()
+    # Range 作用于压缩后的副本
+    with client.stream("GET", "/download/dl.musicxml",
+                       headers={"Accept-Encoding": "gzip", "Range": "bytes=10-"}) as partial:
+        assert partial.status_code == 206 and partial.headers["content-encoding"] == "gzip"
+        tail = b"".join(partial.iter_raw())
+    assert gzip.decompress(compressed[:10] + tail) == xml
+
+    # 已完成任务的路径已在 LRU 中：删除数据库记录后仍可下载
+    hits = artifact_index.hits
+    db = SessionLocal()
+    try:
+        db.query(Task).filter(Task.id == "dl").delete()
+        db.commit()
+    finally:
+        db.close()
+    assert client.get("/download/dl.musicxml").content == xml
+    assert artifact_index.hits == hits + 1
+
+    # 未完成的任务不缓存路径，也不声明 immutable
+    running = client.get("/download/dl-running.musicxml")
+    assert running.status_code == 200 and running.headers["cache-control"] == "no-cache"
+    assert artifact_index.get("dl-running") is None
+
+
+def test_batch_submission_and_batch_affinity(client):
+    # 22. 批量提交：压缩包 + 多文件在一个批次内创建，跳过非音频；批次汇总进度；worker 优先领取同批次任务
+    import io
+    import zipfile
+    from datetime import datetime, timedelta
+    from backend.db import claim_compatible_tasks
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("album/01.wav", b"RIFF" + b"\0" * 64)
+        zf.writestr("album/disc2/02.flac", b"fLaC" + b"\1" * 64)
+        zf.writestr("album/cover.jpg", b"\xff\xd8\xff" + b"\0" * 64)
+        zf.writestr("__MACOSX/album/._01.wav", b"\0" * 16)
+    response = client.post(
+        "/api/batches",
+        files=[
+            ("archive", ("album.zip", archive.getvalue(), "application/zip")),
+            ("files", ("bonus.mp3", b"ID3" + b"\2" * 64, "audio/mpeg")),
+            ("files", ("notes.pdf", b"%PDF-1.4", "application/pdf")),
+        ],
+    )
+    assert response.status_code == 200, response.text
+    data = response.json()
+    batch_id = data["batch_id"]
+    assert [t["filename"] for t in data["tasks"]] == ["album/01.wav", "album/disc2/02.flac", "bonus.mp3"]
+    assert sorted(s["filename"] for s in data["skipped"]) == ["album/cover.jpg", "notes.pdf"]
+    task_ids = [t["task_id"] for t in data["tasks"]]
+
+    db = SessionLocal()
+    try:
+        tasks = db.query(Task).filter(Task.batch_id == batch_id).all()
+        assert sorted(t.id for t in tasks) == sorted(task_ids)
+        assert all(Path(t.input_path).exists() and Path(t.input_path).stem == t.id for t in tasks)
+    finally:
+        db.close()
+
+    assert client.post("/api/batches", files={"archive": ("x.zip", b"not an archive", "application/zip")}).status_code == 400
+    assert client.get("/api/batches/nope").status_code == 404
+    status = client.get(f"/api/batches/{batch_id}").json()
+    assert status["status"] == "queued" and status["total"] == 3 and status["progress"] == 0
+
+    # 更早提交的无关任务排在前面，但刚处理过该批次任务的 worker 优先领取同批次任务
+    db = SessionLocal()
+    try:
+        db.add(Task(id="older", status="queued", input_path="x", created_at=datetime.utcnow() - timedelta(seconds=10)))
+        db.query(Task).filter(Task.id == task_ids[0]).update({
+            Task.status: "done", Task.progress: 1.0, Task.worker_id: "w1", Task.updated_at: datetime.utcnow(),
+        })
+        db.commit()
+        assert [t.id for t in claim_compatible_tasks(db, 1, worker_id="w1")] == [task_ids[1]]
+        assert [t.id for t in claim_compatible_tasks(db, 1, worker_id="w2")] == ["older"]
+        db.query(Task).filter(Task.id == task_ids[1]).update({Task.status: "failed"})
+        db.commit()
+    finally:
+        db.close()
+
+    status = client.get(f"/api/batches/{batch_id}")
+    body = status.json()
+    assert body["status"] == "processing" and body["counts"] == {"queued": 1, "processing": 0, "done": 1, "failed": 1}
+    assert abs(body["progress"] - 2 / 3) < 1e-3
+    assert client.get(f"/api/batches/{batch_id}", headers={"If-None-Match": status.headers["etag"]}).status_code == 304
+
+
+def test_object_storage_direct_worker_transfers(client, monkeypatch, tmp_path):
+    # 23. 对象存储后端：输入写入存储，领取时下发签名下载 URL，结果经签名上传 URL 直传后 stored=true 提交
+    import threading
+    from datetime import datetime, timedelta, timezone
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, unquote, urlsplit
+
+    import requests
+    from backend import main, remote_worker
+    from backend.storage import LocalStorage, S3Storage
+
+    objects = {}
+    prefix = "/bucket/mt/"
+
+    class FakeS3(BaseHTTPRequestHandler):
+        """MinIO 替身：按 SigV4 查询串重新计算签名并检查过期时间"""
+
+        def log_message(self, *args):
+            pass
+
+        def _authorize(self):
+            parts = urlsplit(self.path)
+            query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+            key = unquote(parts.path)[len(prefix):]
+            try:
+                signed_at = datetime.strptime(query["X-Amz-Date"], "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+                expires = int(query["X-Amz-Expires"])
+                expected = s3.presign(self.command, key, expires, now=signed_at)
+            except (KeyError, ValueError):
+                expected = None
+            valid = (
+                expected is not None and unquote(parts.path).startswith(prefix)
+                and parse_qs(urlsplit(expected).query)["X-Amz-Signature"][0] == query.get("X-Amz-Signature")
+                and datetime.now(timezone.utc) <= signed_at + timedelta(seconds=expires)
+            )
+            if not valid:
+                self.send_response(403)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+            return key if valid else None
+
+        def do_PUT(self):
+            key = self._authorize()
+            if key is None:
+                return
+            objects[key] = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def do_GET(self, head=False):
+            key = self._authorize()
+            if key is None:
+                return
+            body = objects.get(key)
+            self.send_response(200 if body is not None else 404)
+            self.send_header("Content-Length", str(len(body or b"")))
+            self.end_headers()
+            if body and not head:
+                self.wfile.write(body)
+
+        def do_HEAD(self):
+            self.do_GET(head=True)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeS3)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        s3 = S3Storage(f"http://127.0.0.1:{server.server_port}", "bucket", "minio", "minio-secret", prefix="mt",
+                       expires=60)
+        monkeypatch.setattr(main, "storage", s3)
+        monkeypatch.setattr(main, "WORKER_TOKEN", "secret")
+        headers = {"x-worker-token": "secret", "x-worker-id": "remote-1"}
+
+        # 内容唯一，避免命中之前运行留下的结果缓存
+        audio = b"RIFF" + os.urandom(128)
+        task_id = client.post("/api/tasks", files={"file": ("a.wav", audio, "audio/wav")}).json()["task_id"]
+        input_key = next(k for k in objects if k.startswith("uploads/"))
+        assert objects[input_key] == audio and s3.exists(input_key)
+
+        task = client.post("/api/worker/tasks/claim", headers=headers).json()["task"]
+        assert task["task_id"] == task_id and task["direct_upload"] is True
+        assert requests.get(task["input_download_url"]).content == audio
+        # 篡改对象键或签名过期都会被存储拒绝
+        assert requests.get(task["input_download_url"].replace("uploads/", "results/")).status_code == 403
+        assert requests.get(s3.presign("GET", input_key, now=datetime.now(timezone.utc) - timedelta(hours=1))).status_code == 403
+
+        # 远程 worker 直接从存储下载输入，结果直传存储后以 stored=true 提交
+        client.headers.update(headers)
+        monkeypatch.setattr(remote_worker, "http", client)
+        downloaded = tmp_path / "input.wav"
+        remote_worker._download_input(task, downloaded)
+        assert downloaded.read_bytes() == audio
+
+        midi, xml = tmp_path / "result.mid", tmp_path / "result.musicxml"
+        midi.write_bytes(b"MThd-direct")
+        xml.write_bytes(b"<score-partwise>" + b"<note/>" * 200 + b"</score-partwise>")
+        remote_worker._upload_result(task_id, midi, xml, 1.5, 3, direct=True)
+        assert objects[f"results/{task_id}/.remote-1-1/result.mid"] == b"MThd-direct"
+
+        status = client.get(f"/api/tasks/{task_id}").json()
+        assert status["status"] == "done"
+        assert client.get(f"/download/{task_id}.mid").content == b"MThd-direct"
+
+        # 未上传就声明 stored 的提交被拒绝；本地存储不提供上传 URL
+        other = client.post("/api/tasks", files={"file": ("b.wav", b"RIFF" + os.urandom(64), "audio/wav")}).json()
+        client.post("/api/worker/tasks/claim")
+        assert client.post(f"/api/worker/tasks/{other['task_id']}/complete", data={"stored": "true"}).status_code == 400
+
+        # 上传 URL 按领取区分：租约转给 remote-2 后，remote-1 仍可用未过期的 URL 上传，
+        # 但只写到自己那次领取的键，remote-2 的 stored 提交取回的是自己的结果
+        stale_urls = client.post(f"/api/worker/tasks/{other['task_id']}/upload-urls").json()
+        db = SessionLocal()
+        try:
+            db.query(Task).filter(Task.id == other["task_id"]).update({Task.worker_id: "remote-2", Task.attempts: 2})
+            db.commit()
+        finally:
+            db.close()
+        fresh_headers = dict(headers, **{"x-worker-id": "remote-2"})
+        fresh_urls = client.post(f"/api/worker/tasks/{other['task_id']}/upload-urls", headers=fresh_headers).json()
+        assert fresh_urls["midi"] != stale_urls["midi"]
+        for name, body in (("midi", b"MThd-fresh"), ("musicxml", b"<score-partwise/>")):
+            assert requests.put(fresh_urls[name], data=body).status_code == 200
+            assert requests.put(stale_urls[name], data=b"stale").status_code == 200
+        done = client.post(f"/api/worker/tasks/{other['task_id']}/complete", headers=fresh_headers,
+                           data={"stored": "true"})
+        assert done.status_code == 200, done.text
+        assert client.get(f"/download/{other['task_id']}.mid").content == b"MThd-fresh"
+
+        third = client.post("/api/tasks", files={"file": ("c.wav", b"RIFF" + os.urandom(64), "audio/wav")}).json()
+        client.post("/api/worker/tasks/claim")
+        monkeypatch.setattr(main, "storage", LocalStorage())
+        assert client.post(f"/api/worker/tasks/{third['task_id']}/upload-urls").status_code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_unchanged_progress_heartbeat_keeps_etag(client, monkeypatch):
+    # 24. 远程 worker 重发相同进度的心跳只续约：updated_at 与 ETag 不变，也不推送 task 事件
+    from backend import main
+    from backend.progress_writer import get_progress_writer
+
+    monkeypatch.setattr(main, "WORKER_TOKEN", "secret")
+    headers = {"x-worker-token": "secret", "x-worker-id": "remote-1"}
+    task_id = client.post("/api/tasks", files={"file": ("a.wav", b"RIFF" + os.urandom(64), "audio/wav")}).json()["task_id"]
+    assert client.post("/api/worker/tasks/claim", headers=headers).json()["task"]["task_id"] == task_id
+
+    writer = get_progress_writer()
+    published = []
+    monkeypatch.setattr(writer, "on_write", lambda ids: published.append(set(ids)))
+
+    def heartbeat(progress):
+        resp = client.post("/api/worker/tasks/progress", headers=headers,
+                           json={"updates": [{"task_id": task_id, "progress": progress}]})
+        assert resp.json()["results"][task_id] == "ok"
+        writer.flush()
+
+    heartbeat(0.5)
+    assert published == [{task_id}]
+    etag = client.get(f"/api/tasks/{task_id}").headers["etag"]
+    bulk_etag = client.get("/api/tasks", params={"ids": task_id}).headers["etag"]
+    db = SessionLocal()
+    try:
+        lease = db.query(Task).filter(Task.id == task_id).first().lease_expires_at
+    finally:
+        db.close()
+
+    heartbeat(0.5)
+    assert published == [{task_id}]
+    assert client.get(f"/api/tasks/{task_id}", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/api/tasks", params={"ids": task_id}, headers={"If-None-Match": bulk_etag}).status_code == 304
+    db = SessionLocal()
+    try:
+        assert db.query(Task).filter(Task.id == task_id).first().lease_expires_at > lease  # 仍然续约
+    finally:
+        db.close()
+
+    heartbeat(0.6)
+    assert published == [{task_id}, {task_id}]
+    assert client.get(f"/api/tasks/{task_id}", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_stale_completion_never_touches_new_holders_results(client, monkeypatch):
+    # 25. 提交结果期间租约被转给其他 worker：过期提交返回 409，暂存文件被删除，正式结果不被覆盖
+    from backend import main
+
+    monkeypatch.setattr(main, "WORKER_TOKEN", "secret")
+    task_id = client.post("/api/tasks", files={"file": ("a.wav", b"RIFF" + os.urandom(64), "audio/wav")}).json()["task_id"]
+
+    def headers(worker_id):
+        return {"x-worker-token": "secret", "x-worker-id": worker_id}
+
+    def complete(worker_id, midi):
+        return client.post(
+            f"/api/worker/tasks/{task_id}/complete",
+            headers=headers(worker_id),
+            files={
+                "midi_file": ("result.mid", midi, "audio/midi"),
+                "musicxml_file": ("result.musicxml", b"<score-partwise>" + b"<note/>" * 100 + b"</score-partwise>",
+                                  "application/xml"),
+            },
+        )
+
+    assert client.post("/api/worker/tasks/claim", headers=headers("worker-a")).json()["task"]["task_id"] == task_id
+    output_dir = RESULT_DIR / task_id
+    precompress = main.precompress_results
+
+    def reassign_during_upload(*paths):
+        # 模拟上传期间租约被回收并由 worker-b 领取
+        precompress(*paths)
+        db = SessionLocal()
+        try:
+            db.query(Task).filter(Task.id == task_id).update({Task.worker_id: "worker-b", Task.attempts: 2})
+            db.commit()
+        finally:
+            db.close()
+
+    monkeypatch.setattr(main, "precompress_results", reassign_during_upload)
+    assert complete("worker-a", b"MThd-stale").status_code == 409
+    assert not (output_dir / "result.mid").exists() and not (output_dir / "result.musicxml.gz").exists()
+    assert [p for p in output_dir.iterdir() if p.name.startswith(".")] == []
+
+    monkeypatch.setattr(main, "precompress_results", precompress)
+    assert complete("worker-b", b"MThd-fresh").status_code == 200
+    assert (output_dir / "result.mid").read_bytes() == b"MThd-fresh"
+    assert (output_dir / "result.musicxml.gz").exists()
+    assert client.get(f"/download/{task_id}.mid").content == b"MThd-fresh"
+    assert [p for p in output_dir.iterdir() if p.name.startswith(".")] == []
+
+
+def test_memmap_audio_released_when_inference_aborts(monkeypatch, tmp_path):
+    # 26. 推理中止（租约丢失）或出错时，内存映射音频文件同样被删除（单任务、批量与远程预取路径）
+    from backend import remote_worker
+    from backend.mtmt3_core import transcriber
+    from backend.mtmt3_core.audio_io import MMAP_FILENAME
+    from backend.mtmt3_core.progress import TaskAborted
+
+    def decoded_in(out_dir):
+        out_dir.mkdir(parents=True, exist_ok=True)
+        audio = np.lib.format.open_memmap(str(out_dir / MMAP_FILENAME), mode="w+", dtype=np.float32, shape=(16000,))
+        audio[:] = 0.1
+        return audio, 16000, 0.1
+
+    def lost_lease(model, precision):
+        raise TaskAborted("lease lost")
+
+    monkeypatch.setattr(transcriber, "MT3_AVAILABLE", True)
+    monkeypatch.setattr(transcriber, "_load_model", lost_lease)
+
+    single = tmp_path / "single"
+    with pytest.raises(TaskAborted):
+        transcriber.run_mtmt3("in.wav", "m", "with_accompaniment", "none", str(single),
+                              decoded_audio=decoded_in(single))
+    assert not (single / MMAP_FILENAME).exists()
+
+    batch = [tmp_path / "b0", tmp_path / "b1"]
+    results = transcriber.run_mtmt3_batch(
+        [{"audio_path": "in.wav", "output_dir": str(d), "decoded_audio": decoded_in(d)} for d in batch],
+        "m", "with_accompaniment", "none",
+    )
+    assert all(isinstance(r, TaskAborted) for r in results)
+    assert not any((d / MMAP_FILENAME).exists() for d in batch)
+
+    # 远程 worker 预取并解码后、推理前被中止
+    prepared = remote_worker.PreparedTask({"task_id": "prefetched", "input_filename": "a.wav"})
+    prepared.decoded = decoded_in(prepared.output_dir)
+    prepared.cleanup()
+    assert not prepared.temp_dir.exists()
+
+
+def test_supervisor_runs_migration_and_reaper_once(monkeypatch):
+    # 27. supervisor 启动的多进程 API 不在各进程内迁移与回收租约，回收线程只在 supervisor 中运行一份
+    import threading
+    from datetime import datetime, timedelta
+    from backend import supervisor
+    from backend.db import run_lease_reaper
+
+    processes, _ = supervisor.build_processes(1, 1, 0, 4, "127.0.0.1", 8000)
+    api = next(p for p in processes if p.name == "api")
+    assert api.env == {"API_INIT_DB": "0", "API_LEASE_REAPER": "0"}
+    assert all("API_LEASE_REAPER" not in p.env for p in processes if p.name != "api")
+
+    db = SessionLocal()
+    try:
+        db.add(Task(id="stale", status="processing", input_path="x", worker_id="gone", attempts=1,
+                    lease_expires_at=datetime.utcnow() - timedelta(seconds=1)))
+        db.commit()
+    finally:
+        db.close()
+
+    stop = threading.Event()
+    woken = threading.Event()
+
+    def on_requeued():
+        woken.set()
+        stop.set()
+
+    reaper = threading.Thread(target=run_lease_reaper, kwargs={"interval": 0.01, "on_requeued": on_requeued,
+                                                                 "stop": stop})
+    reaper.start()
+    assert woken.wait(5)
+    reaper.join(5)
+    assert not reaper.is_alive()
+    db = SessionLocal()
+    try:
+        assert db.query(Task).filter(Task.id == "stale").first().status == "queued"
+    finally:
+        db.close()
@@ -0,0 +1,272 @@
+import numpy as np
+import pytest
+
+from backend.mtmt3_core.model_registry import ModelRegistry, resolve_model_name
+from backend.mtmt3_core.midi_utils import NOTE_DTYPE, midi_to_notes, notes_to_midi
+from backend.mtmt3_core import segmentation
+from backend.mtmt3_core.segmentation import plan_segments, transcribe_segments, stitch_segments, transcribe_many
+from backend.mtmt3_core.audio_io import load_audio
+from backend.mtmt3_core.postprocess import midi_stats, midi_to_bytes, write_musicxml
+from backend.mtmt3_core.progress import ProgressReporter
+from backend.mtmt3_core.precision import note_agreement
+from backend.mtmt3_core.cpu_affinity import plan_worker_cores
+from backend.mtmt3_core.silence import find_active_regions, compact_audio, restore_note_times
+
+
+class _FakeModel:
+    def __init__(self, name):
+        self.name = name
+
+
+def test_model_registry_loads_once_and_evicts_lru(monkeypatch):
+    # 1. 同一模型只加载一次；超出内存预算时淘汰最久未使用的模型
+    from backend.mtmt3_core import model_registry
+
+    monkeypatch.setattr(model_registry, "estimate_model_bytes", lambda model: 600 * 1024 * 1024)
+    loads = []
+
+    def loader(model_name, device):
+        loads.append(model_name)
+        return _FakeModel(model_name)
+
+    registry = ModelRegistry(memory_budget_mb=1024, loader=loader)
+
+    first, first_load = registry.get("mr_mt3", "cpu")
+    again, again_load = registry.get("mr_mt3", "cpu")
+    assert first is again
+    assert again_load == 0.0
+    assert loads == ["mr_mt3"]
+
+    registry.get("mt3_pytorch", "cpu")
+    assert registry.loaded() == ["mt3_pytorch"]
+    assert loads == ["mr_mt3", "mt3_pytorch"]
+
+
+def test_resolve_model_name_maps_form_values():
+    assert resolve_model_name("mtmt3_piano_vocal") == "mr_mt3"
+    assert resolve_model_name("mtmt3_multi") == "mr_mt3"
+    assert resolve_model_name("yourmt3") == "yourmt3"
+    assert resolve_model_name("unknown") == "mr_mt3"
+
+
+class _FakeSegmentModel:
+    """音频样本值即绝对时间（秒）；在每个整秒处产生一个音符，模拟重叠区内两段都识别出同一音符"""
+
+    def transcribe(self, audio, sr=16000):
+        offset = float(audio[0])
+        seconds = np.arange(np.ceil(offset), offset + len(audio) / sr - 0.25)
+        notes = np.zeros(len(seconds), dtype=NOTE_DTYPE)
+        notes["start"] = seconds - offset
+        notes["end"] = notes["start"] + 0.2
+        notes["pitch"] = 60
+        notes["velocity"] = 100
+        return notes_to_midi(notes)
+
+
+def test_segmented_transcription_stitches_with_absolute_times():
+    # 2. 分段推理的音符按绝对时间拼接，重叠区不重复
+    sr = 1000
+    audio = (np.arange(25 * sr) / sr).astype(np.float32)
+    segments = plan_segments(len(audio), sr, window_seconds=10, overlap_seconds=2)
+    assert [(s.start, s.end) for s in segments] == [(0, 10000), (8000, 18000), (16000, 25000)]
+
+    per_segment = transcribe_segments(_FakeSegmentModel(), audio, sr, segments, batch_size=2, parallel=2)
+    notes = stitch_segments(per_segment)
+
+    assert np.allclose(notes["start"], np.arange(25), atol=1e-2)
+
+    roundtrip = midi_to_notes(notes_to_midi(notes))
+    assert len(roundtrip) == len(notes)
+    assert np.allclose(roundtrip["start"], notes["start"], atol=1e-2)
+
+
+def test_streaming_load_audio_matches_librosa(tmp_path):
+    # 3. 流式解码+重采样的结果与 librosa.load 一致，并同时给出峰值
+    import librosa
+    import soundfile as sf
+
+    sr_in = 44100
+    t = np.arange(int(sr_in * 3.3)) / sr_in
+    stereo = np.stack([0.8 * np.sin(2 * np.pi * 440 * t), 0.4 * np.sin(2 * np.pi * 660 * t)], axis=1)
+    path = tmp_path / "input.wav"
+    sf.write(path, stereo, sr_in)
+
+    audio, sr, peak = load_audio(str(path), sr=16000, block_frames=4096)
+    expected, _ = librosa.load(str(path), sr=16000, mono=True)
+
+    assert sr == 16000
+    assert audio.dtype == np.float32
+    assert abs(len(audio) - len(expected)) <= 2
+    n = min(len(audio), len(expected))
+    assert np.max(np.abs(audio[:n] - expected[:n])) < 1e-3
+    assert peak == pytest.approx(float(np.max(np.abs(audio))))
+
+
+def test_midi_stats_and_single_parse_musicxml(tmp_path):
+    # 4. 音符统计直接来自 MIDI 事件；MusicXML 由一次 music21 解析生成
+    notes = np.zeros(5, dtype=NOTE_DTYPE)
+    notes["start"] = [0.0, 0.0, 0.5, 1.0, 1.5]
+    notes["end"] = [0.5, 0.5, 1.0, 1.5, 2.5]
+    notes["pitch"] = [60, 64, 67, 36, 38]
+    notes["velocity"] = 100
+    notes["channel"] = [0, 0, 0, 9, 9]
+    midi = notes_to_midi(notes)
+
+    stats = midi_stats(midi)
+    assert stats["note_count"] == 5
+    assert stats["midi_duration"] == pytest.approx(2.5, abs=1e-2)
+    drums = [i for i in stats["instruments"] if i["is_drum"]]
+    assert drums[0]["note_count"] == 2
+
+    xml_path = tmp_path / "result.musicxml"
+    assert write_musicxml(midi_to_bytes(midi), str(xml_path)) is True
+    assert "<score-partwise" in xml_path.read_text(encoding="utf-8")
+
+
+def test_progress_reporter_rate_limits_by_delta_and_time():
+    # 5. 进度按实际工作量推进，并按变化幅度与时间间隔限流
+    now = [0.0]
+    calls = []
+    reporter = ProgressReporter(lambda stage, p: calls.append(round(p, 3)),
+                                min_delta=0.05, min_interval=1.0, clock=lambda: now[0])
+
+    on_done = reporter.stage_range("transcribing", 0.2, 0.8)
+    for done in range(1, 11):
+        now[0] += 0.5
+        on_done(done, 10)
+
+    # 每秒最多一次、每次至少变化 5%，最后一段强制上报
+    assert calls == [0.26, 0.38, 0.5, 0.62, 0.74, 0.8]
+    # 同一阶段内的小幅变化被合并，进入新阶段时总是上报
+    assert reporter.report("transcribing", 0.81) is False
+    assert reporter.report("saving_midi", 0.81) is True
+
+
+def test_progress_reporter_emits_every_stage_of_a_short_task():
+    # 6. 短任务在 2 秒内走完全部阶段：每个阶段都上报，只有阶段内的分段进度被限流
+    now = [0.0]
+    calls = []
+    reporter = ProgressReporter(lambda stage, p: calls.append((stage, round(p, 3))), clock=lambda: now[0])
+
+    # 与 transcriber.run_mtmt3 / _save_outputs 的调用顺序一致
+    reporter.report("loading_audio", 0.10)
+    now[0] += 0.1
+    reporter.report("normalizing", 0.15)
+    reporter.report("transcribing", 0.20)
+    on_done = reporter.stage_range("transcribing", 0.20, 0.80)
+    for done in range(1, 5):
+        now[0] += 0.2
+        on_done(done, 4)
+    reporter.report("transcribing_done", 0.80, force=True)
+    now[0] += 0.1
+    reporter.report("saving_midi", 0.85)
+    reporter.report("converting_musicxml", 0.90)
+
+    assert calls == [
+        ("loading_audio", 0.1), ("normalizing", 0.15), ("transcribing", 0.2), ("transcribing", 0.8),
+        ("saving_midi", 0.85), ("converting_musicxml", 0.9),
+    ]
+
+
+def test_note_agreement_matches_pitch_and_onset():
+    reference = np.zeros(3, dtype=NOTE_DTYPE)
+    reference["start"] = [0.0, 1.0, 2.0]
+    reference["pitch"] = [60, 62, 64]
+    estimate = reference.copy()
+    estimate["start"][1] += 0.03   # 容差内
+    estimate["start"][2] += 0.2    # 超出容差
+
+    agreement = note_agreement(reference, estimate)
+    assert agreement["matched"] == 2
+    assert agreement["f1"] == pytest.approx(2 / 3)
+
+
+def test_invalid_default_precision_exits_at_startup(monkeypatch):
+    from backend.mtmt3_core import precision
+
+    precision.check_default_precision()
+    monkeypatch.setattr(precision, "DEFAULT_PRECISION", "fp16")
+    with pytest.raises(SystemExit, match="MTMT3_PRECISION"):
+        precision.check_default_precision()
+
+
+def test_plan_worker_cores_partitions_disjoint_sets():
+    # 默认：每个 worker 4 个核心，互不重叠
+    plan = plan_worker_cores(range(32))
+    assert len(plan) == 8
+    assert all(len(cores) == 4 for cores in plan)
+    assert sorted(c for cores in plan for c in cores) == list(range(32))
+
+    # 指定进程数时平均分配；预留核心不参与分配
+    plan = plan_worker_cores(range(64), workers=4, reserved=4)
+    assert [len(cores) for cores in plan] == [15, 15, 15, 15]
+    assert max(c for cores in plan for c in cores) < 60
+
+    # 核心不足时线程数不超过核心数
+    assert plan_worker_cores(range(2), threads=8) == [[0, 1]]
+
+
+def test_silence_skipping_restores_absolute_note_times():
+    sr = 16000
+    t = np.arange(5 * sr) / sr
+    tone = (0.5 * np.sin(2 * np.pi * 440 * t)).astype(np.float32)
+    silence = np.zeros(10 * sr, dtype=np.float32)
+    # 10s 静音 + 5s 有声 + 10s 静音 + 5s 有声 + 1s 静音（短于最小静音长度，不跳过）
+    audio = np.concatenate([silence, tone, silence, tone, silence[:sr]])
+
+    plan = find_active_regions(audio, sr, min_silence_seconds=2.0, pad_seconds=0.25)
+    assert plan.regions == [(int(9.75 * sr), int(15.25 * sr)), (int(24.75 * sr), len(audio))]
+    assert plan.skipped_seconds == pytest.approx(19.25)
+    compact = compact_audio(audio, plan)
+    assert len(compact) == plan.active_samples
+
+    # 模型在拼接音频上输出的音符：各区域内 0.5 秒处各一个
+    second_region_offset = (15.25 - 9.75) + 0.5
+    notes = np.zeros(2, dtype=NOTE_DTYPE)
+    notes["start"] = [0.5, second_region_offset]
+    notes["end"] = notes["start"] + 1.0
+    notes["pitch"] = [60, 62]
+    notes["velocity"] = 100
+
+    restored = midi_to_notes(restore_note_times(notes_to_midi(notes), plan))
+    np.testing.assert_allclose(restored["start"], [10.25, 25.25], atol=0.01)
+    np.testing.assert_allclose(restored["end"] - restored["start"], [1.0, 1.0], atol=0.01)
+
+
+def test_transcribe_many_packs_segments_across_tasks(monkeypatch):
+    # 短音频批量推理：不同任务的分段共用批次，结果与进度按任务拆分
+    sr = 1000
+    monkeypatch.setattr(segmentation, "SEGMENT_SECONDS", 10)
+    monkeypatch.setattr(segmentation, "SEGMENT_OVERLAP_SECONDS", 2)
+    audios = [
+        (np.arange(3 * sr) / sr).astype(np.float32),
+        (100 + np.arange(25 * sr) / sr).astype(np.float32),  # 长音频：3 段
+        (200 + np.arange(4 * sr) / sr).astype(np.float32),
+    ]
+    batches = []
+    transcribe_batch = segmentation._transcribe_batch
+
+    def recording_batch(model, chunks, sr):
+        batches.append([float(c[0]) // 100 for c in chunks])
+        return transcribe_batch(model, chunks, sr)
+
+    monkeypatch.setattr(segmentation, "_transcribe_batch", recording_batch)
+    progress = []
+    midis = transcribe_many(_FakeSegmentModel(), audios, sr, "cpu", batch_size=2,
+                            on_task_progress=lambda t, done, total: progress.append((t, done, total)))
+
+    # 5 个分段打包成 3 批，其中两批混合了不同任务
+    assert batches == [[0, 1], [1, 1], [2]]
+    starts = [midi_to_notes(m)["start"] for m in midis]
+    assert np.allclose(starts[0], [0, 1, 2], atol=1e-2)
+    assert np.allclose(starts[1], np.arange(25), atol=1e-2)
+    assert np.allclose(starts[2], [0, 1, 2, 3], atol=1e-2)
+    assert progress == [(0, 1, 1), (1, 1, 3), (1, 3, 3), (2, 1, 1)]
+
+    # CPU 上按 CPU_PARALLEL_BATCHES 并行执行批次，结果与逐批执行一致，每个任务的进度最终到达总段数
+    progress = []
+    parallel_midis = transcribe_many(_FakeSegmentModel(), audios, sr, "cpu", batch_size=2, parallel=3,
+                                     on_task_progress=lambda t, done, total: progress.append((t, done, total)))
+    for serial, parallel in zip(midis, parallel_midis):
+        assert np.allclose(midi_to_notes(serial)["start"], midi_to_notes(parallel)["start"], atol=1e-2)
+    assert {(t, total) for t, done, total in progress if done == total} == {(0, 1), (1, 3), (2, 1)}
@@ -0,0 +1,276 @@
+"""
+上传处理：
+- UploadLimitMiddleware 在解析请求体之前按 Content-Length 拒绝超限的上传，
+  分块传输（无 Content-Length）时边接收边计数，超限立即中止，不必先把整个请求体收完
+- save_upload 在线程池中把上传文件分块复制到目标路径，同时计算 sha256 并检查大小，不阻塞事件循环
+- sniff_audio 根据文件头识别音频格式，拒绝可以确定不是音频的文件（图片、压缩包、文档等）
+- extract_audio_files 从 zip / tar 压缩包中逐个流式解出音频文件（批量提交）
+"""
+import hashlib
+import os
+import tarfile
+import zipfile
+from pathlib import Path, PurePosixPath
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+COPY_CHUNK_SIZE = 1024 * 1024
+SNIFF_BYTES = 16
+
+# 常见音频容器的文件头：(偏移, 魔数, 格式)
+AUDIO_SIGNATURES = [
+    (0, b"RIFF", "wav"),
+    (0, b"FORM", "aiff"),
+    (0, b"fLaC", "flac"),
+    (0, b"OggS", "ogg"),
+    (0, b"ID3", "mp3"),
+    (0, b"\x1a\x45\xdf\xa3", "webm"),
+    (4, b"ftyp", "m4a"),
+]
+# 可以确定不是音频的文件头
+NON_AUDIO_SIGNATURES = [
+    b"%PDF", b"PK\x03\x04", b"\x89PNG", b"\xff\xd8\xff", b"GIF8", b"MZ", b"\x7fELF",
+    b"<!DOCTYPE", b"<html", b"<?xml", b"MThd",
+]
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class ArchiveLimitExceeded(Exception):
+    pass
+
+
+def sniff_audio(head: bytes):
+    """
+    返回识别出的音频格式；无法识别时返回 None（交给解码器判断），
+    可以确定不是音频时抛出 ValueError。
+    """
+    for offset, magic, fmt in AUDIO_SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            return fmt
+    # MPEG 音频帧同步字（无 ID3 标签的 mp3 / aac）
+    if len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0:
+        return "mp3"
+    lowered = head.lstrip()[:9].lower()
+    for magic in NON_AUDIO_SIGNATURES:
+        if head.startswith(magic) or lowered.startswith(magic.lower()):
+            raise ValueError("Uploaded file is not an audio file")
+    return None
+
+
+def _copy(src, target: Path, max_bytes: int, hash_content: bool):
+    """在工作线程中执行：分块复制、计算哈希并检查大小；先写临时文件，完成后原子替换"""
+    hasher = hashlib.sha256() if hash_content else None
+    tmp = target.with_name(target.name + ".part")
+    size = 0
+    src.seek(0)
+    try:
+        with open(tmp, "wb") as f:
+            while True:
+                chunk = src.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise UploadTooLarge()
+                if hasher:
+                    hasher.update(chunk)
+                f.write(chunk)
+        os.replace(tmp, target)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return size, hasher.hexdigest() if hasher else None
+
+
+def _read_head(src) -> bytes:
+    src.seek(0)
+    head = src.read(SNIFF_BYTES)
+    src.seek(0)
+    return head
+
+
+def _archive_members(archive_path: Path):
+    """逐个返回压缩包内的普通文件 (名称, 声明大小, 打开函数)；不是 zip / tar 时抛出 ValueError"""
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as zf:
+            for info in zf.infolist():
+                if not info.is_dir():
+                    yield info.filename, info.file_size, lambda info=info: zf.open(info)
+    elif tarfile.is_tarfile(archive_path):
+        with tarfile.open(archive_path, "r:*") as tf:
+            for member in tf:
+                if member.isfile():
+                    yield member.name, member.size, lambda member=member: tf.extractfile(member)
+    else:
+        raise ValueError("Archive must be a zip or tar file")
+
+
+def _is_hidden(name: str) -> bool:
+    # macOS 打包时附带的资源分支（__MACOSX/、._xxx）与隐藏文件
+    return any(part.startswith((".", "__MACOSX")) for part in PurePosixPath(name).parts)
+
+
+def extract_audio_files(archive_path: Path, new_path, max_bytes: int = 0, max_files: int = 0,
+                        max_total_bytes: int = 0):
+    """
+    在工作线程中执行：逐个解出压缩包内的音频文件，分块写盘并计算 sha256，不整体解压。
+    new_path(ext) 返回文件的保存路径（文件名由调用方决定，压缩包内的路径不会用于拼接）。
+    返回 (saved, skipped)：saved 为 [(压缩包内名称, 保存路径, 大小, sha256)]，
+    skipped 为 [(名称, 原因)]，跳过非音频、超过 max_bytes 的文件。
+    音频文件数超过 max_files 或解出总量超过 max_total_bytes 时抛出 ArchiveLimitExceeded，
+    不是 zip / tar 或压缩包损坏时抛出 ValueError；出错时已解出的文件会被删除。
+    """
+    saved, skipped = [], []
+    total = 0
+    try:
+        for name, declared_size, open_member in _archive_members(Path(archive_path)):
+            if _is_hidden(name):
+                continue
+            if max_bytes and declared_size > max_bytes:
+                skipped.append((name, "too large"))
+                continue
+            with open_member() as src:
+                head = src.read(SNIFF_BYTES)
+                try:
+                    fmt = sniff_audio(head)
+                except ValueError:
+                    skipped.append((name, "not audio"))
+                    continue
+                if max_files and len(saved) >= max_files:
+                    raise ArchiveLimitExceeded(f"Archive contains more than {max_files} audio files")
+                ext = PurePosixPath(name).suffix.lstrip(".").lower()
+                if not ext.isalnum():
+                    ext = fmt or "audio"
+                target = Path(new_path(ext))
+                try:
+                    # 压缩包成员不一定支持回退，已读出的文件头与剩余内容拼接后写盘
+                    size, digest = _copy(_Prefixed(head, src), target, max_bytes, True)
+                except UploadTooLarge:
+                    skipped.append((name, "too large"))
+                    continue
+            total += size
+            saved.append((name, target, size, digest))
+            if max_total_bytes and total > max_total_bytes:
+                raise ArchiveLimitExceeded(f"Archive expands beyond {max_total_bytes // (1024 * 1024)} MB")
+    except BaseException as e:
+        for _, target, _, _ in saved:
+            target.unlink(missing_ok=True)
+        if isinstance(e, (zipfile.BadZipFile, tarfile.TarError, EOFError)):
+            raise ValueError(f"Invalid archive: {e}") from e
+        raise
+    return saved, skipped
+
+
+class _Prefixed:
+    """把已读出的文件头放回流前面，供 _copy 按顺序读取"""
+
+    def __init__(self, head: bytes, src):
+        self._head = head
+        self._src = src
+
+    def seek(self, offset):
+        if offset != 0:
+            raise ValueError("only rewinding to the start is supported")
+
+    def read(self, size: int = -1) -> bytes:
+        if self._head:
+            chunk, self._head = self._head, b""
+            return chunk
+        return self._src.read(size)
+
+
+async def save_upload(upload, target: Path, max_bytes: int = 0, hash_content: bool = False,
+                      sniff: bool = False):
+    """
+    把 UploadFile 保存到 target，返回 (size, sha256 或 None, 识别出的音频格式或 None)。
+    超过 max_bytes 返回 413；sniff=True 且文件头表明不是音频时返回 415。
+    """
+    fmt = None
+    if sniff:
+        head = await run_in_threadpool(_read_head, upload.file)
+        try:
+            fmt = sniff_audio(head)
+        except ValueError as e:
+            raise HTTPException(status_code=415, detail=str(e))
+    try:
+        size, digest = await run_in_threadpool(_copy, upload.file, Path(target), max_bytes, hash_content)
+    except UploadTooLarge:
+        raise _too_large(max_bytes)
+    return size, digest, fmt
+
+
+class UploadLimitMiddleware:
+    """
+    对指定路径的 POST 请求限制请求体大小（纯 ASGI 中间件，不缓冲请求体）。
+    limits 为 {路径谓词: 最大字节数}，谓词接收请求路径返回 bool。
+    """
+
+    def __init__(self, app, limits):
+        self.app = app
+        self.limits = limits
+
+    def _limit_for(self, path: str) -> int:
+        for matches, max_bytes in self.limits:
+            if max_bytes and matches(path):
+                return max_bytes
+        return 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return await self.app(scope, receive, send)
+        max_bytes = self._limit_for(scope["path"])
+        if not max_bytes:
+            return await self.app(scope, receive, send)
+
+        # multipart 的边界与表单字段有少量额外开销
+        allowed = max_bytes + 64 * 1024
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > allowed:
+            return await _reject(send, max_bytes)
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > allowed:
+                    # 在路由解析请求体时抛出，由 FastAPI 转为 413 响应，剩余请求体不再读取
+                    raise _too_large(max_bytes)
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except HTTPException as e:
+            if e.status_code != 413 or response_started:
+                raise
+            await _reject(send, max_bytes)
+
+
+def _too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"File exceeds the {max_bytes // (1024 * 1024)} MB limit")
+
+
+async def _reject(send, max_bytes: int):
+    body = ('{"detail":"%s"}' % _too_large(max_bytes).detail).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 413,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                    (b"connection", b"close")],
+    })
+    await send({"type": "http.response.body", "body": body})
+
@@ -1,85 +1,420 @@
+import os
 import time
+import socket
+import threading
+from datetime import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from sqlalchemy.orm import Session
 
 try:
-    from .db import SessionLocal, Task
-    from .config import RESULT_DIR
-    from .mtmt3_core.transcriber import run_mtmt3
+    from .db import SessionLocal, Task, claim_compatible_tasks, lease_held_by, lease_status, register_worker
+    from .config import (
+        RESULT_DIR, WORKER_PIPELINE, WORKER_INFERENCE_SLOTS,
+        WORKER_POSTPROCESS_PROCESSES, WORKER_MAX_PENDING_POSTPROCESS, TASK_LEASE_SECONDS,
+        WORKER_IDLE_POLL_SECONDS, WORKER_BATCH_TASKS, WORKER_REGISTER_SECONDS,
+    )
+    from .notify import get_listener
+    from .progress_writer import get_progress_writer
+    from .task_events import publish_task_updates
+    from .result_cache import cache_task_result
+    from .artifacts import precompress_results
+    from .storage import storage, StorageError
+    from .mtmt3_core.transcriber import run_mtmt3, run_mtmt3_batch, prewarm_models
+    from .mtmt3_core.postprocess import finalize_result
+    from .mtmt3_core.progress import TaskAborted
+    from .mtmt3_core.precision import check_default_precision
+    from .mtmt3_core.cpu_affinity import bind_current_process
+    from .mtmt3_core.capacity import ThroughputMeter, CapacityReporter
 except ImportError:
-    from backend.db import SessionLocal, Task
-    from backend.config import RESULT_DIR
-    from backend.mtmt3_core.transcriber import run_mtmt3
+    from backend.db import SessionLocal, Task, claim_compatible_tasks, lease_held_by, lease_status, register_worker
+    from backend.config import (
+        RESULT_DIR, WORKER_PIPELINE, WORKER_INFERENCE_SLOTS,
+        WORKER_POSTPROCESS_PROCESSES, WORKER_MAX_PENDING_POSTPROCESS, TASK_LEASE_SECONDS,
+        WORKER_IDLE_POLL_SECONDS, WORKER_BATCH_TASKS, WORKER_REGISTER_SECONDS,
+    )
+    from backend.notify import get_listener
+    from backend.progress_writer import get_progress_writer
+    from backend.task_events import publish_task_updates
+    from backend.result_cache import cache_task_result
+    from backend.artifacts import precompress_results
+    from backend.storage import storage, StorageError
+    from backend.mtmt3_core.transcriber import run_mtmt3, run_mtmt3_batch, prewarm_models
+    from backend.mtmt3_core.postprocess import finalize_result
+    from backend.mtmt3_core.progress import TaskAborted
+    from backend.mtmt3_core.precision import check_default_precision
+    from backend.mtmt3_core.cpu_affinity import bind_current_process
+    from backend.mtmt3_core.capacity import ThroughputMeter, CapacityReporter
 
 
-def update_progress(db: Session, task_id: str, progress: float, status: str = None):
-    """更新任务进度"""
-    task = db.query(Task).filter(Task.id == task_id).first()
-    if task:
-        task.progress = progress
-        if status:
-            task.status = status
-        task.touch()
-        db.commit()
-        db.refresh(task)
+# 本进程的 worker 标识，写入任务租约
+WORKER_ID = f"local-{socket.gethostname()}-{os.getpid()}"
 
 
-def process_one_task(db: Session):
-    task = (
+def update_progress(db: Session, task_id: str, progress: float):
+    """
+    更新任务进度并续约；任务已不属于本 worker 时抛出 TaskAborted。
+    租约只做读检查，写入由合并写线程批量提交（见 progress_writer.py）。
+    """
+    if lease_status(db, task_id, WORKER_ID) == "lost":
+        raise TaskAborted(f"lease lost for task {task_id}")
+    get_progress_writer().submit(task_id, WORKER_ID, progress)
+
+
+class LeaseKeeper:
+    """
+    后台线程定期为本进程持有的任务续约。
+    推理单批耗时较长或任务处于后处理阶段时没有进度上报，靠它保持租约。
+    """
+
+    def __init__(self, interval: float = TASK_LEASE_SECONDS / 3):
+        self.interval = interval
+        self._held = set()
+        self._lost = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def hold(self, task_id: str):
+        with self._lock:
+            self._held.add(task_id)
+            self._lost.discard(task_id)
+        self._ensure_started()
+
+    def release(self, task_id: str):
+        with self._lock:
+            self._held.discard(task_id)
+            self._lost.discard(task_id)
+
+    def lost(self, task_id: str) -> bool:
+        with self._lock:
+            return task_id in self._lost
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="lease-keeper", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                held = list(self._held)
+            if not held:
+                continue
+            db = SessionLocal()
+            try:
+                writer = get_progress_writer()
+                for task_id in held:
+                    if lease_status(db, task_id, WORKER_ID) == "lost":
+                        print(f"[worker] lease lost task={task_id}")
+                        with self._lock:
+                            self._lost.add(task_id)
+                    else:
+                        writer.submit(task_id, WORKER_ID)
+            except Exception as e:
+                print(f"[worker] lease renewal failed: {e}")
+            finally:
+                db.close()
+
+
+lease_keeper = LeaseKeeper()
+
+
+def _progress_callback(task_id: str):
+    """使用回调函数更新进度"""
+    def progress_callback(stage: str, progress: float):
+        """进度回调函数"""
+        if lease_keeper.lost(task_id):
+            raise TaskAborted(f"lease lost for task {task_id}")
+        db_session = SessionLocal()
+        try:
+            update_progress(db_session, task_id, progress)
+        finally:
+            db_session.close()
+    return progress_callback
+
+
+# 实测处理速度，随能力信息定期登记到 workers 表
+throughput = ThroughputMeter()
+
+
+def _register(capabilities: dict):
+    db = SessionLocal()
+    try:
+        register_worker(db, WORKER_ID, **capabilities)
+    finally:
+        db.close()
+
+
+def start_capacity_reporter(slots: int) -> CapacityReporter:
+    reporter = CapacityReporter(_register, slots, throughput, WORKER_REGISTER_SECONDS)
+    reporter.start()
+    return reporter
+
+
+def _claim(db: Session, limit: int = 1):
+    """按本 worker 登记的能力领取任务（见 db.claim_preferences）"""
+    tasks = claim_compatible_tasks(db, limit, progress=0.05, worker_id=WORKER_ID)  # 5% - 开始处理
+    publish_task_updates([task.id for task in tasks])
+    return tasks
+
+
+def _run_task(task: Task, defer_postprocess: bool = False):
+    output_dir = RESULT_DIR / task.id
+    task_id = task.id
+    progress_callback = _progress_callback(task_id)
+    started = time.monotonic()
+
+    result = run_mtmt3(
+        audio_path=task.input_path,
+        model=task.model,
+        mode=task.mode,
+        quantization=task.quantization,
+        output_dir=str(output_dir),
+        progress_callback=progress_callback,
+        defer_postprocess=defer_postprocess,
+        precision=task.precision,
+    )
+    throughput.record(result.get("duration"), time.monotonic() - started)
+    print(f"[worker] task={task_id} model={result.get('model_name')} precision={result.get('precision')} "
+          f"model_load={result.get('model_load_seconds', 0.0):.2f}s")
+    return result
+
+
+def _finish(db: Session, task: Task, values: dict) -> bool:
+    """仅在本 worker 仍持有租约时写入最终状态"""
+    lease_keeper.release(task.id)
+    values = dict(values, updated_at=datetime.utcnow(), lease_expires_at=None)
+    updated = (
         db.query(Task)
-        .filter(Task.status == "queued")
-        .order_by(Task.created_at.asc())
-        .first()
+        .filter(Task.id == task.id, *lease_held_by(WORKER_ID))
+        .update({getattr(Task, k): v for k, v in values.items()}, synchronize_session=False)
     )
-    if not task:
+    db.commit()
+    if not updated:
+        print(f"[worker] lease lost, result discarded task={task.id}")
         return False
+    db.refresh(task)
+    publish_task_updates([task.id])
+    return True
 
-    task.status = "processing"
-    task.progress = 0.05  # 5% - 开始处理
-    task.touch()
-    db.commit()
 
+def _mark_done(db: Session, task: Task, result: dict):
+    # 先生成预压缩副本，任务对外可见为 done 时副本已就绪（也随结果缓存一起保存）
+    precompress_results(result["midi_path"], result["musicxml_path"])
     try:
-        output_dir = RESULT_DIR / task.id
-        
-        # 使用回调函数更新进度
-        def progress_callback(stage: str, progress: float):
-            """进度回调函数"""
-            db_session = SessionLocal()
-            try:
-                update_progress(db_session, task.id, progress, "processing")
-            finally:
-                db_session.close()
-        
-        result = run_mtmt3(
-            audio_path=task.input_path,
-            model=task.model,
-            mode=task.mode,
-            quantization=task.quantization,
-            output_dir=str(output_dir),
-            progress_callback=progress_callback,
+        # 对象存储后端同样保存一份结果（本地存储时为空操作）
+        for path in (result["midi_path"], result["musicxml_path"]):
+            storage.put_file(path)
+    except (StorageError, ValueError) as e:
+        print(f"[storage] result upload failed task={task.id}: {e}")
+    if _finish(db, task, {
+        "midi_path": result["midi_path"],
+        "musicxml_path": result["musicxml_path"],
+        "duration": result.get("duration"),
+        "note_count": result.get("note_count"),
+        "skipped_seconds": result.get("skipped_seconds"),
+        "status": "done",
+        "progress": 1.0,
+    }):
+        cache_task_result(task)
+
+
+def _mark_failed(db: Session, task: Task, error: Exception):
+    if isinstance(error, TaskAborted):
+        # 任务已被回收并可能由其他 worker 接手，不能改写其状态
+        lease_keeper.release(task.id)
+        print(f"[worker] task aborted={task.id}: {error}")
+        return
+    _finish(db, task, {"status": "failed", "error_message": str(error), "progress": 0.0})
+
+
+def process_task_batch(db: Session, limit: int = WORKER_BATCH_TASKS):
+    """
+    一次领取至多 limit 个参数相同的任务，分段混合打包进同一模型批次推理（适合大量短音频），
+    各任务的进度与结果仍分别写回；单个任务失败不影响同批的其他任务。
+    """
+    tasks = _claim(db, limit)
+    if not tasks:
+        return False
+    for task in tasks:
+        lease_keeper.hold(task.id)
+
+    first = tasks[0]
+    started = time.monotonic()
+    try:
+        results = run_mtmt3_batch(
+            [
+                {
+                    "audio_path": task.input_path,
+                    "output_dir": str(RESULT_DIR / task.id),
+                    "progress_callback": _progress_callback(task.id),
+                }
+                for task in tasks
+            ],
+            model=first.model,
+            mode=first.mode,
+            quantization=first.quantization,
+            precision=first.precision,
         )
+    except Exception as e:
+        results = [e] * len(tasks)
 
-        task.midi_path = result["midi_path"]
-        task.musicxml_path = result["musicxml_path"]
-        task.duration = result.get("duration")
-        task.note_count = result.get("note_count")
-        task.status = "done"
-        task.progress = 1.0
-        task.touch()
-        db.commit()
+    print(f"[worker] batch of {len(tasks)} tasks model={first.model} precision={first.precision}")
+    done = [r for r in results if not isinstance(r, Exception)]
+    throughput.record(sum(r.get("duration") or 0.0 for r in done), time.monotonic() - started, len(done))
+    for task, result in zip(tasks, results):
+        if isinstance(result, Exception):
+            _mark_failed(db, task, result)
+        else:
+            _mark_done(db, task, result)
+    return True
+
+
+def process_one_task(db: Session):
+    if WORKER_BATCH_TASKS > 1:
+        return process_task_batch(db)
+    tasks = _claim(db)
+    if not tasks:
+        return False
+    task = tasks[0]
+    lease_keeper.hold(task.id)
 
+    try:
+        result = _run_task(task)
+        _mark_done(db, task, result)
     except Exception as e:
-        task.status = "failed"
-        task.error_message = str(e)
-        task.progress = 0.0
-        task.touch()
-        db.commit()
+        _mark_failed(db, task, e)
 
     return True
 
 
+def _finish_postprocess(task_id: str, result: dict, future):
+    """后处理进程完成后回写任务状态（在线程池回调中执行，使用独立会话）"""
+    db = SessionLocal()
+    try:
+        task = db.query(Task).filter(Task.id == task_id).first()
+        if not task:
+            return
+        try:
+            stats = future.result()
+        except Exception as e:
+            print(f"[worker] postprocess failed task={task_id} error={e}")
+            _mark_failed(db, task, e)
+            return
+        _mark_done(db, task, dict(result, note_count=stats["note_count"]))
+        print(f"[worker] task done={task_id} notes={stats['note_count']}")
+    finally:
+        db.close()
+
+
+def process_one_task_pipelined(db: Session, post_pool, on_finished=None):
+    """
+    流水线模式处理一个任务：推理完成后把 MusicXML 转换与音符统计提交到后处理进程池，
+    立即返回，以便当前推理槽位开始下一个任务。任务在后处理结束前保持 processing。
+    """
+    tasks = _claim(db)
+    if not tasks:
+        return False
+    task = tasks[0]
+    lease_keeper.hold(task.id)
+
+    task_id = task.id
+    try:
+        result = _run_task(task, defer_postprocess=True)
+    except Exception as e:
+        _mark_failed(db, task, e)
+        if on_finished:
+            on_finished()
+        return True
+
+    if not result.get("postprocess_pending"):
+        _mark_done(db, task, result)
+        if on_finished:
+            on_finished()
+        return True
+
+    def _done(f):
+        try:
+            _finish_postprocess(task_id, result, f)
+        finally:
+            if on_finished:
+                on_finished()
+
+    try:
+        update_progress(db, task_id, 0.90)
+        future = post_pool.submit(finalize_result, result["midi_path"], result["musicxml_path"])
+    except Exception as e:
+        _mark_failed(db, task, e)
+        if on_finished:
+            on_finished()
+        return True
+
+    future.add_done_callback(_done)
+    return True
+
+
+def pipelined_worker_loop():
+    prewarm_models()
+    # spawn：子进程不继承已加载的模型与 PyTorch 线程池，只导入轻量的后处理模块
+    post_pool = ProcessPoolExecutor(
+        max_workers=WORKER_POSTPROCESS_PROCESSES,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+    # 限制等待后处理的任务数，避免推理远快于后处理时积压
+    backlog = threading.BoundedSemaphore(WORKER_MAX_PENDING_POSTPROCESS)
+    print(f"[worker] pipeline mode: inference_slots={WORKER_INFERENCE_SLOTS} "
+          f"postprocess_processes={WORKER_POSTPROCESS_PROCESSES}")
+    start_capacity_reporter(max(1, WORKER_INFERENCE_SLOTS))
+
+    wakeup = get_listener()
+
+    def inference_slot():
+        while True:
+            backlog.acquire()
+            since = wakeup.generation
+            db = SessionLocal()
+            try:
+                # 处理了任务时，由后处理完成回调释放 backlog
+                processed = process_one_task_pipelined(db, post_pool, on_finished=backlog.release)
+            except Exception as e:
+                print(f"[worker] inference slot error: {e}")
+                backlog.release()
+                time.sleep(1)
+                continue
+            finally:
+                db.close()
+            if not processed:
+                backlog.release()
+                # 空闲时阻塞等待新任务通知，超时后再查一次数据库兜底
+                wakeup.wait(since, WORKER_IDLE_POLL_SECONDS)
+
+    threads = [
+        threading.Thread(target=inference_slot, name=f"inference-{i}", daemon=True)
+        for i in range(max(1, WORKER_INFERENCE_SLOTS))
+    ]
+    for t in threads:
+        t.start()
+    try:
+        for t in threads:
+            t.join()
+    finally:
+        post_pool.shutdown(wait=True)
+
+
 def worker_loop():
+    check_default_precision()
+    if WORKER_PIPELINE:
+        pipelined_worker_loop()
+        return
+
+    prewarm_models()
+    start_capacity_reporter(max(1, WORKER_BATCH_TASKS))
+    wakeup = get_listener()
     while True:
+        # 先记下通知计数再查询，查询期间到达的通知不会丢失
+        since = wakeup.generation
         db = SessionLocal()
         try:
             processed = process_one_task(db)
@@ -87,8 +422,11 @@ def worker_loop():
             db.close()
 
         if not processed:
-            time.sleep(1)
+            # 空闲时阻塞等待新任务通知，超时后再查一次数据库兜底
+            wakeup.wait(since, WORKER_IDLE_POLL_SECONDS)
 
 
 if __name__ == "__main__":
+    # 由 supervisor 启动时绑定分配到的核心与线程数
+    bind_current_process()
     worker_loop()
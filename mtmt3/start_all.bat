@@ -14,9 +14,7 @@ echo.
 echo 正在启动API服务器和Worker...
 echo.
 
-start "API服务器" cmd /k "cd /d %~dp0 && ""%PYTHON_EXE%"" -m uvicorn backend.main:app --reload --port 8000"
-timeout /t 3 /nobreak >nul
-start "Worker" cmd /k "cd /d %~dp0 && ""%PYTHON_EXE%"" -m backend.worker"
+start "音乐转谱服务" cmd /k "cd /d %~dp0 && ""%PYTHON_EXE%"" -m backend.supervisor"
 
 echo.
 echo ========================================